@@ -0,0 +1,152 @@
+import itertools
+import json
+import os
+
+import flask
+import numpy as np
+import pandas as pd
+
+from omeinfo import LAT_LON_COLUMNS, Coalescer, MemoryTileCache, default_tile_cache, filter_locations, get_s3_point_data, stable_id_columns
+from resources import RESOURCES
+
+API = flask.Blueprint("api", __name__)
+
+API_BLOCK_ROWS = int(os.environ.get("OMEINFO_API_BLOCK_ROWS", 10000))
+#decoded tiles are kept in memory (OMEINFO_API_TILE_MEMORY, in MB) in front of the tile cache on disk
+API_TILE_CACHE = MemoryTileCache(int(os.environ.get("OMEINFO_API_TILE_MEMORY", 256)) * 1024 * 1024, backing = default_tile_cache())
+
+class APIError(Exception):
+    pass
+
+def location_columns(records):
+    #every location needs a sample and either latitude and longitude or a combined lat_lon field, checked
+    #before batching so a request without them gets a 400. the values are validated by filter_locations
+    if not all(isinstance(record, dict) for record in records):
+        raise APIError("every location must be a JSON object")
+    for record in records:
+        if "sample" not in record or not ({"latitude", "longitude"}.issubset(record) or any(column in record for column in LAT_LON_COLUMNS)):
+            raise APIError("every location must contain sample, latitude and longitude (or sample and lat_lon)")
+
+def annotate_requests(requests):
+    #the batch processing function: annotates the locations of every request at once and returns the NDJSON
+    #lines of each request, in the order they were sent. rejected locations are returned with their
+    #rejection_reason
+    url, (id_to_rurality, id_to_kg) = RESOURCES.current()
+    locations = [record for records in requests for record in records]
+    df = pd.DataFrame.from_records(locations)
+    bounds = np.cumsum([0] + [len(records) for records in requests])
+    user_columns = list(df.columns)
+    valid, rejected = filter_locations(df)
+    if len(valid):
+        valid = get_s3_point_data(valid, RESOURCES.version, user_url = url, rurality_def = id_to_rurality, kg_def = id_to_kg, coord_projection = "EPSG:4326",
+                                  tile_cache = API_TILE_CACHE, range_source_factory = RESOURCES.range_source_factory)
+        if "error" in valid.columns:
+            valid["error"] = valid["error"].map(lambda e: None if e is None or e != e else str(e))
+    df = stable_id_columns(pd.concat([valid, rejected]).sort_index())
+    if "rejection_reason" not in df.columns:
+        df["rejection_reason"] = None
+    #each location gets its own fields back, not those of other locations in the batch (e.g. no lat_lon:
+    #null for a location given as latitude and longitude). locations with the same fields are encoded together
+    added_columns = [column for column in df.columns if column not in user_columns or column in ("latitude", "longitude")]
+    groups = {}
+    for row, record in enumerate(locations):
+        groups.setdefault(frozenset(record), []).append(row)
+    lines = [None] * len(locations)
+    for keys, rows in groups.items():
+        columns = [column for column in user_columns if column in keys and column not in added_columns] + added_columns
+        encoded = df.iloc[rows][columns].to_json(orient = "records", lines = True, force_ascii = False, double_precision = 15).rstrip("\n").split("\n")
+        for row, line in zip(rows, encoded):
+            lines[row] = line
+    return ["".join(line + "\n" for line in lines[bounds[i]:bounds[i + 1]]) for i in range(len(requests))]
+
+#locations from concurrent requests arriving within OMEINFO_API_BATCH_WINDOW_MS of each other are annotated
+#together, so many small requests share one validation, one grouped tile read and one JSON encoding
+BATCHER = Coalescer(annotate_requests, window = float(os.environ.get("OMEINFO_API_BATCH_WINDOW_MS", 5)) / 1000,
+                    max_rows = int(os.environ.get("OMEINFO_API_BATCH_ROWS", 50000)), workers = int(os.environ.get("OMEINFO_API_WORKERS", 2)))
+
+def annotate_records(records):
+    location_columns(records)
+    return BATCHER.submit(records).result()
+
+def json_records(request):
+    #a JSON array of locations, {"locations": [...]} or a single location
+    try:
+        body = json.loads(request.get_data())
+    except ValueError:
+        raise APIError("the request body is not valid JSON")
+    if isinstance(body, dict):
+        body = body.get("locations", [body])
+    if not isinstance(body, list):
+        raise APIError("expected a list of locations")
+    return iter(body)
+
+def ndjson_records(request):
+    #one location per line, read from the request as it arrives
+    for number, line in enumerate(request.stream, start = 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            raise APIError(f"line {number} is not valid JSON")
+
+def blocks(records, size):
+    while True:
+        block = list(itertools.islice(records, size))
+        if not block:
+            return
+        yield block
+
+@API.route("/api/annotate", methods = ["POST"])
+def annotate():
+    #locations as JSON (a list of objects with sample, latitude and longitude, or lat_lon) or NDJSON (one
+    #object per line), annotated a block at a time and streamed back as NDJSON in the order they were sent
+    request = flask.request
+    if request.mimetype in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        records = ndjson_records(request)
+    else:
+        try:
+            records = json_records(request)
+        except APIError as e:
+            return flask.jsonify({"error": str(e)}), 400
+    records = blocks(records, API_BLOCK_ROWS)
+    #the first block is annotated before the response starts, so a bad request gets a 400 status. later
+    #failures can only end the stream with an {"error": ...} line
+    try:
+        first = next(records, [])
+        first = annotate_records(first) if first else ""
+        following = next(records, None)
+    except APIError as e:
+        return flask.jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return flask.jsonify({"error": str(e)}), 500
+    if following is None:
+        #a single block (most requests) is sent as it is
+        return flask.Response(first, mimetype = "application/x-ndjson")
+
+    def generate():
+        yield first
+        try:
+            yield annotate_records(following)
+            for block in records:
+                yield annotate_records(block)
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+    return flask.Response(flask.stream_with_context(generate()), mimetype = "application/x-ndjson")
+
+@API.route("/api/annotate", methods = ["GET"])
+def annotate_location():
+    #a single location from the query string (?sample=...&latitude=...&longitude=..., or lat_lon), answered
+    #with one JSON object. lookups from concurrent callers are batched like any other request
+    try:
+        line = annotate_records([flask.request.args.to_dict()])
+    except APIError as e:
+        return flask.jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return flask.jsonify({"error": str(e)}), 500
+    return flask.Response(line, mimetype = "application/json")
+
+@API.route("/api/status", methods = ["GET"])
+def status():
+    return flask.jsonify({"data_packet": RESOURCES.status(), "batches": BATCHER.batches, "requests": BATCHER.requests})
@@ -1,9 +1,13 @@
 import base64
 import datetime
 import io
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
 import plotly.graph_objs as go
 import plotly.express as px
-from io import StringIO
 import dash
 from dash.dependencies import Input, Output, State
 from dash import dcc
@@ -11,11 +15,18 @@ from dash import html
 from dash import dash_table
 import dash_bootstrap_components as dbc
 
+import flask
+import numpy as np
 import pandas as pd
 import requests
 
 import os
-from omeinfo import get_s3_point_data
+from omeinfo import filter_locations, get_s3_point_data
+from result_store import RESULT_STORE, upload_key
+from jobs import JOBS
+from api import API
+from uploads import UPLOADS, UploadError
+from resources import RESOURCES
 
 import dash_loading_spinners as dls
 
@@ -29,7 +40,6 @@ external_stylesheets = [dbc.themes.BOOTSTRAP, "assets/dbc.min.css"]
 APP_VERSION = "1.1.0"
 LOGO_BASE64 = base64.b64encode(open("assets/logos/logo_brand.png", 'rb').read()).decode('ascii')
 OMEINFO_DATA_VERSION = os.environ.get('OMEINFO_VERSION', "2.0.0")
-OMEINFO_URL = os.environ.get('OMEINFO_URL', None)
 
 version_info = {"1.0.0" : {"data_list_group" : dbc.ListGroup([dbc.ListGroupItem("Open-source Data Inventory for Anthropogenic CO2"), dbc.ListGroupItem("Global Human Settlement Layer (European Commission)"), dbc.ListGroupItem("Sentinel 5p Satellite (European Space Agency)"), dbc.ListGroupItem("Beck et al. (2018)")]),
                            "data_info" : {"Rurality" : {"comment" : "Rurality is determined using the Global Human Settlement Layer, and provides a global coverage for rurality, in line with the UN’s Global Definition of Cities and Rural Areas, at 1km resolution.", "source" : '<a href="https://ghsl.jrc.ec.europa.eu/">Global Human Settlement Layer (R2019A)</a>', "value" : "rurality", "title": "Rurality", "filepath": "assets/rurality.html"},
@@ -65,6 +75,11 @@ navbar = html.Div(dbc.NavbarSimple(
 ))
 
 app = dash.Dash(__name__, suppress_callback_exceptions=True, external_stylesheets = external_stylesheets)
+#the REST annotation API, served alongside the app
+app.server.register_blueprint(API)
+#started by the first request rather than in __main__, so servers that import app (gunicorn app:server) load them too
+app.server.before_request(RESOURCES.start)
+server = app.server
 
 app.layout = dbc.Container([
     dcc.Location(id='url', refresh=False),
@@ -187,6 +202,14 @@ tabs = dbc.Tabs(
         dbc.Tab(tab3_content, label="Table"),
     ])
 
+UPLOAD_STYLE = {
+    'align-items' : 'center',
+    'borderWidth': '1px',
+    'borderStyle': 'dashed',
+    'borderRadius': '5px',
+    'textAlign': 'center',
+    'margin': '10px 0'}
+
 page_1_layout = [dbc.Row(dbc.Col(navbar)),
             dbc.Row(
                 dbc.Col(
@@ -194,14 +217,18 @@ page_1_layout = [dbc.Row(dbc.Col(navbar)),
                         id='upload-data', 
                         children= html.Div(["Drag and Drop or ", dcc.Link("Select Files", href = "")], id = "upload-link",
                         style ={"font-size": 'vi'}), multiple=True,
-                        style={
-                            'align-items' : 'center',
-                            'borderWidth': '1px',
-                            'borderStyle': 'dashed',
-                            'borderRadius': '5px',
-                            'textAlign': 'center',
-                            'margin': '10px 0'}
+                        style=UPLOAD_STYLE
                             )), justify = "center"),
+            dbc.Row(
+                dbc.Col(
+                    html.Div(
+                        [
+                            dbc.Progress(id="job_progress", value=0, striped=True, animated=True, style={'height': '20px'}),
+                            html.P(id="job_progress_text", style={'padding': '10px 0px 0px 0px'}),
+                            dbc.Button("Cancel", id="cancel_job", color="secondary", size="sm")
+                        ],
+                        id="job_status", style={'display': 'none'}),
+                    style={'textAlign': 'center', 'padding': '10px'}), justify = "center"),
                         
             dbc.Row(dbc.Col(html.Div(id ="map_fill", style = {'padding' : '10px'}))),
             dbc.Row(
@@ -223,7 +250,10 @@ page_1_layout = [dbc.Row(dbc.Col(navbar)),
                         style={'padding': '10px 10px 10px 10px'}, width = True), justify = "center"),
             
             dbc.Row(dbc.Col(version_card, style={'textAlign': 'center', 'margin': '10px'}, width = True), justify = "center"),
-            dcc.Store(id="df_store")
+            dcc.Store(id="df_store"),
+            dcc.Store(id="job_store"),
+            dcc.Store(id="upload_job"),
+            dcc.Interval(id="job_poll", interval=1000, disabled=True)
         ]
 
 data_card = dbc.Card(
@@ -283,31 +313,181 @@ explore_page_layout = [dbc.Row([dbc.Col(navbar, style={'textAlign': 'center', 'm
     ]),
     dbc.Row(dbc.Col(version_card, style={'textAlign': 'center', 'margin': '10px'}, width = True), justify = "center")]
 
-def parse_data(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+PARTIAL_RESULT_SECONDS = int(os.environ.get("OMEINFO_PARTIAL_SECONDS", 5))
+
+def count_rows(path, block_size = 1024 * 1024):
+    #number of lines after the header, for progress only (quoted line breaks are counted too)
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return max(lines - (last == b"\n"), 0)
+
+def finish_results(annotated, rejected):
+    #rejected rows are listed after the annotated ones with the reason, their coordinates are left out of the map
+    df = pd.concat(annotated, ignore_index = True) if annotated else pd.DataFrame()
+    if rejected:
+        df = pd.concat([df] + [rejected_df.drop(columns = ["latitude", "longitude"], errors = "ignore") for rejected_df in rejected], ignore_index = True)
+    for col in df.columns:
+        if df[col].isna().all():
+            df = df.drop(columns=[col])
+    return df
 
+def parse_upload(path, filename, progress = None, publish = None):
+    #reads the uploaded file from disk and annotates it a block of rows at a time, so only the results are
+    #held in memory. progress, if given, is called with (rows read, total rows) after every block, and
+    #publish with the results so far every PARTIAL_RESULT_SECONDS
+    if filename.endswith('.csv'):
+        delimiter = ','
+    elif filename.endswith('.tsv'):
+        delimiter = '\t'
+    else:
+        raise ValueError('There was an error processing this file.')
+    rows_total = count_rows(path)
+    #annotated in blocks so that progress can be reported and the job cancelled part way
+    block_size = max(5000, math.ceil(rows_total / 50))
+    annotated, rejected = [], []
+    rows_done = 0
+    legends = None
+    published = time.time()
+    published_rows = 0
     try:
-        if filename.endswith('.csv'):
-            delimiter = ','
-        elif filename.endswith('.tsv'):
-            delimiter = '\t'
-            
-        df = pd.read_csv(
-            StringIO(decoded.decode('utf-8')), sep = delimiter)
-    except Exception as e: #there needs to be a new exception here as this is not displaying a div
-        return html.Div([
-            'There was an error processing this file.'
-        ])
-    if 'latitude' and 'longitude' in df.columns:
-        rurality_definitions = pd.read_csv("rurality_legend.txt", sep = "\t")
-        rurality_definitions["id"] = rurality_definitions["id"].astype("str")
-        kg_definitions = pd.read_csv("kg_legend.txt", sep = "\t")
-        kg_definitions["id"] = kg_definitions["id"].astype("str")
-        id_to_rurality = rurality_definitions.set_index('id')['definition'].to_dict()
-        id_to_kg = kg_definitions.set_index('id')['definition'].to_dict()
-        df = get_s3_point_data(df, OMEINFO_DATA_VERSION, user_url = OMEINFO_URL, rurality_def = id_to_rurality, kg_def = id_to_kg, coord_projection="EPSG:4326")
-    return df
+        reader = pd.read_csv(path, sep = delimiter, chunksize = block_size)
+    except Exception as e:
+        raise ValueError('There was an error processing this file.')
+    while True:
+        if progress:
+            progress(min(rows_done, rows_total), rows_total)
+        try:
+            chunk = next(reader, None)
+        except Exception as e:
+            raise ValueError('There was an error processing this file.')
+        if chunk is None:
+            break
+        rows_done += len(chunk)
+        df, rejected_df = filter_locations(chunk)
+        if len(df):
+            if legends is None:
+                #legends and the data packet header are kept warm by RESOURCES instead of being read for every upload
+                url, legends = RESOURCES.current()
+            id_to_rurality, id_to_kg = legends
+            annotated.append(get_s3_point_data(df, OMEINFO_DATA_VERSION, user_url = url, rurality_def = id_to_rurality, kg_def = id_to_kg, coord_projection="EPSG:4326",
+                                               range_source_factory = RESOURCES.range_source_factory))
+        if len(rejected_df):
+            rejected.append(rejected_df)
+        #every publish writes all results so far, waiting until they have grown by half since the last one
+        #keeps the rows written over a whole job within a small multiple of its size
+        if publish and annotated and time.time() - published > PARTIAL_RESULT_SECONDS and rows_done >= 1.5 * published_rows:
+            publish(finish_results(annotated, rejected))
+            published, published_rows = time.time(), rows_done
+    if progress:
+        progress(rows_total, rows_total)
+    return finish_results(annotated, rejected)
+
+def annotation_job(job, key, upload_id, filename):
+    #runs on a JOBS worker thread. results so far are published to RESULT_STORE as the file is annotated,
+    #the complete result is picked up from RESULT_STORE once the job is done
+    def publish(df):
+        partial_key = f"{key}-partial-{len(df)}"
+        RESULT_STORE.put(partial_key, df, summary = summarise_results(df))
+        if job.partial:
+            RESULT_STORE.discard(job.partial)
+        job.partial = partial_key
+
+    try:
+        df = parse_upload(UPLOADS.path(upload_id), filename, job.progress, publish)
+        RESULT_STORE.put(key, df, summary = summarise_results(df))
+    except KeyError as e:
+        raise ValueError(e.args[0])
+    finally:
+        UPLOADS.discard(upload_id)
+        if job.partial:
+            RESULT_STORE.discard(job.partial)
+            job.partial = None
+
+def contents_job(job, key, contents, filename):
+    #files from dcc.Upload arrive whole and base64 encoded, they are written to disk and then annotated like
+    #a chunked upload
+    content_type, content_string = contents.split(',')
+    upload = UPLOADS.write_bytes(filename, base64.b64decode(content_string))
+    annotation_job(job, key, upload["upload_id"], filename)
+
+def job_progress_text(status):
+    if status["state"] == "queued":
+        return "Waiting for a free worker..."
+    if status["state"] == "cancelled":
+        return "Annotation cancelled."
+    if status["state"] == "failed":
+        return f"Annotation failed: {status['message']}"
+    if not status["rows_total"]:
+        return "Reading file..."
+    text = f"Annotated {status['rows_done']} of {status['rows_total']} samples"
+    if status["eta_seconds"] is not None:
+        text += f", about {math.ceil(status['eta_seconds'])} seconds remaining"
+    return text
+
+@app.server.route("/health")
+def health():
+    #checks the data packet now, 503 if it cannot be loaded
+    RESOURCES.check()
+    status = RESOURCES.status()
+    return flask.jsonify(status), 200 if status["status"] == "ok" else 503
+
+@app.server.route("/jobs/<job_id>")
+def job_status(job_id):
+    status = JOBS.status(job_id)
+    if status is None:
+        return flask.jsonify({"error": "unknown job"}), 404
+    return flask.jsonify(status)
+
+@app.server.route("/jobs/<job_id>/cancel", methods = ["POST"])
+def cancel_job(job_id):
+    if not JOBS.cancel(job_id):
+        return flask.jsonify({"error": "unknown job"}), 404
+    return flask.jsonify(JOBS.status(job_id))
+
+@app.server.errorhandler(UploadError)
+def upload_error(e):
+    return flask.jsonify({"error": str(e)}), e.status
+
+@app.server.route("/uploads", methods = ["POST"])
+def create_upload():
+    #starts a chunked upload: {"filename": ..., "size": ...} -> {"upload_id": ..., "received": 0, ...}
+    request = flask.request.get_json(silent = True) or {}
+    try:
+        size = int(request.get("size"))
+    except (TypeError, ValueError):
+        size = None
+    return flask.jsonify(UPLOADS.create(request.get("filename"), size)), 201
+
+@app.server.route("/uploads/<upload_id>", methods = ["GET"])
+def upload_status(upload_id):
+    #how much of the file the server has, an interrupted upload carries on from "received"
+    return flask.jsonify(UPLOADS.status(upload_id))
+
+@app.server.route("/uploads/<upload_id>", methods = ["PATCH"])
+def upload_chunk(upload_id):
+    #the request body is appended at the Upload-Offset header, 409 (with the expected offset) if that is not
+    #the number of bytes received so far
+    try:
+        offset = int(flask.request.headers.get("Upload-Offset"))
+    except (TypeError, ValueError):
+        raise UploadError("the Upload-Offset header is needed")
+    return flask.jsonify(UPLOADS.write(upload_id, offset, flask.request.stream))
+
+@app.server.route("/uploads/<upload_id>/complete", methods = ["POST"])
+def complete_upload(upload_id):
+    #starts annotating a fully received upload, poll /jobs/<job_id> for progress
+    record = UPLOADS.status(upload_id)
+    job_id = upload_key(UPLOADS.digest(upload_id), record["filename"], OMEINFO_DATA_VERSION, RESOURCES.url, sorted(RESOURCES.identity.items()))
+    status = JOBS.status(job_id)
+    if job_id in RESULT_STORE or (status is not None and status["state"] in ("queued", "running")):
+        UPLOADS.discard(upload_id)
+    else:
+        JOBS.submit(job_id, annotation_job, job_id, upload_id, record["filename"])
+    return flask.jsonify({"job_id": job_id, "filename": record["filename"]})
 
 @app.callback(
     [
@@ -317,47 +497,154 @@ def parse_data(contents, filename):
         Output('download_button_df', 'style'),
         Output('upload-data', 'style'),
         Output('upload-link', 'style'),
-        Output('download_button', 'style')
+        Output('download_button', 'style'),
+        Output('job_store', 'data'),
+        Output('job_poll', 'disabled'),
+        Output('job_status', 'style'),
+        Output('job_progress', 'value'),
+        Output('job_progress_text', 'children')
     ],
     [
         Input('upload-data', 'contents'),
-        Input('upload-data', 'filename')
+        Input('job_poll', 'n_intervals'),
+        Input('cancel_job', 'n_clicks'),
+        Input('upload_job', 'data')
+    ],
+    [
+        State('upload-data', 'filename'),
+        State('job_store', 'data'),
+        State('df_store', 'data')
     ],
     prevent_initial_call=True
 )
-def compute_dataframe(contents, filename):
-    # Initialize is_loading to False
+def compute_dataframe(contents, n_intervals, cancel_clicks, upload_job, filename, job_id, shown_key):
+    #uploads are annotated by a background job, this callback starts the job (or picks up the job of a
+    #chunked upload from upload_job) and is then polled by job_poll to show its progress and the results so
+    #far, until the result is in RESULT_STORE
     is_loading = False
-
-    if contents:
+    hidden = {'display': 'none'}
+    tabs_style = {'display': 'block', 'padding': '10px'}
+    button_style = {'display': 'block', 'padding': '10px', 'text-align': 'center', 'justify-content': 'center', 'align-items': 'center'}
+    download_button_style = {'display': 'block', 'padding': '10px', 'text-align': 'center', 'justify-content': 'center', 'align-items': 'center'}
+
+    trigger = dash.callback_context.triggered_id
+    if trigger == 'cancel_job' and job_id:
+        JOBS.cancel(job_id)
+    elif trigger == 'upload-data':
+        if not contents:
+            return [dash.no_update] * 12
         contents = contents[0]
         filename = filename[0]
-        
-        # Set is_loading to True while processing
-        is_loading = True
-
-        df = parse_data(contents, filename)
-
-        for col in df.columns:
-            if df[col].isna().all():
-                df = df.drop(columns=[col])
-        data = df.to_json()
-        
-        # Set is_loading back to False when done
-        is_loading = False
-
-    # Conditionally set style properties to make tabs and button visible
-        tabs_style = {'display': 'block', 'padding': '10px'}
-        button_style = {'display': 'block', 'padding': '10px', 'text-align': 'center', 'justify-content': 'center', 'align-items': 'center'}
-        upload_data_style = {'display': 'none'}
-        download_button_style = {'display': 'block', 'padding': '10px', 'text-align': 'center', 'justify-content': 'center', 'align-items': 'center'}
-
+        #the annotated table stays on the server, the browser only gets its key
+        job_id = upload_key(contents, filename, OMEINFO_DATA_VERSION, RESOURCES.url, sorted(RESOURCES.identity.items()))
+        if job_id not in RESULT_STORE:
+            JOBS.submit(job_id, contents_job, job_id, contents, filename)
+    elif trigger == 'upload_job':
+        if not upload_job:
+            return [dash.no_update] * 12
+        job_id = upload_job["job_id"]
+
+    status = JOBS.status(job_id)
+    if job_id in RESULT_STORE and (status is None or status["state"] == "done"):
+        return job_id, is_loading, tabs_style, button_style, hidden, hidden, download_button_style, job_id, True, hidden, 100, ""
+    if status is None:
+        status = {"state": "failed", "message": "the job was lost, please upload the file again"}
+    if status["state"] in ("queued", "running"):
+        value = 100 * status["rows_done"] / status["rows_total"] if status["rows_total"] else 0
+        if status["partial"]:
+            #the plots, map and table follow the results so far, downloads wait for the complete result
+            partial_key = status["partial"] if status["partial"] != shown_key else dash.no_update
+            return partial_key, is_loading, tabs_style, hidden, hidden, hidden, hidden, job_id, False, {'display': 'block'}, value, job_progress_text(status)
+        return dash.no_update, is_loading, hidden, hidden, hidden, hidden, hidden, job_id, False, {'display': 'block'}, value, job_progress_text(status)
+    #failed or cancelled, the upload box is shown again
+    return dash.no_update, is_loading, hidden, hidden, UPLOAD_STYLE, {"font-size": 'vi'}, hidden, None, True, {'display': 'block'}, 0, job_progress_text(status)
+
+MAP_POINT_LIMIT = int(os.environ.get("OMEINFO_MAP_POINTS", 20000))
+
+def hover_text(df):
+    #built a column at a time rather than a row at a time
+    columns = [col for col in df.columns if col not in ['latitude', 'longitude', 'rurality_id', 'koppen_geiger_id']]
+    text = pd.Series("", index = df.index)
+    for i, col in enumerate(columns):
+        text = text + ("<br>" if i else "") + f"{col}: " + np.asarray(df[col], dtype = object).astype(str)
+    return text
+
+def map_clusters(df, val, cell):
+    #one marker per grid cell of cell degrees, placed at the mean position of its samples and coloured by
+    #their mean value (or most common class for the categorical ids)
+    cells = pd.DataFrame({"x": np.floor(df["longitude"].to_numpy() / cell), "y": np.floor(df["latitude"].to_numpy() / cell)}, index = df.index)
+    grouped = df[["latitude", "longitude"]].groupby([cells["x"], cells["y"]])
+    clusters = grouped.mean()
+    clusters["count"] = grouped.size()
+    if val in ["rurality_id", "koppen_geiger_id"]:
+        counts = df[val].groupby([cells["x"], cells["y"], df[val]]).size().rename("n").sort_values(ascending = False)
+        clusters["value"] = counts.reset_index(level = 2).groupby(level = [0, 1])[val].first()
+        label = "most common"
     else:
-        data = dash.no_update  # No data update, keep the previous value
-        tabs_style = {'display': 'none'}  # Hide tabs
-        button_style = {'display': 'none'}  # Hide button
+        clusters["value"] = df[val].groupby([cells["x"], cells["y"]]).mean()
+        label = "mean"
+    clusters["text"] = clusters["count"].astype(str) + f" samples<br>{val} ({label}): " + clusters["value"].round(3).astype(str)
+    return clusters
+
+def map_figure(df, val, zoom = 2, center = None, bounds = None):
+    #all samples are drawn up to MAP_POINT_LIMIT, beyond that samples are clustered on a grid that gets
+    #finer as the map is zoomed in. once few enough samples are in view (bounds = (west, south, east,
+    #north)) they are drawn individually again
+    df = df[np.isfinite(df["latitude"]) & np.isfinite(df["longitude"])]
+    if center is None:
+        center = dict(lat=df["latitude"].head(1).iloc[0], lon=df["longitude"].head(1).iloc[0]) if len(df) else dict(lat=0, lon=0)
+    in_view = df
+    if bounds is not None and len(df) > MAP_POINT_LIMIT:
+        west, south, east, north = bounds
+        in_longitude = (df["longitude"] >= west) & (df["longitude"] <= east) if west <= east else (df["longitude"] >= west) | (df["longitude"] <= east)
+        in_view = df[in_longitude & (df["latitude"] >= south) & (df["latitude"] <= north)]
+    if len(in_view) <= MAP_POINT_LIMIT:
+        trace = go.Scattermapbox(
+            lat=in_view["latitude"],
+            lon=in_view["longitude"],
+            hovertext=hover_text(in_view),
+            marker=dict(
+                size=10,  # Adjust the size of the markers
+                color=in_view[val],
+            ),
+        )
+    else:
+        cell = 22.5 / 2 ** max(zoom, 0)
+        clusters = map_clusters(in_view, val, cell)
+        while len(clusters) > MAP_POINT_LIMIT:
+            cell *= 2
+            clusters = map_clusters(in_view, val, cell)
+        trace = go.Scattermapbox(
+            lat=clusters["latitude"],
+            lon=clusters["longitude"],
+            hovertext=clusters["text"],
+            marker=dict(
+                size=np.clip(6 + 3 * np.log2(clusters["count"]), 6, 40),
+                color=clusters["value"],
+            ),
+        )
+    fig = go.Figure(trace)
+
+    fig.update_layout(
+        mapbox=dict(
+            style="open-street-map",  # Choose the desired mapbox style
+            center=center,  # Set the initial center of the map
+            zoom=zoom  # Set the initial zoom level of the map
+        ),
+        margin=dict(l=0, r=0, b=0, t=0),
+        autosize=True,
+        paper_bgcolor='rgba(0, 0, 0, 0)',
+        plot_bgcolor='rgba(0, 0, 0, 0)',
+        uirevision=val  # keep the user's view when the detail is redrawn
+    )
+    return fig
 
-    return data, is_loading, tabs_style, button_style, upload_data_style, upload_data_style, download_button_style
+def map_value_column(val):
+    if val == "Koppen Geiger":
+        return "koppen_geiger_id"
+    elif val == "Rurality":
+        return "rurality_id"
+    return val
 
 @app.callback(Output('Sample_Location', 'children'),
             [
@@ -365,44 +652,17 @@ def compute_dataframe(contents, filename):
                 Input('map_fill', 'value')
             ],
             prevent_initial_call=True)
-def update_map(df, val):
-    if df and not val == None:
+def update_map(key, val):
+    df = RESULT_STORE.get(key)
+    if df is not None and not val == None:
 
         comment = version_info[OMEINFO_DATA_VERSION]["data_info"][val]["comment"]
 
-        if val == "Koppen Geiger":
-            val = "koppen_geiger_id"
-        elif val == "Rurality":
-            val = "rurality_id"
-
-        df = pd.read_json(StringIO(df))
         df['Rurality'] = df['Rurality'].astype('category')
         df['Koppen Geiger'] = df['Koppen Geiger'].astype('category')
-        hover_text = df[[col for col in df.columns if col not in ['latitude', 'longitude', 'rurality_id', 'koppen_geiger_id']]].apply(lambda row: '<br>'.join([f"{col}: {row[col]}" for col in row.index]), axis=1)
-        
-        fig = go.Figure(go.Scattermapbox(
-            lat=df["latitude"],
-            lon=df["longitude"],
-            hovertext=hover_text,
-            marker=dict(
-                size=10,  # Adjust the size of the markers
-                color=df[val],
-            ),
-        ))
-
-        fig.update_layout(
-            mapbox=dict(
-                style="open-street-map",  # Choose the desired mapbox style
-                center=dict(lat=df["latitude"].head(1)[0], lon=df["longitude"].head(1)[0]),  # Set the initial center of the map
-                zoom=2  # Set the initial zoom level of the map
-            ),
-            margin=dict(l=0, r=0, b=0, t=0),
-            autosize=True,
-            paper_bgcolor='rgba(0, 0, 0, 0)',
-            plot_bgcolor='rgba(0, 0, 0, 0)'
-        )
+        fig = map_figure(df, map_value_column(val))
 
-        map_output = dcc.Graph(figure=fig)
+        map_output = dcc.Graph(id='map_graph', figure=fig)
 
         card_content = [
             dbc.CardBody(
@@ -417,27 +677,92 @@ def update_map(df, val):
 
     return card_content
 
+@app.callback(Output('map_graph', 'figure'),
+            [
+                Input('map_graph', 'relayoutData')
+            ],
+            [
+                State('df_store', 'data'),
+                State('map_fill', 'value')
+            ],
+            prevent_initial_call=True)
+def update_map_detail(relayout, key, val):
+    #redraws large sample sets for the part of the map in view when it is zoomed or moved
+    if not relayout or "mapbox.zoom" not in relayout or val == None:
+        return dash.no_update
+    df = RESULT_STORE.get(key)
+    if df is None or len(df) <= MAP_POINT_LIMIT:
+        return dash.no_update
+    bounds = None
+    corners = relayout.get("mapbox._derived", {}).get("coordinates")
+    if corners:
+        #corners run clockwise from the north west, longitudes are not wrapped to -180..180
+        west, east = corners[0][0], corners[1][0]
+        latitudes = [corner[1] for corner in corners]
+        if east - west < 360:
+            #a view across the antimeridian ends up with west > east, which map_figure handles
+            bounds = ((west + 180) % 360 - 180, min(latitudes), (east + 180) % 360 - 180, max(latitudes))
+    return map_figure(df, map_value_column(val), zoom = relayout["mapbox.zoom"], center = relayout.get("mapbox.center"), bounds = bounds)
+
+CATEGORICAL_VARIABLES = ["Rurality", "Koppen Geiger"]
+
+def summarise_results(df):
+    #the aggregates behind the histograms, computed once when a result is stored: counts per category, and
+    #binned counts for continuous variables
+    histograms = {}
+    for variable in version_info[OMEINFO_DATA_VERSION]["data_info"]:
+        if variable not in df.columns:
+            continue
+        values = df[variable].dropna()
+        if variable in CATEGORICAL_VARIABLES:
+            counts = values.astype(str).value_counts(sort = False)
+            histograms[variable] = {"categories": counts.index.tolist(), "counts": counts.tolist()}
+        else:
+            values = values.to_numpy(dtype = "float64")
+            values = values[np.isfinite(values)]
+            if len(values) == 0:
+                continue
+            edges = np.histogram_bin_edges(values, bins = "auto")
+            if len(edges) > 101:
+                edges = np.histogram_bin_edges(values, bins = 100)
+            counts, edges = np.histogram(values, bins = edges)
+            histograms[variable] = {"edges": edges.tolist(), "counts": counts.tolist()}
+    return {"rows": len(df), "histograms": histograms}
+
+def result_summary(key):
+    #results stored without a summary get one the first time it is needed
+    summary = RESULT_STORE.get_summary(key)
+    if summary is None:
+        df = RESULT_STORE.get(key)
+        if df is None:
+            return None
+        summary = summarise_results(df)
+        RESULT_STORE.put_summary(key, summary)
+    return summary
+
 @app.callback(Output('bar', 'children'),
             [
                 Input('df_store', 'data'),
                 Input('map_fill', 'value')
             ],
             prevent_initial_call=True)
-def update_bar(df, val):
-    if df and not val == None:
+def update_bar(key, val):
+    summary = result_summary(key)
+    if summary is not None and not val == None:
         comment = html.P(version_info[OMEINFO_DATA_VERSION]["data_info"][val]["comment"],className="card-text")
 
-        df = pd.read_json(StringIO(df))
-        df['Rurality'] = df['Rurality'].astype('category')
-        if val not in ["Population Density", "Fossil Fuel CO2 emissions", "Tropospheric Nitrogen Dioxide Emissions", "Relative Deprivation"]:
-            fig = px.histogram(df,
-                        x=df[val],
-                        hover_name="sample",
-                        color = df[val])
+        histogram = summary["histograms"].get(val, {"counts": [], "categories": [], "edges": [0]})
+        if val in CATEGORICAL_VARIABLES:
+            fig = px.bar(x=histogram["categories"],
+                        y=histogram["counts"],
+                        color=histogram["categories"],
+                        labels={"x": val, "y": "count"})
         else:
-            fig = px.histogram(df,
-                        x=df[val],
-                        hover_name="sample")
+            edges = np.array(histogram["edges"])
+            fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2,
+                        y=histogram["counts"],
+                        width=np.diff(edges)))
+            fig.update_layout(bargap=0, xaxis_title=val, yaxis_title="count")
         if val == "Rurality" or val == "Koppen Geiger":
             fig.update_xaxes(type = "category")
         fig.update_layout(go.Layout(
@@ -460,25 +785,99 @@ def update_bar(df, val):
         
     return card_content
 
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+def split_filter_part(filter_part):
+    #one "{column} operator value" part of a DataTable filter query
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                quote = value_part[0] if value_part else ''
+                if quote and quote == value_part[-1] and quote in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + quote, quote)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+def filter_rows(df, filter_query):
+    for filter_part in (filter_query or "").split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name not in df.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            try:
+                df = df.loc[getattr(df[name], operator)(value)]
+            except TypeError:
+                df = df.loc[getattr(df[name].astype(str), operator)(str(value))]
+        elif operator == 'contains':
+            df = df.loc[df[name].astype(str).str.contains(str(value), regex = False, na = False)]
+        elif operator == 'datestartswith':
+            df = df.loc[df[name].astype(str).str.startswith(str(value), na = False)]
+    return df
+
+TABLE_VIEWS = OrderedDict()
+#callbacks run on several server threads at once
+TABLE_VIEWS_LOCK = threading.Lock()
+
+def table_view(key, df, sort_by, filter_query):
+    #row order of a filtered and sorted table, kept for the last few tables so that paging through
+    #them only slices
+    view_key = (key, json.dumps(sort_by or []), filter_query or "")
+    with TABLE_VIEWS_LOCK:
+        if view_key in TABLE_VIEWS:
+            TABLE_VIEWS.move_to_end(view_key)
+            return TABLE_VIEWS[view_key]
+    view = filter_rows(df, filter_query)
+    if sort_by:
+        view = view.sort_values([col['column_id'] for col in sort_by], ascending = [col['direction'] == 'asc' for col in sort_by], na_position = 'last')
+    order = df.index.get_indexer(view.index)
+    with TABLE_VIEWS_LOCK:
+        TABLE_VIEWS[view_key] = order
+        while len(TABLE_VIEWS) > 16:
+            TABLE_VIEWS.popitem(last = False)
+    return order
+
+def table_page(key, df, page_current, page_size, sort_by, filter_query):
+    #(records, page count) for one page of the results table, only that page is formatted and sent
+    order = table_view(key, df, sort_by, filter_query)
+    page = df.iloc[order[page_current * page_size:(page_current + 1) * page_size]]
+    df_display = page.drop(columns = ["rurality_id", "koppen_geiger_id"])
+    df_display["Tropospheric Nitrogen Dioxide Emissions"] = df_display["Tropospheric Nitrogen Dioxide Emissions"].apply(lambda x: '{:.{}e}'.format(x, 2))
+    df_display[["Fossil Fuel CO2 emissions", "Population Density"]] = df_display[["Fossil Fuel CO2 emissions", "Population Density"]].round(2)
+    return df_display.to_dict('records'), max(1, math.ceil(len(order) / page_size))
+
 @app.callback(Output('output-data-upload', 'children'),
             [
                 Input('df_store', 'data')
             ])
-def update_table(df):
+def update_table(key):
     table = html.Div()
-    if df:
-        df = pd.read_json(StringIO(df))
-        df_display = df.copy()
-        df_display = df.drop(columns = ["rurality_id", "koppen_geiger_id"])
-        df_display["Tropospheric Nitrogen Dioxide Emissions"] = df_display["Tropospheric Nitrogen Dioxide Emissions"].apply(lambda x: '{:.{}e}'.format(x, 2))
-        df_display[["Fossil Fuel CO2 emissions", "Population Density"]] = df_display[["Fossil Fuel CO2 emissions", "Population Density"]].round(2)
+    df = RESULT_STORE.get(key)
+    if df is not None:
+        data, page_count = table_page(key, df, 0, 8, [], "")
         table = dash_table.DataTable(
-                data=df_display.to_dict('records'),
-                columns=[{'name': i, 'id': i, "deletable": True} for i in df_display.columns],
-                filter_action = "none",
+                id = 'results_table',
+                data=data,
+                columns=[{'name': i, 'id': i, "deletable": True} for i in df.columns if i not in ["rurality_id", "koppen_geiger_id"]],
+                page_current = 0,
                 page_size = 8,
+                page_count = page_count,
+                page_action = "custom",
+                sort_action = "custom",
+                sort_mode = "multi",
+                sort_by = [],
+                filter_action = "custom",
+                filter_query = "",
                 style_cell = {'textAlign' : 'left', 'backgroundColor': 'rgba(0, 0, 0, 0)', 'height': 'auto', 'whiteSpace': 'normal'},
                 style_header = {'textAlign' : 'left', 'backgroundColor': 'rgba(0, 0, 0, 0)', 'height': 'auto', 'whiteSpace': 'normal'},
+                style_filter = {'textAlign' : 'left', 'backgroundColor': 'rgba(0, 0, 0, 0)'},
                 style_table={'overflowX': 'scroll'})
 
         card_content = [
@@ -492,12 +891,30 @@ def update_table(df):
         card_content = html.Div()
     return card_content
 
+@app.callback([Output('results_table', 'data'), Output('results_table', 'page_count')],
+            [
+                Input('results_table', 'page_current'),
+                Input('results_table', 'page_size'),
+                Input('results_table', 'sort_by'),
+                Input('results_table', 'filter_query')
+            ],
+            [
+                State('df_store', 'data')
+            ],
+            prevent_initial_call=True)
+def update_table_page(page_current, page_size, sort_by, filter_query, key):
+    #paging, sorting and filtering of the results table run on the server
+    df = RESULT_STORE.get(key)
+    if df is None:
+        return dash.no_update, dash.no_update
+    return table_page(key, df, page_current or 0, page_size, sort_by, filter_query)
+
 @app.callback(Output('map_fill', 'children'),
             [
                 Input('df_store', 'data')
             ])
-def populate_dropdown(df):
-    if df:
+def populate_dropdown(store_key):
+    if store_key:
         data_list = [{"label": key, "value": key} for key in version_info[OMEINFO_DATA_VERSION]["data_info"].keys()]
         dropdown = dcc.Dropdown(
                     id='map_fill',
@@ -524,8 +941,10 @@ def download(n_clicks):
     State("df_store", "data"),
     prevent_initial_call=True,
 )
-def download_df(n_clicks, df):
-    df = pd.read_json(StringIO(df))
+def download_df(n_clicks, key):
+    df = RESULT_STORE.get(key)
+    if df is None:
+        return dash.no_update
     df_download = df.drop(columns = ["rurality_id", "koppen_geiger_id"])
     return dcc.send_data_frame(df_download.to_csv, "annotated_metadata.tsv", index = False, header=True, sep="\t")
 
@@ -563,4 +982,5 @@ def display_page(pathname):
         return index_page #update to a 404 not found page
     
 if __name__ == '__main__':
+    RESOURCES.start()
     app.run_server(host='0.0.0.0', port=8050)
\ No newline at end of file
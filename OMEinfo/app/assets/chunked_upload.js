@@ -0,0 +1,123 @@
+// files dropped on (or selected with) the upload box are sent to /uploads in chunks instead of through
+// dcc.Upload, which reads the whole file in the browser and posts it base64 encoded in one request. an
+// upload that is interrupted carries on from the last chunk the server has, also after a page reload if
+// the same file is selected again. once the file is complete the annotation job is handed to the app via
+// the upload_job store
+(function () {
+    var CHUNK_SIZE = 8 * 1024 * 1024;
+    var RETRIES = 5;
+
+    function enabled() {
+        return window.fetch && window.dash_clientside && window.dash_clientside.set_props;
+    }
+
+    function setProps(id, props) {
+        window.dash_clientside.set_props(id, props);
+    }
+
+    function showProgress(value, text) {
+        setProps('job_status', {style: {display: 'block'}});
+        setProps('job_progress', {value: value});
+        setProps('job_progress_text', {children: text});
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function request(url, options) {
+        // retries network errors and server errors, anything else is returned to the caller
+        for (var attempt = 0; ; attempt++) {
+            try {
+                var response = await fetch(url, options);
+                if (response.status < 500 || attempt >= RETRIES) {
+                    return response;
+                }
+            } catch (error) {
+                if (attempt >= RETRIES) {
+                    throw error;
+                }
+            }
+            await sleep(1000 * Math.pow(2, attempt));
+        }
+    }
+
+    async function checked(response) {
+        var body = await response.json();
+        if (!response.ok) {
+            throw new Error(body.error || response.statusText);
+        }
+        return body;
+    }
+
+    async function startUpload(file) {
+        var storageKey = 'omeinfo-upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+        var upload = null;
+        var uploadId = window.localStorage.getItem(storageKey);
+        if (uploadId) {
+            var response = await request('/uploads/' + uploadId, {method: 'GET'});
+            if (response.ok) {
+                upload = await response.json();
+            }
+        }
+        if (!upload) {
+            upload = await checked(await request('/uploads', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({filename: file.name, size: file.size})
+            }));
+            window.localStorage.setItem(storageKey, upload.upload_id);
+        }
+        var offset = upload.received;
+        while (offset < file.size) {
+            showProgress(100 * offset / file.size, 'Uploaded ' + (offset / 1048576).toFixed(1) + ' of ' + (file.size / 1048576).toFixed(1) + ' MB');
+            var response = await request('/uploads/' + upload.upload_id, {
+                method: 'PATCH',
+                headers: {'Upload-Offset': String(offset), 'Content-Type': 'application/octet-stream'},
+                body: file.slice(offset, offset + CHUNK_SIZE)
+            });
+            if (response.status === 409) {
+                // the server has a different amount of the file (e.g. a chunk was received but the
+                // response was lost), carry on from there
+                upload = await checked(await request('/uploads/' + upload.upload_id, {method: 'GET'}));
+            } else {
+                upload = await checked(response);
+            }
+            offset = upload.received;
+        }
+        showProgress(0, 'Reading file...');
+        var job = await checked(await request('/uploads/' + upload.upload_id + '/complete', {method: 'POST'}));
+        window.localStorage.removeItem(storageKey);
+        setProps('upload_job', {data: job});
+    }
+
+    function upload(file) {
+        startUpload(file).catch(function (error) {
+            showProgress(0, 'Upload failed: ' + error.message);
+        });
+    }
+
+    function inUploadBox(event) {
+        return event.target && event.target.closest && event.target.closest('#upload-data');
+    }
+
+    // capture phase listeners run before dcc.Upload's own handlers, which never see the file
+    document.addEventListener('drop', function (event) {
+        if (!enabled() || !inUploadBox(event) || !event.dataTransfer || !event.dataTransfer.files.length) {
+            return;
+        }
+        event.preventDefault();
+        event.stopPropagation();
+        upload(event.dataTransfer.files[0]);
+    }, true);
+
+    document.addEventListener('change', function (event) {
+        if (!enabled() || !inUploadBox(event) || event.target.type !== 'file' || !event.target.files.length) {
+            return;
+        }
+        event.stopPropagation();
+        var file = event.target.files[0];
+        event.target.value = '';
+        upload(file);
+    }, true);
+})();
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    #an annotation job, shared between the worker thread running it and the callbacks polling it
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.state = "queued"
+        self.rows_done = 0
+        self.rows_total = None
+        self.message = None
+        #key of the results so far, for jobs that publish them as they go
+        self.partial = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    def progress(self, rows_done, rows_total = None):
+        #called by the job function as it goes, raises JobCancelled once the job has been cancelled
+        if rows_total is not None:
+            self.rows_total = rows_total
+        self.rows_done = rows_done
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def eta(self):
+        if self.state != "running" or not self.rows_done or not self.rows_total:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / self.rows_done * (self.rows_total - self.rows_done)
+
+    def status(self):
+        return {"job_id": self.job_id, "state": self.state, "rows_done": self.rows_done, "rows_total": self.rows_total,
+                "eta_seconds": self.eta(), "message": self.message, "partial": self.partial, "submitted": self.submitted, "started": self.started, "finished": self.finished}
+
+class JobQueue:
+    #runs annotation jobs on a pool of background threads so that callbacks return straight away. jobs
+    #are looked up by id for progress and cancellation, and forgotten keep seconds after they finish
+    def __init__(self, workers = 2, keep = 3600):
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = "omeinfo-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id, function, *args):
+        #function is called as function(job, *args). submitting an id that is already queued or running
+        #returns the existing job instead of starting another one
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and job.state in ("queued", "running"):
+                return job
+            job = Job(job_id)
+            self._jobs[job_id] = job
+        self._executor.submit(self._run, job, function, args)
+        return job
+
+    def _run(self, job, function, args):
+        if job.cancel_event.is_set():
+            self._finish(job, "cancelled")
+            return
+        job.state = "running"
+        job.started = time.time()
+        try:
+            function(job, *args)
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            self._finish(job, "failed", str(e))
+        else:
+            self._finish(job, "done")
+
+    def _finish(self, job, state, message = None):
+        job.message = message
+        job.finished = time.time()
+        job.state = state
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        return None if job is None else job.status()
+
+    def cancel(self, job_id):
+        #queued jobs never start, running jobs stop at their next progress update
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.keep:
+                del self._jobs[job_id]
+
+JOBS = JobQueue(workers = int(os.environ.get("OMEINFO_JOB_WORKERS", 2)))
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+
+import rasterio
+
+from omeinfo import BAND_STORE_METADATA, HTTPRangeSource, data_packet_urls, is_band_store, is_remote, load_legend, open_band_store
+
+def file_identity(path):
+    #changes whenever a local packet file (or band store) is replaced
+    if is_band_store(path):
+        path = os.path.join(path, BAND_STORE_METADATA)
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+class DataPacketResources:
+    #process wide resources for annotating uploads: the legends, parsed once, and for a remote data packet
+    #a HTTPRangeSource per file holding its header and IFDs. annotations fork those sources, so their
+    #readers open without a single request. a background thread checks the packet every health_interval
+    #seconds, and everything is reloaded if the packet file changes or OMEINFO_URL does
+    def __init__(self, version, legend_dir = ".", health_interval = 300, url_setting = lambda: os.environ.get("OMEINFO_URL")):
+        self.version = version
+        self.legend_dir = legend_dir
+        self.health_interval = health_interval
+        self.url_setting = url_setting
+        self._lock = threading.RLock()
+        #held while loading, so loads run one at a time without holding up readers of the loaded resources
+        self._loading = threading.RLock()
+        self._thread = None
+        self.url = url_setting()
+        self.sources = {}
+        self.identity = {}
+        self.legends = None
+        self.error = None
+        self.loaded_at = None
+        self.checked_at = None
+
+    def load(self):
+        with self._loading:
+            return self._load()
+
+    def _load(self):
+        url = self.url_setting()
+        try:
+            legends = (load_legend(os.path.join(self.legend_dir, "rurality_legend.txt")), load_legend(os.path.join(self.legend_dir, "kg_legend.txt")))
+            sources = {}
+            identity = {}
+            for file_url in data_packet_urls(self.version, url):
+                if is_remote(file_url):
+                    source = HTTPRangeSource(file_url)
+                    warm_up(file_url, source)
+                    sources[file_url] = source
+                    identity[file_url] = source.etag or source.size
+                elif is_band_store(file_url):
+                    open_band_store(file_url)
+                    identity[file_url] = file_identity(file_url)
+                else:
+                    warm_up(file_url)
+                    identity[file_url] = file_identity(file_url)
+        except Exception as e:
+            with self._lock:
+                self.url = url
+                self.error = str(e)
+                self.checked_at = time.time()
+            return False
+        with self._lock:
+            self.url, self.legends, self.sources, self.identity = url, legends, sources, identity
+            self.error = None
+            self.loaded_at = self.checked_at = time.time()
+        return True
+
+    def check(self):
+        #health check: reloads if OMEINFO_URL or any packet file changed, or after a failed load
+        if self.url_setting() != self.url or self.error is not None or self.legends is None:
+            return self.load()
+        try:
+            for file_url, loaded in self.identity.items():
+                current = HTTPRangeSource(file_url, readahead = 1) if is_remote(file_url) else None
+                current = (current.etag or current.size) if current else file_identity(file_url)
+                if current != loaded:
+                    return self.load()
+        except Exception as e:
+            with self._lock:
+                self.error = str(e)
+                self.checked_at = time.time()
+            return False
+        self.checked_at = time.time()
+        return True
+
+    def start(self):
+        #loads in the background so the app starts straight away, then keeps checking the packet. only the
+        #first call in a process starts the thread (a forked server worker starts its own)
+        def run():
+            self.load()
+            while True:
+                time.sleep(self.health_interval)
+                self.check()
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target = run, name = "omeinfo-resources", daemon = True)
+            self._thread.start()
+
+    def stale(self):
+        with self._lock:
+            return self.url_setting() != self.url or self.legends is None
+
+    def current(self):
+        #(url, (id_to_rurality, id_to_kg)) to annotate with, reloading first if OMEINFO_URL has changed
+        if self.stale():
+            with self._loading:
+                #another request may have reloaded while this one waited
+                if self.stale():
+                    self._load()
+        with self._lock:
+            if self.legends is None:
+                raise RuntimeError(f"Data packet resources are not available: {self.error}")
+            return self.url, self.legends
+
+    def range_source_factory(self, url):
+        #for get_s3_point_data: a fork of the warm source for url, or a new source for anything else
+        with self._lock:
+            source = self.sources.get(url)
+        return source.fork() if source is not None else HTTPRangeSource(url)
+
+    def status(self):
+        with self._lock:
+            if self.error is not None:
+                state = "error"
+            elif self.loaded_at is None:
+                state = "loading"
+            else:
+                state = "ok"
+            return {"status": state, "data_version": self.version, "url": self.url, "files": {url: str(identity) for url, identity in self.identity.items()},
+                    "loaded_at": self.loaded_at, "checked_at": self.checked_at, "error": self.error}
+
+def warm_up(url, source = None):
+    #opens the file once so that its header, overview IFDs and tile offsets are read (into source, for
+    #remote files, or GDAL's caches for local ones)
+    with rasterio.open(url, opener = source.open if source else None) as dataset:
+        dataset.overviews(1)
+        dataset.get_tag_item("BLOCK_OFFSET_0_0", "TIFF", bidx = 1)
+
+RESOURCES = DataPacketResources(os.environ.get('OMEINFO_VERSION', "2.0.0"), health_interval = int(os.environ.get("OMEINFO_HEALTH_INTERVAL", 300)))
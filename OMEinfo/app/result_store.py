@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+class ResultStore:
+    #annotated uploads kept on the server as parquet files, the browser only holds the key. results are
+    #removed ttl seconds after they were last used, and the most recently used frames are also kept in
+    #memory so that switching between plots does not read the file again. a small JSON summary (e.g.
+    #precomputed aggregates) can be stored with each result
+    def __init__(self, directory, ttl = 7200, memory_items = 8):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self._frames = OrderedDict()
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _summary_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key, df, cache = None):
+        cache = self._frames if cache is None else cache
+        with self._lock:
+            cache[key] = df
+            cache.move_to_end(key)
+            while len(cache) > self.memory_items:
+                cache.popitem(last = False)
+
+    def put(self, key, df, summary = None):
+        df = df.copy()
+        if "error" in df.columns:
+            #exceptions cannot be stored in parquet, the message is kept
+            df["error"] = df["error"].map(lambda e: None if e is None or e != e else str(e))
+        temp_file = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if summary is not None:
+            self.put_summary(key, summary)
+        df.to_parquet(temp_file, index = False)
+        os.replace(temp_file, self._path(key))
+        self._remember(key, df)
+        self.evict()
+        return key
+
+    def get(self, key):
+        #returns a copy of the stored frame, or None if there is no (unexpired) result for key
+        if not key:
+            return None
+        with self._lock:
+            df = self._frames.get(key)
+            if df is not None:
+                self._frames.move_to_end(key)
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                self.discard(key)
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            self.discard(key)
+            return None
+        if df is None:
+            df = pd.read_parquet(path)
+            self._remember(key, df)
+        return df.copy()
+
+    def put_summary(self, key, summary):
+        temp_file = f"{self._summary_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(summary, f)
+        os.replace(temp_file, self._summary_path(key))
+        self._remember(key, summary, self._summaries)
+
+    def get_summary(self, key):
+        #the summary stored with key, None if there is none (or the result has expired)
+        if not key:
+            return None
+        with self._lock:
+            summary = self._summaries.get(key)
+        if summary is None:
+            try:
+                with open(self._summary_path(key)) as f:
+                    summary = json.load(f)
+            except FileNotFoundError:
+                return None
+            self._remember(key, summary, self._summaries)
+        return summary
+
+    def __contains__(self, key):
+        #for status polls: only checks that the result is stored and has not expired, nothing is read
+        if not key:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self._path(key)) <= self.ttl
+        except FileNotFoundError:
+            return False
+
+    def discard(self, key):
+        with self._lock:
+            self._frames.pop(key, None)
+            self._summaries.pop(key, None)
+        for path in [self._path(key), self._summary_path(key)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    if name.endswith(".parquet"):
+                        self.discard(name[:-len(".parquet")])
+                    elif not (name.endswith(".json") and os.path.exists(self._path(name[:-len(".json")]))):
+                        #temporary file of a write that never finished, or a summary without its result.
+                        #summaries of results still in use are kept, only the parquet file records use
+                        os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def upload_key(contents, *settings):
+    #results are keyed by the uploaded file and the data packet it was annotated against, so the same
+    #upload is only annotated once while its result is stored
+    digest = hashlib.sha256(contents.encode() if isinstance(contents, str) else contents)
+    for setting in settings:
+        digest.update(b"\0" + str(setting).encode())
+    return digest.hexdigest()
+
+RESULT_STORE = ResultStore(os.environ.get("OMEINFO_RESULT_DIR", os.path.join(tempfile.gettempdir(), "omeinfo_results")),
+                           ttl = int(os.environ.get("OMEINFO_RESULT_TTL", 7200)))
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+class UploadError(Exception):
+    #carries the HTTP status the upload routes answer with
+    def __init__(self, message, status = 400):
+        super().__init__(message)
+        self.status = status
+
+class UploadStore:
+    #files uploaded in chunks, written straight to disk. each upload has a .part file and a small JSON
+    #record of its name and declared size, the number of bytes received is the size of the .part file so an
+    #interrupted upload carries on from there. unfinished and unused uploads are removed after ttl seconds
+    def __init__(self, directory, ttl = 7200, max_size = 2 * 1024 ** 3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, upload_id):
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise UploadError("unknown upload", 404)
+        return os.path.join(self.directory, f"{upload_id}.part")
+
+    def _record_path(self, upload_id):
+        return os.path.join(self.directory, f"{upload_id}.json")
+
+    def create(self, filename, size):
+        if not filename or not (filename.endswith(".csv") or filename.endswith(".tsv")):
+            raise UploadError("only .csv and .tsv files can be uploaded")
+        if size is None or int(size) < 0:
+            raise UploadError("the file size is needed to start an upload")
+        if int(size) > self.max_size:
+            raise UploadError(f"files can be at most {self.max_size} bytes", 413)
+        self.evict()
+        upload_id = uuid.uuid4().hex
+        open(self.path(upload_id), "wb").close()
+        with open(self._record_path(upload_id), "w") as f:
+            json.dump({"filename": filename, "size": int(size), "created": time.time()}, f)
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        path = self.path(upload_id)
+        try:
+            with open(self._record_path(upload_id)) as f:
+                record = json.load(f)
+            record["received"] = os.path.getsize(path)
+        except FileNotFoundError:
+            raise UploadError("unknown upload", 404)
+        record["upload_id"] = upload_id
+        record["complete"] = record["received"] == record["size"]
+        return record
+
+    def write(self, upload_id, offset, stream, block_size = 1024 * 1024):
+        #appends the body of one chunk (a file like stream) at offset, which has to be the number of bytes
+        #already received. returns the upload's status
+        with self._lock:
+            record = self.status(upload_id)
+            if offset != record["received"]:
+                raise UploadError(f"expected offset {record['received']}", 409)
+            received = offset
+            with open(self.path(upload_id), "ab") as f:
+                while True:
+                    block = stream.read(block_size)
+                    if not block:
+                        break
+                    received += len(block)
+                    if received > record["size"]:
+                        f.truncate(offset)
+                        raise UploadError("more data was sent than the declared file size", 413)
+                    f.write(block)
+        return self.status(upload_id)
+
+    def write_bytes(self, filename, data):
+        #a whole file at once, for files that arrive in a single request
+        record = self.create(filename, len(data))
+        with open(self.path(record["upload_id"]), "wb") as f:
+            f.write(data)
+        return self.status(record["upload_id"])
+
+    def digest(self, upload_id, block_size = 1024 * 1024):
+        #sha256 of a complete upload, read back from disk a block at a time
+        record = self.status(upload_id)
+        if not record["complete"]:
+            raise UploadError(f"only {record['received']} of {record['size']} bytes have been received", 409)
+        digest = hashlib.sha256()
+        with open(self.path(upload_id), "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def discard(self, upload_id):
+        for path in [self.path(upload_id), self._record_path(upload_id)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".part") and now - os.path.getmtime(path) > self.ttl:
+                    self.discard(name[:-len(".part")])
+                elif name.endswith(".json") and not os.path.exists(path[:-len(".json")] + ".part"):
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+UPLOADS = UploadStore(os.environ.get("OMEINFO_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "omeinfo_uploads")),
+                      ttl = int(os.environ.get("OMEINFO_UPLOAD_TTL", 7200)),
+                      max_size = int(os.environ.get("OMEINFO_MAX_UPLOAD_BYTES", 2 * 1024 ** 3)))
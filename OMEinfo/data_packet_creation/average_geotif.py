@@ -1,82 +1,121 @@
+#averages monthly rasters (by default the twelve 2019 ODIAC 1 km CO2 files) into a geotiff of the per pixel
+#mean, and optionally one of the standard deviation. pixels that are nodata in any month are nodata (NaN) in
+#the output. the rasters are processed a window at a time in a process pool, each window streamed month by
+#month through a one pass mean/variance accumulator, so memory use is bounded by the window size and not by
+#the size of the rasters
+import argparse
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import ExitStack
+
 import numpy as np
 import rasterio
+from rasterio.windows import Window
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeRemainingColumn
+
+ODIAC_2019 = [f"odiac2020b_1km_excl_intl_19{month:02d}.tif" for month in range(1, 13)]
+
+#set in each worker process by init_worker
+datasets = []
+output_dtype = None
+with_std = False
+
+def init_worker(paths, dtype, std):
+    #the rasters are opened once per worker. windows are made of whole blocks, so each block is only read
+    #once and a small GDAL block cache is enough
+    global datasets, output_dtype, with_std
+    os.environ["GDAL_CACHEMAX"] = "64"
+    datasets = [rasterio.open(path) for path in paths]
+    output_dtype = dtype
+    with_std = std
+
+def window_stats(window):
+    #mean and (population, as np.std) standard deviation of the window across all rasters, accumulated one
+    #raster at a time with Welford's method
+    mean = m2 = nodata = None
+    for n, src in enumerate(datasets, start = 1):
+        data = src.read(window = window).astype("float64")
+        missing = np.isnan(data)
+        if src.nodata is not None:
+            missing |= data == src.nodata
+        if mean is None:
+            mean, m2, nodata = np.zeros_like(data), np.zeros_like(data), missing
+        else:
+            nodata |= missing
+        delta = data - mean
+        mean += delta / n
+        m2 += delta * (data - mean)
+    mean[nodata] = np.nan
+    std = None
+    if with_std:
+        std = np.sqrt(m2 / len(datasets))
+        std[nodata] = np.nan
+        std = std.astype(output_dtype)
+    return window, mean.astype(output_dtype), std
 
-im1 = 'odiac2020b_1km_excl_intl_1901.tif'
-im2 = 'odiac2020b_1km_excl_intl_1902.tif'
-im3 = 'odiac2020b_1km_excl_intl_1903.tif'
-im4 = 'odiac2020b_1km_excl_intl_1904.tif'
-im5 = 'odiac2020b_1km_excl_intl_1905.tif'
-im6 = 'odiac2020b_1km_excl_intl_1906.tif'
-im7 = 'odiac2020b_1km_excl_intl_1907.tif'
-im8 = 'odiac2020b_1km_excl_intl_1908.tif'
-im9 = 'odiac2020b_1km_excl_intl_1909.tif'
-im10 = 'odiac2020b_1km_excl_intl_1910.tif'
-im11 = 'odiac2020b_1km_excl_intl_1911.tif'
-im12 = 'odiac2020b_1km_excl_intl_1912.tif'
+def averaging_windows(src, block_size):
+    #windows of whole input blocks: about block_size square for tiled rasters, full width bands of whole
+    #strips (of about block_size * block_size pixels) for striped ones
+    block_height, block_width = src.block_shapes[0]
+    if block_width >= src.width:
+        height = max(1, block_size * block_size // src.width // block_height) * block_height
+        width = src.width
+    else:
+        height = max(1, block_size // block_height) * block_height
+        width = max(1, block_size // block_width) * block_width
+    for row in range(0, src.height, height):
+        for col in range(0, src.width, width):
+            yield Window(col, row, min(width, src.width - col), min(height, src.height - row))
 
-with rasterio.open(im1) as src:
-    array1 = src.read()
-    profile1 = src.profile
-with rasterio.open(im2) as src:
-    array2 = src.read()
-    profile2 = src.profile
-with rasterio.open(im3) as src:
-    array3 = src.read()
-    profile3 = src.profile
-with rasterio.open(im4) as src:
-    array4 = src.read()
-    profile4 = src.profile
-with rasterio.open(im5) as src:
-    array5 = src.read()
-    profile5 = src.profile
-with rasterio.open(im6) as src:
-    array6 = src.read()
-    profile6 = src.profile
-with rasterio.open(im7) as src:
-    array7 = src.read()
-    profile7 = src.profile
-with rasterio.open(im8) as src:
-    array8 = src.read()
-    profile8 = src.profile
-with rasterio.open(im9) as src:
-    array9 = src.read()
-    profile9 = src.profile
-with rasterio.open(im10) as src:
-    array10 = src.read()
-    profile10 = src.profile
-with rasterio.open(im11) as src:
-    array11 = src.read()
-    profile11 = src.profile
-with rasterio.open(im12) as src:
-    array12 = src.read()
-    profile12 = src.profile
+def check_rasters(sources):
+    first = sources[0]
+    for src in sources[1:]:
+        if (src.width, src.height, src.count, src.crs, src.transform) != (first.width, first.height, first.count, first.crs, first.transform):
+            raise ValueError(f"{src.name} does not have the same size, bands, CRS and transform as {first.name}")
 
+def main():
+    parser = argparse.ArgumentParser(prog = "average_geotif.py", description = "average monthly rasters into one geoTIFF of the per pixel mean (and optionally standard deviation)")
+    parser.add_argument("rasters", nargs = "*", help = "rasters to average, all on the same grid, defaults to the twelve 2019 ODIAC files", default = ODIAC_2019)
+    parser.add_argument("--output_file", type = str, help = "geoTIFF to write the mean to", default = "co2.tif")
+    parser.add_argument("--std_file", type = str, help = "geoTIFF to write the standard deviation to, not written by default", default = None)
+    parser.add_argument("--workers", type = int, help = "number of processes, defaults to the number of CPUs", default = os.cpu_count())
+    parser.add_argument("--block_size", type = int, help = "approximate width and height in pixels of the windows processed at a time (bounds memory use per worker)", default = 1024)
+    args = parser.parse_args()
 
-# Create nodata mask (True is nodata)
-nodata_mask = np.any((array1 == profile1.get('nodata'),
-                      array2 == profile2.get('nodata'),
-                      array3 == profile3.get('nodata'),
-                      array4 == profile4.get('nodata'),
-                      array5 == profile5.get('nodata'),
-                      array6 == profile6.get('nodata'),
-                      array7 == profile7.get('nodata'),
-                      array8 == profile8.get('nodata'),
-                      array9 == profile9.get('nodata'),
-                      array10 == profile10.get('nodata'),
-                      array11 == profile11.get('nodata'),
-                      array12 == profile12.get('nodata'),),
-                     axis=0)
-# Compute anything what you want
-array_mean = np.mean((array1, array2, array3,array4, array5, array6,array7, array8, array9,array10, array11, array12), axis=0)
-array_sd = np.std((array1, array2, array3,array4, array5, array6,array7, array8, array9,array10, array11, array12), axis=0)
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in args.rasters]
+        check_rasters(sources)
+        first = sources[0]
+        #float rasters keep their type, anything else is averaged to float64 like np.mean does
+        dtype = first.dtypes[0] if np.issubdtype(np.dtype(first.dtypes[0]), np.floating) else "float64"
+        profile = first.profile.copy()
+        profile.update(dtype = dtype, nodata = np.nan, BIGTIFF = "IF_SAFER")
+        windows = list(averaging_windows(first, args.block_size))
 
-# replace nodata pixels to np.nan
-array_mean[nodata_mask] = np.nan
-array_sd[nodata_mask] = np.nan
+    with ExitStack() as stack:
+        mean_dst = stack.enter_context(rasterio.open(args.output_file, "w", **profile))
+        std_dst = stack.enter_context(rasterio.open(args.std_file, "w", **profile)) if args.std_file else None
+        pool = stack.enter_context(ProcessPoolExecutor(args.workers, initializer = init_worker, initargs = (args.rasters, dtype, std_dst is not None)))
+        progress = stack.enter_context(Progress(TextColumn("[bold green]Averaging windows"), BarColumn(), MofNCompleteColumn(), TimeRemainingColumn()))
+        task = progress.add_task("Averaging windows", total = len(windows))
+        #a couple of windows per worker are in flight at a time, finished windows are written as they
+        #arrive so results do not pile up in memory
+        remaining = iter(windows)
+        pending = set()
+        while True:
+            for window in remaining:
+                pending.add(pool.submit(window_stats, window))
+                if len(pending) >= 2 * args.workers:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                window, mean, std = future.result()
+                mean_dst.write(mean, window = window)
+                if std_dst is not None:
+                    std_dst.write(std, window = window)
+                progress.advance(task)
 
-# Write as geotiff file
-profile_out = profile1.copy()
-profile_out.update(dtype=array_mean.dtype.name,
-                   nodata=np.nan)
-with rasterio.open('co2.tif', 'w', **profile_out) as dst:
-    dst.write(array_mean)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#builds a data packet COG from a JSON spec listing the target grid, the output type and the source layers in
+#band order, replacing the manual gdalwarp / gdal_merge.py -separate / rio cogeo create steps. each source is
+#reprojected onto the grid by a warped VRT and the bands are stacked in a VRT, so nothing is written at full
+#size but the COG itself: GDAL's COG driver reads the stack block by block, warping and compressing with
+#NUM_THREADS threads, and builds the overviews.
+#
+#spec format (paths are relative to the spec file):
+#{
+#  "output": "omeinfo_v2.tif",
+#  "grid": {"crs": "EPSG:4326", "bounds": [-180, -90, 180, 90], "resolution": 0.0083333333333333},
+#          (or {"like": "some_source.tif"} to use the grid of an existing raster)
+#  "nodata": "nan",
+#  "cog": {"blocksize": 512, "compress": "deflate", "interleave": "pixel", "predictor": "yes", "overview_resampling": "nearest"},
+#  "bands": [{"name": "population_density", "source": "GHS_POP.tif", "band": 1, "dtype": "float32", "resampling": "nearest", "nodata": -200}, ...]
+#}
+#a GeoTIFF has one data type for all bands: the packet gets the smallest type holding every band's "dtype"
+#(float32 if not given), unless the spec sets "dtype" itself. point lookups read one full resolution tile
+#per location, pixel interleaving keeps all the bands of a location in that one tile and smaller blocks
+#make it smaller (see layout_benchmark.py)
+#bands are in the order omeinfo.py reads them. resampling other than nearest depends on how GDAL splits the
+#warp into chunks (the resampling scale is worked out per chunk), a band's "warp_options" (e.g. {"XSCALE": 1,
+#"YSCALE": 1}) fix it where that matters
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from xml.sax.saxutils import escape
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+
+GDAL_TYPES = {"uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16", "uint32": "UInt32", "int32": "Int32", "float32": "Float32", "float64": "Float64"}
+COG_DEFAULTS = {"blocksize": 512, "compress": "deflate", "interleave": "pixel", "overviews": "auto", "overview_resampling": "nearest"}
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    spec["output"] = os.path.join(base, spec["output"])
+    for band in spec["bands"]:
+        band["source"] = os.path.join(base, band["source"])
+    if "like" in spec["grid"]:
+        spec["grid"]["like"] = os.path.join(base, spec["grid"]["like"])
+    spec["cog"] = {**COG_DEFAULTS, **spec.get("cog", {})}
+    return spec
+
+def target_grid(grid):
+    #(crs, transform, width, height) of the packet
+    if "like" in grid:
+        with rasterio.open(grid["like"]) as src:
+            return src.crs, src.transform, src.width, src.height
+    left, bottom, right, top = grid["bounds"]
+    resolution = grid["resolution"]
+    xres, yres = resolution if isinstance(resolution, (list, tuple)) else (resolution, resolution)
+    width, height = round((right - left) / xres), round((top - bottom) / yres)
+    return CRS.from_user_input(grid["crs"]), from_origin(left, top, xres, yres), width, height
+
+def packet_dtype(bands):
+    return np.result_type(*[np.dtype(band.get("dtype", "float32")) for band in bands]).name
+
+def cog_options(cog, threads = "ALL_CPUS"):
+    #COG driver creation options for the "cog" section of a spec. predictor ("yes" picks the one for the
+    #data type), level and max_z_error (lossy LERC compression, in data units) are optional
+    options = {"BLOCKSIZE": cog["blocksize"], "COMPRESS": cog["compress"].upper(), "INTERLEAVE": cog["interleave"].upper(), "OVERVIEWS": cog["overviews"].upper(),
+               "OVERVIEW_RESAMPLING": cog["overview_resampling"].upper(), "NUM_THREADS": threads, "BIGTIFF": "IF_SAFER"}
+    for key in ["predictor", "level", "max_z_error"]:
+        if cog.get(key) is not None:
+            options[key.upper()] = str(cog[key]).upper()
+    options.update({key.upper(): value for key, value in cog.get("creation_options", {}).items()})
+    return options
+
+def warped_source(band, grid, dtype, nodata, path, threads):
+    #one source band reprojected and aligned to the grid, saved as a VRT (nothing is warped yet)
+    crs, transform, width, height = grid
+    with rasterio.open(band["source"]) as src:
+        src_nodata = band.get("nodata", src.nodata)
+        with WarpedVRT(src, crs = crs, transform = transform, width = width, height = height, dtype = dtype,
+                       resampling = Resampling[band.get("resampling", "nearest")], src_nodata = src_nodata, nodata = nodata,
+                       warp_mem_limit = 256, warp_extras = {"NUM_THREADS": threads, **band.get("warp_options", {})}) as vrt:
+            rasterio.shutil.copy(vrt, path, driver = "VRT")
+    return path
+
+def stacked_vrt(bands, paths, grid, dtype, nodata, path):
+    #the separate source VRTs as the bands of one dataset, like gdal_merge.py -separate but virtual
+    crs, transform, width, height = grid
+    lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+             f"  <SRS>{escape(crs.to_wkt())}</SRS>",
+             f"  <GeoTransform>{', '.join(repr(v) for v in transform.to_gdal())}</GeoTransform>"]
+    for number, (band, source) in enumerate(zip(bands, paths), start = 1):
+        lines += [f'  <VRTRasterBand dataType="{GDAL_TYPES[dtype]}" band="{number}">',
+                  f"    <Description>{escape(band.get('name', os.path.basename(band['source'])))}</Description>"]
+        if nodata is not None:
+            lines.append(f"    <NoDataValue>{nodata!r}</NoDataValue>")
+        lines += ["    <SimpleSource>",
+                  f'      <SourceFilename relativeToVRT="0">{escape(os.path.abspath(source))}</SourceFilename>',
+                  f"      <SourceBand>{band.get('band', 1)}</SourceBand>",
+                  f'      <SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}" />',
+                  f'      <DstRect xOff="0" yOff="0" xSize="{width}" ySize="{height}" />',
+                  "    </SimpleSource>",
+                  "  </VRTRasterBand>"]
+    lines.append("</VRTDataset>")
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def build_packet(spec, output = None, threads = "ALL_CPUS", work_dir = None):
+    output = output or spec["output"]
+    grid = target_grid(spec["grid"])
+    dtype = spec.get("dtype") or packet_dtype(spec["bands"])
+    nodata = float(spec["nodata"]) if spec.get("nodata") is not None else None
+    work_dir = tempfile.mkdtemp(prefix = "omeinfo_packet_", dir = work_dir)
+    try:
+        paths = [warped_source(band, grid, dtype, nodata, os.path.join(work_dir, f"band{number}.vrt"), threads) for number, band in enumerate(spec["bands"], start = 1)]
+        stack = stacked_vrt(spec["bands"], paths, grid, dtype, nodata, os.path.join(work_dir, "stack.vrt"))
+        with rasterio.Env(GDAL_NUM_THREADS = threads):
+            rasterio.shutil.copy(stack, output, driver = "COG", **cog_options(spec["cog"], threads))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(prog = "build_packet.py", description = "build a data packet COG from a JSON spec of its grid and source layers")
+    parser.add_argument("spec", type = str, help = "JSON spec of the packet (e.g. omeinfo_v2_packet.json)")
+    parser.add_argument("--output", type = str, help = "COG to write, defaults to the output given in the spec", default = None)
+    parser.add_argument("--threads", type = str, help = "threads GDAL warps and compresses with", default = "ALL_CPUS")
+    parser.add_argument("--work_dir", type = str, help = "directory for the intermediate VRT files (a few KB)", default = None)
+    args = parser.parse_args()
+    print(f"Packet written to: {build_packet(load_spec(args.spec), args.output, args.threads, args.work_dir)}")
+
+if __name__ == "__main__":
+    main()
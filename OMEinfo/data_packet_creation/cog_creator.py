@@ -1,9 +1,16 @@
-
 # Import necessary packages
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import boto3
-from botocore.exceptions import NoCredentialsError
-from rio_tiler.io import Reader
-import pandas as pd
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
 
 s3_bucket = 'cloudgeotiffbucket'
 s3_key1 = 'rurpopkoppov_v1_cog.tif'
@@ -12,22 +19,187 @@ s3_key3= 'no2_v1_cog.tif'
 s3_key4= 'omeinfo_v2.tif'
 s3_region = 'eu-north-1'
 
-s3_url = f"https://{s3_bucket}.s3.{s3_region}.amazonaws.com/{s3_key1}"
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+def object_url(bucket, key, region, endpoint_url = None):
+    if endpoint_url:
+        return f"{endpoint_url.rstrip('/')}/{bucket}/{key}"
+    return f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
+
+def effective_part_size(size, part_size):
+    #S3 allows at most 10000 parts of at least 5 MB (but the last), the part size is raised if needed
+    return max(part_size, MIN_PART_SIZE, -(-size // MAX_PARTS))
+
+def part_ranges(size, part_size):
+    #(part number, offset, length) of every part
+    return [(number, offset, min(part_size, size - offset)) for number, offset in enumerate(range(0, max(size, 1), part_size), start = 1)]
+
+def part_checksums(data):
+    #md5 (hex) and sha256 (base64) of a part, sent as its Content-MD5 and SHA256 checksum. S3 checks both
+    #on receipt, whatever the bucket's encryption
+    return hashlib.md5(data).hexdigest(), base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+def file_checksums(path, parts):
+    #checksums of every part and the sha256 of the whole file, in one pass over the file
+    part_md5, part_sha256 = {}, {}
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for number, offset, length in parts:
+            data = f.read(length)
+            part_md5[number], part_sha256[number] = part_checksums(data)
+            sha256.update(data)
+    return part_md5, part_sha256, sha256.hexdigest()
+
+def multipart_checksums(part_md5, part_sha256):
+    #what S3 reports for the completed upload: the ETag is the md5 of the concatenated part md5s and the
+    #part count (not for objects encrypted with KMS or a customer key), the SHA256 checksum is the sha256 of
+    #the concatenated part sha256s
+    numbers = sorted(part_md5)
+    etag = f"{hashlib.md5(b''.join(bytes.fromhex(part_md5[number]) for number in numbers)).hexdigest()}-{len(numbers)}"
+    checksum = base64.b64encode(hashlib.sha256(b"".join(base64.b64decode(part_sha256[number]) for number in numbers)).digest()).decode()
+    return etag, checksum
+
+def part_matches(part, md5, sha256):
+    #whether a part S3 holds has the expected content. its SHA256 checksum is compared where the store keeps
+    #part checksums, otherwise the ETag, which is the part's md5 unless the bucket encrypts with KMS (such
+    #parts are uploaded again)
+    if part.get("ChecksumSHA256"):
+        return part["ChecksumSHA256"] == sha256
+    return part["ETag"].strip('"') == md5
 
-def upload_cog_s3(key, bucket_name, local_filepath):
-    session = boto3.client('s3')
+def load_state(state_file):
     try:
-        session.upload_file(local_filepath, bucket_name, key)
-        return("Upload successful")
+        with open(state_file) as f:
+            return json.load(f)
     except FileNotFoundError:
-        return("The file was not found")
-    except NoCredentialsError:
-        return("Credentials not available")
+        return None
+
+def save_state(state_file, state):
+    temp_file = f"{state_file}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(state, f, indent = 1)
+    os.replace(temp_file, state_file)
+
+def uploaded_parts(client, bucket, key, upload_id):
+    #{part number: part (ETag and checksum)} of the parts S3 already holds for an upload, None if the upload is gone
+    parts = {}
+    try:
+        for page in client.get_paginator("list_parts").paginate(Bucket = bucket, Key = key, UploadId = upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchUpload", "404"):
+            return None
+        raise
+    return parts
+
+def upload_part(client, bucket, key, upload_id, path, number, offset, length, md5, sha256):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if part_checksums(data) != (md5, sha256):
+        raise ValueError(f"part {number} of {path} changed during the upload")
+    #S3 rejects the part if either checksum does not match what it received
+    response = client.upload_part(Bucket = bucket, Key = key, UploadId = upload_id, PartNumber = number, Body = data,
+                                  ContentMD5 = base64.b64encode(bytes.fromhex(md5)).decode(), ChecksumSHA256 = sha256)
+    if response.get("ChecksumSHA256") not in (None, sha256):
+        raise ValueError(f"part {number} of {path} was stored with SHA256 checksum {response['ChecksumSHA256']}, expected {sha256}")
+    return number, response["ETag"]
+
+def publish_cog(path, bucket, key, region = s3_region, data_version = None, part_size = 64 * 1024 * 1024, threads = 8, endpoint_url = None, state_file = None, client = None):
+    #uploads path to s3://bucket/key in parts, threads at a time. the upload id and checksums are kept in
+    #state_file (next to the file by default) so an interrupted upload resumes with the parts S3 does not
+    #have yet. every part is sent with its md5 and sha256, and the completed object is checked against the
+    #expected SHA256 checksum (or multipart ETag), size and sha256. returns the manifest, which is also
+    #written next to the file and to key.manifest.json
+    client = client or boto3.client("s3", region_name = region, endpoint_url = endpoint_url,
+                                    config = Config(max_pool_connections = threads, retries = {"max_attempts": 10, "mode": "adaptive"}))
+    state_file = state_file or f"{path}.upload.json"
+    stat = os.stat(path)
+    file_identity = {"bucket": bucket, "key": key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    state = load_state(state_file)
+    done = None
+    if state is not None and state["file"] == file_identity:
+        done = uploaded_parts(client, bucket, key, state["upload_id"])
+    elif state is not None:
+        #the file changed since the interrupted upload, its parts are dropped rather than left on S3
+        try:
+            client.abort_multipart_upload(Bucket = state["file"]["bucket"], Key = state["file"]["key"], UploadId = state["upload_id"])
+        except ClientError:
+            pass
+    if done is None:
+        part_size = effective_part_size(stat.st_size, part_size)
+        parts = part_ranges(stat.st_size, part_size)
+        part_md5, part_sha256, sha256 = file_checksums(path, parts)
+        upload = client.create_multipart_upload(Bucket = bucket, Key = key, ContentType = "image/tiff", Metadata = {"sha256": sha256}, ChecksumAlgorithm = "SHA256")
+        state = {"file": file_identity, "upload_id": upload["UploadId"], "part_size": part_size, "sha256": sha256,
+                 "part_md5": {str(number): md5 for number, md5 in part_md5.items()},
+                 "part_sha256": {str(number): checksum for number, checksum in part_sha256.items()}}
+        save_state(state_file, state)
+        done = {}
+    else:
+        print(f"Resuming upload of {path}: {len(done)} parts already uploaded")
+    parts = part_ranges(stat.st_size, state["part_size"])
+    part_md5 = {int(number): md5 for number, md5 in state["part_md5"].items()}
+    part_sha256 = {int(number): checksum for number, checksum in state["part_sha256"].items()}
+    #parts S3 holds with the wrong content (e.g. a different file under the same key) are uploaded again
+    etags = {number: part["ETag"] for number, part in done.items() if number in part_md5 and part_matches(part, part_md5[number], part_sha256[number])}
+    todo = [part for part in parts if part[0] not in etags]
+
+    progress_columns = [TextColumn(f"[bold green]Uploading {os.path.basename(path)}"), BarColumn(), DownloadColumn(), TransferSpeedColumn(), TimeRemainingColumn()]
+    with Progress(*progress_columns) as progress, ThreadPoolExecutor(max_workers = threads) as executor:
+        task = progress.add_task("upload", total = stat.st_size, completed = sum(length for number, offset, length in parts if number in etags))
+        futures = {executor.submit(upload_part, client, bucket, key, state["upload_id"], path, number, offset, length, part_md5[number], part_sha256[number]): length for number, offset, length in todo}
+        for future in as_completed(futures):
+            number, etag = future.result()
+            etags[number] = etag
+            progress.advance(task, futures[future])
+
+    expected_etag, expected_checksum = multipart_checksums(part_md5, part_sha256)
+    client.complete_multipart_upload(Bucket = bucket, Key = key, UploadId = state["upload_id"],
+                                     MultipartUpload = {"Parts": [{"PartNumber": number, "ETag": etags[number], "ChecksumSHA256": part_sha256[number]} for number in sorted(etags)]})
+    head = client.head_object(Bucket = bucket, Key = key, ChecksumMode = "ENABLED")
+    etag = head["ETag"].strip('"')
+    problems = []
+    if head["ContentLength"] != stat.st_size:
+        problems.append(f"size {head['ContentLength']}, expected {stat.st_size}")
+    if head["Metadata"].get("sha256") != state["sha256"]:
+        problems.append(f"sha256 metadata {head['Metadata'].get('sha256')}, expected {state['sha256']}")
+    #S3 reports the checksum of a multipart object followed by -<part count>
+    if head.get("ChecksumSHA256"):
+        if head["ChecksumSHA256"].split("-")[0] != expected_checksum:
+            problems.append(f"SHA256 checksum {head['ChecksumSHA256']}, expected {expected_checksum}")
+    elif not (head.get("ServerSideEncryption", "").startswith("aws:kms") or "SSECustomerAlgorithm" in head) and etag != expected_etag:
+        problems.append(f"ETag {etag}, expected {expected_etag}")
+    if problems:
+        raise ValueError(f"s3://{bucket}/{key} does not match {path} after the upload: {', '.join(problems)}")
+
+    manifest = {"url": object_url(bucket, key, region, endpoint_url), "bucket": bucket, "key": key, "size": stat.st_size, "sha256": state["sha256"],
+                "etag": etag, "part_size": state["part_size"], "parts": len(part_md5), "data_version": data_version,
+                "uploaded": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+    with open(f"{path}.manifest.json", "w") as f:
+        json.dump(manifest, f, indent = 1)
+    client.put_object(Bucket = bucket, Key = f"{key}.manifest.json", Body = json.dumps(manifest, indent = 1).encode(), ContentType = "application/json")
+    os.remove(state_file)
+    return manifest
 
+def main():
+    parser = argparse.ArgumentParser(prog = "cog_creator.py", description = "publish a data packet COG to S3 with a parallel, resumable multipart upload and write its manifest")
+    parser.add_argument("file", type = str, nargs = "?", help = "COG to upload", default = "omeinfo_v2.tif")
+    parser.add_argument("--key", type = str, help = "object key, defaults to the file name", default = None)
+    parser.add_argument("--bucket", type = str, help = "S3 bucket", default = s3_bucket)
+    parser.add_argument("--region", type = str, help = "S3 region", default = s3_region)
+    parser.add_argument("--data_version", type = str, help = "data packet version recorded in the manifest", default = "2.0.0")
+    parser.add_argument("--part_size", type = int, help = "part size in MB (at least 5)", default = 64)
+    parser.add_argument("--threads", type = int, help = "number of parts uploaded at once", default = 8)
+    parser.add_argument("--endpoint_url", type = str, help = "S3 compatible endpoint to upload to instead of AWS (e.g. a local MinIO or moto server)", default = None)
+    args = parser.parse_args()
 
-#old uploads commented out.
-#print(upload_cog_s3(s3_key1, s3_bucket, "rurpopkoppov_v1_cog.tif"))
-#print(upload_cog_s3(s3_key2, s3_bucket, "co2_v1_cog.tif"))
-#print(upload_cog_s3(s3_key3, s3_bucket, "no2_v1_cog.tif"))
+    #old uploads: rurpopkop_v1_cog.tif, co2_v1_cog.tif and no2_v1_cog.tif as s3_key1 to s3_key3
+    manifest = publish_cog(args.file, args.bucket, args.key or os.path.basename(args.file), region = args.region, data_version = args.data_version,
+                           part_size = args.part_size * 1024 * 1024, threads = args.threads, endpoint_url = args.endpoint_url)
+    print(f"Upload successful: {manifest['url']} ({manifest['size']} bytes, sha256 {manifest['sha256']}, ETag {manifest['etag']})")
 
-print(upload_cog_s3(s3_key4, s3_bucket, "omeinfo_v2.tif"))
\ No newline at end of file
+if __name__ == "__main__":
+    main()
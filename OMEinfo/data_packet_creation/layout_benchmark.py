@@ -0,0 +1,155 @@
+#benchmarks data packet layouts for point lookups: an existing packet (e.g. omeinfo_v2.tif) is rewritten in
+#each layout, served from a local HTTP server with range support, and annotated with get_s3_point_data for
+#synthetic location sets. for every layout, distribution and size the bytes fetched, number of range
+#requests and lookups per second are written to a JSON file, so the layout a mirror is hosted in can be
+#picked by the range request bytes of its workload
+import argparse
+import functools
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.shutil
+from rio_tiler.errors import NoOverviewWarning
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from omeinfo import HTTPRangeSource, get_s3_point_data
+from build_packet import COG_DEFAULTS, cog_options
+
+#"cog" sections as in a build_packet.py spec. GDAL's COG driver only writes band interleaved files from
+#GDAL 3.11, band interleaved layouts are written as tiled GeoTIFFs instead (same tiles, no overviews,
+#which lookups do not read)
+LAYOUTS = {
+    "rio_cogeo_default": {"blocksize": 512, "compress": "deflate"},
+    "band_512_deflate": {"blocksize": 512, "compress": "deflate", "interleave": "band"},
+    "pixel_256_deflate": {"blocksize": 256, "compress": "deflate", "predictor": "yes"},
+    "pixel_128_deflate": {"blocksize": 128, "compress": "deflate", "predictor": "yes"},
+    "pixel_256_zstd": {"blocksize": 256, "compress": "zstd", "predictor": "yes"},
+    "pixel_128_zstd": {"blocksize": 128, "compress": "zstd", "predictor": "yes"},
+    "pixel_128_lerc_zstd": {"blocksize": 128, "compress": "lerc_zstd"},
+    "pixel_128_none": {"blocksize": 128, "compress": "none"},
+}
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    #serves single byte ranges (all HTTPRangeSource asks for) from the benchmark directory
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        ranged = self.headers.get("Range", "").startswith("bytes=")
+        if ranged:
+            first, last = self.headers["Range"][len("bytes="):].split("-")
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        self.send_response(206 if ranged else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(directory, handler_class = RangeRequestHandler):
+    handler = functools.partial(handler_class, directory = directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+def write_layout(packet, path, layout):
+    cog = {**COG_DEFAULTS, **layout}
+    if cog["interleave"] == "band":
+        options = {"TILED": "YES", "BLOCKXSIZE": cog["blocksize"], "BLOCKYSIZE": cog["blocksize"], "COMPRESS": cog["compress"].upper(), "INTERLEAVE": "BAND", "BIGTIFF": "IF_SAFER"}
+        rasterio.shutil.copy(packet, path, driver = "GTiff", **options)
+    else:
+        rasterio.shutil.copy(packet, path, driver = "COG", **cog_options(cog))
+    return path
+
+def locations(distribution, size, rng):
+    #synthetic location sets: uniform over the globe, clustered around 20 sites (about 1 degree spread),
+    #or dense around 3 sites (a few km spread, many locations share tiles)
+    if distribution == "uniform":
+        latitude, longitude = rng.uniform(-60, 75, size), rng.uniform(-180, 180, size)
+    else:
+        sites, spread = (20, 1.0) if distribution == "clustered" else (3, 0.03)
+        centres = np.column_stack([rng.uniform(-50, 65, sites), rng.uniform(-170, 170, sites)])
+        chosen = centres[rng.integers(0, sites, size)]
+        latitude = np.clip(chosen[:, 0] + rng.normal(0, spread, size), -89.9, 89.9)
+        longitude = np.clip(chosen[:, 1] + rng.normal(0, spread, size), -179.9, 179.9)
+    return pd.DataFrame({"sample": [f"s{i}" for i in range(size)], "latitude": latitude, "longitude": longitude})
+
+def measure(url, df, repeats):
+    #best of repeats, every run with new range sources (nothing cached between runs)
+    best = None
+    for _ in range(repeats):
+        sources = []
+        def range_source_factory(source_url):
+            source = HTTPRangeSource(source_url)
+            sources.append(source)
+            return source
+        start = time.perf_counter()
+        get_s3_point_data(df.copy(), "2.0.0", {}, {}, user_url = url, tile_cache = False, range_source_factory = range_source_factory)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": elapsed, "requests": sum(source.requests for source in sources), "bytes_fetched": sum(source.bytes_fetched for source in sources)}
+    best["lookups_per_second"] = len(df) / best["seconds"]
+    best["bytes_per_lookup"] = best["bytes_fetched"] / len(df)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(prog = "layout_benchmark.py", description = "compare data packet layouts for point lookups over HTTP range requests")
+    parser.add_argument("packet", type = str, help = "a six band v2 data packet geoTIFF to rewrite in each layout")
+    parser.add_argument("--layouts", type = str, help = "JSON file of {name: cog section} layouts to compare instead of the built in ones", default = None)
+    parser.add_argument("--distributions", type = str, help = "comma separated location distributions (uniform, clustered, dense)", default = "uniform,clustered,dense")
+    parser.add_argument("--sizes", type = str, help = "comma separated numbers of locations", default = "1000,10000")
+    parser.add_argument("--repeats", type = int, help = "runs per measurement, the fastest is reported", default = 3)
+    parser.add_argument("--work_dir", type = str, help = "directory to keep the layouts in, by default they are written to a temporary directory and removed", default = None)
+    parser.add_argument("--output", type = str, help = "JSON file to write the results to", default = "layout_benchmark.json")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    #the band interleaved layouts have no overviews, lookups never read them
+    warnings.filterwarnings("ignore", category = NoOverviewWarning)
+
+    layouts = LAYOUTS
+    if args.layouts:
+        with open(args.layouts) as f:
+            layouts = json.load(f)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix = "omeinfo_layouts_")
+    os.makedirs(work_dir, exist_ok = True)
+    server = serve(work_dir)
+    results = {"packet": os.path.abspath(args.packet), "layouts": {}, "runs": []}
+    for name, layout in layouts.items():
+        path = write_layout(args.packet, os.path.join(work_dir, f"{name}.tif"), layout)
+        with rasterio.open(path) as dataset:
+            results["layouts"][name] = {**layout, "file_bytes": os.path.getsize(path), "interleave": dataset.profile.get("interleave"), "block_shape": list(dataset.block_shapes[0])}
+        url = f"http://127.0.0.1:{server.server_address[1]}/{name}.tif"
+        for distribution in args.distributions.split(","):
+            for size in [int(size) for size in args.sizes.split(",")]:
+                df = locations(distribution, size, np.random.default_rng(args.seed))
+                run = {"layout": name, "distribution": distribution, "size": size, **measure(url, df, args.repeats)}
+                results["runs"].append(run)
+                print(f"{name:24} {distribution:10} {size:>8} {run['bytes_fetched'] / 1e6:10.2f} MB {run['requests']:6} requests {run['lookups_per_second']:10.0f} lookups/s")
+    server.shutdown()
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 1)
+    print(f"Results written to: {args.output}")
+
+if __name__ == "__main__":
+    main()
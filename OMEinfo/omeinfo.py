@@ -2,126 +2,1305 @@
 
 #should take as input a file and a data packet version? or a local filepath
 import argparse
+import asyncio
+import bisect
+import bz2
+import copy
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import math
+import multiprocessing
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+import numpy as np
 import pandas as pd
+import rasterio
 import requests
+from requests.adapters import HTTPAdapter
+from rasterio.coords import BoundingBox
+from rasterio.crs import CRS
+from rasterio.transform import Affine, array_bounds, rowcol
+from rasterio.warp import transform as transform_coords
+from rasterio.windows import Window
+from rio_tiler.errors import PointOutsideBounds
 from rio_tiler.io import Reader
 import os
 from rich.table import Table
 from rich.console import Console
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, ProgressColumn, TextColumn, TimeRemainingColumn
+from rich.text import Text
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 import datetime
 
-def get_s3_point_data(df, version, rurality_def, kg_def, coord_projection="EPSG:4326", user_url = None):
-    if version == "2.0.0":
-        if user_url:
-            s3_url = user_url
+HTTP_SESSION = None
+
+def http_session():
+    #one pooled keep-alive session per process, shared by every remote data packet read
+    global HTTP_SESSION
+    if HTTP_SESSION is None:
+        HTTP_SESSION = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = 32)
+        HTTP_SESSION.mount("http://", adapter)
+        HTTP_SESSION.mount("https://", adapter)
+    return HTTP_SESSION
+
+def is_remote(url):
+    return url.startswith("http://") or url.startswith("https://")
+
+def plan_range_reads(ranges, max_gap = 256 * 1024, max_request = 16 * 1024 * 1024):
+    #merge (start, end) byte ranges into as few reads as possible. ranges closer than max_gap are
+    #read together (fetching the gap is cheaper than another round trip), up to max_request bytes per read
+    planned = []
+    for start, end in sorted(ranges):
+        if planned and start - planned[-1][1] <= max_gap and max(end, planned[-1][1]) - planned[-1][0] <= max_request:
+            planned[-1][1] = max(planned[-1][1], end)
+        else:
+            planned.append([start, end])
+    return [tuple(r) for r in planned]
+
+class HTTPRangeSource:
+    #sparse in-memory view of a remote file built from HTTP range requests. GDAL reads the file through
+    #open() (a rasterio opener), so header reads are served with readahead and tile reads come from
+    #ranges fetched ahead of time by prefetch(), which coalesces them with plan_range_reads(). prefetched
+    #ranges are dropped again by release() once their tiles are decoded, sample_points prefetches at most
+    #max_buffer bytes (OMEINFO_RANGE_BUFFER_MB, 256 by default) at a time. failed requests are retried
+    #with exponential backoff, timeout applies to every request
+    def __init__(self, url, session = None, readahead = 64 * 1024, max_gap = 256 * 1024, max_request = 16 * 1024 * 1024, retries = 3, timeout = 60, backoff = 0.5, max_buffer = None):
+        self.url = url
+        self.location = url
+        self.session = session or http_session()
+        self.readahead = readahead
+        self.max_gap = max_gap
+        self.max_request = max_request
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        if max_buffer is None:
+            max_buffer = int(os.environ.get("OMEINFO_RANGE_BUFFER_MB", 256)) * 1024 * 1024
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self.size = None
+        self.etag = None
+        self.requests = 0
+        self.bytes_fetched = 0
+        self._starts = []
+        self._chunks = []
+        #starts of the chunks fetched by prefetch(), header reads are kept until the source is closed
+        self._prefetched = set()
+        #the first read follows any redirect (figshare serves downloads from a signed S3 url), later
+        #range requests go straight to the final location
+        self._fetch(0, readahead)
+
+    def _get(self, start, end):
+        #connection errors, timeouts and server errors are retried, client errors (e.g. 404) are not
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(self.location, headers = {"Range": f"bytes={start}-{end - 1}"}, timeout = self.timeout)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code < 500 or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def _fetch(self, start, end, prefetched = False):
+        response = self._get(start, end)
+        #fetches may run concurrently (see AsyncHTTPRangeSource), the chunk lists are only touched under the lock
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(response.content)
+            self.location = response.url
+            if self.etag is None:
+                self.etag = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if response.status_code == 200:
+                #server ignored the range header and sent the whole file
+                self.size = len(response.content)
+                self._starts, self._chunks = [0], [response.content]
+                self._prefetched = set()
+                return
+            if self.size is None:
+                self.size = int(response.headers["Content-Range"].rsplit("/", 1)[1])
+            i = bisect.bisect(self._starts, start)
+            self._starts.insert(i, start)
+            self._chunks.insert(i, response.content)
+            if prefetched:
+                self._prefetched.add(start)
+
+    def _missing(self, start, end):
+        #sub-ranges of [start, end) not held in memory yet
+        gaps = []
+        i = max(bisect.bisect(self._starts, start) - 1, 0)
+        position = start
+        while position < end and i < len(self._starts):
+            chunk_start, chunk_end = self._starts[i], self._starts[i] + len(self._chunks[i])
+            if chunk_end <= position:
+                i += 1
+                continue
+            if chunk_start > position:
+                gaps.append((position, min(chunk_start, end)))
+            position = max(position, chunk_end)
+            i += 1
+        if position < end:
+            gaps.append((position, end))
+        return gaps
+
+    def read(self, start, size):
+        end = min(start + size, self.size)
+        for gap_start, gap_end in self._missing(start, end):
+            #small header/IFD reads are extended up to the next cached chunk to save round trips
+            i = bisect.bisect(self._starts, gap_start)
+            limit = self._starts[i] if i < len(self._starts) else self.size
+            self._fetch(gap_start, min(max(gap_end, gap_start + self.readahead), limit))
+        data = bytearray()
+        i = max(bisect.bisect(self._starts, start) - 1, 0)
+        position = start
+        while position < end:
+            chunk_start, chunk = self._starts[i], self._chunks[i]
+            if chunk_start + len(chunk) > position:
+                data += chunk[position - chunk_start:end - chunk_start]
+                position = chunk_start + len(chunk)
+            i += 1
+        return bytes(data)
+
+    def prefetch(self, ranges):
+        missing = [gap for start, end in ranges for gap in self._missing(start, min(end, self.size))]
+        #coalesced reads may span chunks already held, only fetch what is still missing
+        planned = [gap for start, end in plan_range_reads(missing, self.max_gap, self.max_request) for gap in self._missing(start, end)]
+        self.fetch_planned(planned)
+
+    def fetch_planned(self, planned):
+        for start, end in planned:
+            self._fetch(start, end, prefetched = True)
+
+    def release(self):
+        #drops the prefetched ranges, anything read from them again is fetched again
+        with self._lock:
+            kept = [(start, chunk) for start, chunk in zip(self._starts, self._chunks) if start not in self._prefetched]
+            self._starts, self._chunks = [start for start, _ in kept], [chunk for _, chunk in kept]
+            self._prefetched = set()
+
+    def fork(self):
+        #a new source holding the ranges fetched so far (e.g. a file header read once and kept warm), made
+        #without any requests. ranges the fork fetches later stay with the fork, not with this source
+        with self._lock:
+            source = copy.copy(self)
+            source._lock = threading.Lock()
+            source._starts, source._chunks = list(self._starts), list(self._chunks)
+            source._prefetched = set(self._prefetched)
+        source.requests = 0
+        source.bytes_fetched = 0
+        return source
+
+    def open(self, path, mode = "rb"):
+        #rasterio opener interface. GDAL probes for sidecar files (.aux.xml, .msk), COGs never have them
+        if path != self.url:
+            raise FileNotFoundError(path)
+        return HTTPRangeFile(self)
+
+class AsyncHTTPRangeSource(HTTPRangeSource):
+    #HTTPRangeSource whose planned tile reads are issued concurrently on an asyncio event loop, with at
+    #most max_in_flight requests open at once. prefetch() is called from a worker thread (GDAL decoding
+    #runs there too) and blocks until the loop has fetched every range
+    def __init__(self, url, loop, max_in_flight = 16, **kwargs):
+        self.loop = loop
+        self.max_in_flight = max_in_flight
+        #smaller coalesced reads so that a large plan is spread over the concurrent requests
+        kwargs.setdefault("max_request", 4 * 1024 * 1024)
+        super().__init__(url, **kwargs)
+
+    def fetch_planned(self, planned):
+        asyncio.run_coroutine_threadsafe(self.fetch_concurrently(planned), self.loop).result()
+
+    async def fetch_concurrently(self, planned):
+        #requests is blocking, so every in flight request needs its own thread (the loop's default
+        #executor only has a handful)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        with ThreadPoolExecutor(max_workers = self.max_in_flight) as executor:
+            async def fetch(start, end):
+                async with semaphore:
+                    await self.loop.run_in_executor(executor, self._fetch, start, end, True)
+            await asyncio.gather(*(fetch(start, end) for start, end in planned))
+
+class HTTPRangeFile(io.RawIOBase):
+    #file-like cursor over a HTTPRangeSource, as returned to GDAL by the opener
+    def __init__(self, source):
+        self.source = source
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
         else:
-            s3_url = "https://figshare.com/ndownloader/files/44053304" #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/omeinfo_v2.tif
-        with Reader(s3_url) as cog:
-            rurality_values = []
-            pop_density_values = []
-            koppen_values = []
-            pov_values = []
-            co2_values = []
-            no2_values = []
-            error = []
-            for _, row in df.iterrows():
-                x, y = row["longitude"], row["latitude"]
-                # Read pixel values for all bands at coordinates (x, y)
+            self.position = self.source.size + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            size = self.source.size - self.position
+        data = self.source.read(self.position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def tile_byte_ranges(dataset, blocks, indexes):
+    #byte ranges of full resolution tiles from the TIFF tile offsets. pixel interleaved COGs store all
+    #bands in one tile, band interleaved files have one tile per band
+    if dataset.profile.get("interleave") == "pixel":
+        indexes = indexes[:1]
+    ranges = []
+    for block_row, block_col in blocks:
+        for bidx in indexes:
+            offset = dataset.get_tag_item(f"BLOCK_OFFSET_{block_col}_{block_row}", "TIFF", bidx = bidx)
+            size = dataset.get_tag_item(f"BLOCK_SIZE_{block_col}_{block_row}", "TIFF", bidx = bidx)
+            if offset and size and int(size) > 0:
+                ranges.append((int(offset), int(offset) + int(size)))
+    return ranges
+
+def tile_batches(dataset, blocks, cached_blocks, indexes, n_block_cols, max_bytes):
+    #splits the (block id, members) pairs of sample_points into batches whose tiles (those not cached)
+    #add up to at most max_bytes, each with the byte ranges to prefetch for it
+    batches = [([], [])]
+    size = 0
+    for block_id, members in blocks:
+        ranges = [] if block_id in cached_blocks else tile_byte_ranges(dataset, [(int(block_id // n_block_cols), int(block_id % n_block_cols))], indexes)
+        block_bytes = sum(end - start for start, end in ranges)
+        if batches[-1][0] and size + block_bytes > max_bytes:
+            batches.append(([], []))
+            size = 0
+        batches[-1][0].append((block_id, members))
+        batches[-1][1].extend(ranges)
+        size += block_bytes
+    return batches
+
+OPEN_COGS = {}
+
+@contextmanager
+def open_cog(url, range_source_factory = HTTPRangeSource):
+    #yields (Reader, HTTPRangeSource or None). remote packets are read through a HTTPRangeSource so
+    #that sample_points can plan and coalesce tile reads, anything else is opened by rio_tiler as before.
+    #packets opened with keep_cog_open are reused instead of being reopened
+    if url in OPEN_COGS:
+        yield OPEN_COGS[url]
+    elif is_remote(url):
+        range_source = range_source_factory(url)
+        with rasterio.open(url, opener = range_source.open) as dataset:
+            with Reader(url, dataset = dataset) as cog:
+                yield cog, range_source
+    else:
+        with Reader(url) as cog:
+            yield cog, None
+
+class TileCache:
+    #persistent content-addressed cache of decoded data packet tiles, shared by every process using the
+    #same directory. entries are written atomically (temp file + rename) so concurrent readers never see
+    #partial files, file mtimes record last use and the least recently used tiles are evicted once the
+    #directory grows past max_bytes
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._unchecked_bytes = max_bytes
+        #the counters are updated by every thread sampling tiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok = True)
+
+    def count(self, hits = 0, misses = 0, bytes_read = 0, bytes_written = 0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    def _path(self, key):
+        digest = hashlib.sha256("|".join(str(part) for part in key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.npy")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            tile = np.load(io.BytesIO(data), allow_pickle = False)
+            os.utime(path)
+        except (OSError, ValueError):
+            #missing, evicted by another process in the meantime, or unreadable
+            self.count(misses = 1)
+            return None
+        self.count(hits = 1, bytes_read = len(data))
+        return tile
+
+    def put(self, key, tile):
+        path = self._path(key)
+        buffer = io.BytesIO()
+        np.save(buffer, tile, allow_pickle = False)
+        data = buffer.getvalue()
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        #unique per thread as well as per process, threads of one process may write the same tile at once
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            #the cache is best effort, a full or read-only disk must not break annotation
+            return
+        with self._lock:
+            self.bytes_written += len(data)
+            self._unchecked_bytes += len(data)
+            #scanning the directory is not free, only check the budget after every ~10% of it is written
+            check = self._unchecked_bytes >= self.max_bytes // 10
+            if check:
+                self._unchecked_bytes = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".npy"):
+                        try:
+                            stat = os.stat(os.path.join(root, name))
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total = sum(size for _, size, _ in entries)
+            #evict down to 90% of the budget so the next few writes do not immediately evict again
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
                 try:
-                    pointdata = cog.point(x, y, coord_crs=coord_projection, indexes=[1, 2, 3, 4, 5, 6])
-                    pop_density_values.append(float(pointdata.data[0]))
-                    rurality_values.append(int(pointdata.data[1]))
-                    koppen_values.append(int(pointdata.data[2]))
-                    pov_values.append(int(pointdata.data[3]))
-                    co2_values.append(float(pointdata.data[4]))
-                    no2_values.append(float(pointdata.data[5]))
-                    error.append(None)
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = f"{100 * self.hits / lookups:.1f}%" if lookups else "n/a"
+        return f"Tile cache: {self.hits} hits, {self.misses} misses ({hit_rate} hit rate), {self.bytes_read / 1e6:.1f} MB read from cache, {self.bytes_written / 1e6:.1f} MB written"
+
+DEFAULT_TILE_CACHE = None
+
+def default_tile_cache():
+    #cache used when get_s3_point_data is not given one, configured with OMEINFO_CACHE_DIR and
+    #OMEINFO_CACHE_SIZE (in MB, 0 disables caching)
+    global DEFAULT_TILE_CACHE
+    if DEFAULT_TILE_CACHE is None:
+        max_mb = int(os.environ.get("OMEINFO_CACHE_SIZE", 2048))
+        if max_mb <= 0:
+            return None
+        directory = os.environ.get("OMEINFO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "omeinfo", "tiles"))
+        DEFAULT_TILE_CACHE = TileCache(directory, max_mb * 1024 * 1024)
+    return DEFAULT_TILE_CACHE
+
+class MemoryTileCache:
+    #in process LRU of decoded tiles in front of a TileCache (or nothing), for long running processes that
+    #look up a few points at a time and would otherwise decode the same tiles from disk again and again
+    def __init__(self, max_bytes, backing = None):
+        self.max_bytes = max_bytes
+        self.backing = backing
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._tiles = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def count(self, hits = 0, misses = 0, bytes_read = 0, bytes_written = 0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+        tile = self.backing.get(key) if self.backing else None
+        if tile is None:
+            self.count(misses = 1)
+            return None
+        self.count(hits = 1)
+        self._remember(key, tile)
+        return tile
+
+    def put(self, key, tile):
+        self._remember(key, tile)
+        if self.backing:
+            self.backing.put(key, tile)
+
+    def _remember(self, key, tile):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = tile
+            self._bytes += tile.nbytes
+            while self._bytes > self.max_bytes and self._tiles:
+                self._bytes -= self._tiles.popitem(last = False)[1].nbytes
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = f"{100 * self.hits / lookups:.1f}%" if lookups else "n/a"
+        return f"Tile cache: {self.hits} hits, {self.misses} misses ({hit_rate} hit rate), {len(self._tiles)} tiles ({self._bytes / 1e6:.1f} MB) in memory"
+
+def pixel_coordinates(dataset, xs, ys, coord_crs, errors):
+    #vectorised form of the point lookup in rio_tiler's point reader, for anything with the crs, transform,
+    #bounds, width and height of a rasterio dataset. returns the indexes of the points inside the raster and
+    #their pixel rows and columns, and fills in errors for the points outside it
+    xs = np.asarray(xs, dtype="float64")
+    ys = np.asarray(ys, dtype="float64")
+    if dataset.crs != coord_crs:
+        xs, ys = transform_coords(coord_crs, dataset.crs, xs, ys)
+        xs, ys = np.asarray(xs), np.asarray(ys)
+
+    #same (exclusive) bounds check as rio_tiler's point reader, NaN coordinates also fail it
+    left, bottom, right, top = dataset.bounds
+    bottom, top = min(bottom, top), max(bottom, top)
+    inside = (left < xs) & (xs < right) & (bottom < ys) & (ys < top)
+    point_idx = np.flatnonzero(inside)
+    rows = np.zeros(len(point_idx), dtype="int64")
+    cols = np.zeros(len(point_idx), dtype="int64")
+    if len(point_idx):
+        #vectorised form of dataset.index(), which only accepts scalar coordinates
+        rows, cols = rowcol(dataset.transform, xs[point_idx], ys[point_idx])
+        rows = np.asarray(rows, dtype="int64")
+        cols = np.asarray(cols, dtype="int64")
+    #floating point rounding at the raster edge can still land a point one pixel outside the grid
+    on_grid = (rows >= 0) & (rows < dataset.height) & (cols >= 0) & (cols < dataset.width)
+    inside[point_idx[~on_grid]] = False
+    for i in np.flatnonzero(~inside):
+        errors[i] = PointOutsideBounds("Point is outside dataset bounds")
+    return point_idx[on_grid], rows[on_grid], cols[on_grid]
+
+class SamplingStats:
+    #how much deduplication saved: locations annotated against the number of distinct raster pixels sampled
+    def __init__(self):
+        self.locations = 0
+        self.pixels = 0
+        #updated by every thread sampling the packet (e.g. the Dash app's job and API threads)
+        self._lock = threading.Lock()
+
+    def count(self, locations = 0, pixels = 0):
+        with self._lock:
+            self.locations += locations
+            self.pixels += pixels
+
+    def summary(self):
+        ratio = f"{self.locations / self.pixels:.1f}x" if self.pixels else "n/a"
+        return f"Deduplication: {self.locations} locations sampled as {self.pixels} unique pixels ({ratio})"
+
+SAMPLING_STATS = SamplingStats()
+
+def unique_pixels(rows, cols, width, stats = None):
+    #collapses repeated pixels (replicates, time series, nearby sites) so that each is sampled once.
+    #returns the unique rows and columns and, for every input point, the position of its pixel in them
+    pixels, inverse = np.unique(rows * width + cols, return_inverse = True)
+    if stats is not None:
+        stats.count(pixels = len(pixels))
+    return pixels // width, pixels % width, inverse.reshape(-1)
+
+def sample_points(cog, xs, ys, indexes, coord_crs="EPSG:4326", range_source = None, tile_cache = None, cache_namespace = (), stats = None):
+    #batch equivalent of calling cog.point() for every coordinate. all coordinates are transformed
+    #to the raster crs in one call, then samples are grouped by internal COG tile so that each tile
+    #is read once (for all requested bands) and the pixel values are gathered with fancy indexing.
+    #returns an (n_points, n_bands) array of raw pixel values and a list of per-point errors (None if ok).
+    #with a range_source the byte ranges of the needed tiles are fetched ahead in coalesced requests, in
+    #batches of at most range_source.max_buffer bytes that are released once decoded.
+    #with a tile_cache decoded tiles are looked up under cache_namespace before anything is read.
+    #points falling in the same pixel are sampled once, stats (a SamplingStats) counts the unique pixels
+    dataset = cog.dataset
+    values = np.zeros((len(xs), len(indexes)), dtype=dataset.dtypes[indexes[0] - 1])
+    errors = [None] * len(xs)
+    if len(xs) == 0:
+        return values, errors
+    point_idx, rows, cols = pixel_coordinates(dataset, xs, ys, coord_crs, errors)
+    rows, cols, pixel_of_point = unique_pixels(rows, cols, dataset.width, stats)
+    pixel_values = np.zeros((len(rows), len(indexes)), dtype = values.dtype)
+    pixel_errors = {}
+
+    block_height, block_width = dataset.block_shapes[0]
+    n_block_cols = -(-dataset.width // block_width)
+    block_ids = (rows // block_height) * n_block_cols + cols // block_width
+    order = np.argsort(block_ids, kind="stable")
+    unique_blocks, starts = np.unique(block_ids[order], return_index=True)
+    cached_blocks = {}
+    if tile_cache is not None:
+        for block_id in unique_blocks:
+            tile = tile_cache.get(cache_namespace + (tuple(indexes), int(block_id // n_block_cols), int(block_id % n_block_cols)))
+            if tile is not None:
+                cached_blocks[block_id] = tile
+    blocks = list(zip(unique_blocks, np.split(order, starts[1:])))
+    batches = [(blocks, [])]
+    if range_source is not None and len(unique_blocks) > len(cached_blocks):
+        try:
+            batches = tile_batches(dataset, blocks, cached_blocks, indexes, n_block_cols, range_source.max_buffer)
+        except Exception:
+            pass
+    for batch, ranges in batches:
+        if ranges:
+            try:
+                range_source.prefetch(ranges)
+            except Exception:
+                #prefetching is an optimisation only, failed tiles are retried (and reported) by the reads below
+                pass
+        for block_id, members in batch:
+            row_off = int(block_id // n_block_cols) * block_height
+            col_off = int(block_id % n_block_cols) * block_width
+            block = cached_blocks.get(block_id)
+            if block is None:
+                window = Window(col_off, row_off, min(block_width, dataset.width - col_off), min(block_height, dataset.height - row_off))
+                try:
+                    block = dataset.read(indexes, window=window)
                 except Exception as e:
-                    pop_density_values.append(None)
-                    rurality_values.append(None)
-                    koppen_values.append(None)
-                    pov_values.append(None)
-                    co2_values.append(None)
-                    no2_values.append(None)
-                    error.append(e)
-            df["rurality_id"] = rurality_values
-            df["Population Density"] = pop_density_values
-            df["koppen_geiger_id"] = koppen_values
-            df["Relative Deprivation"] = pov_values
-            df["Tropospheric Nitrogen Dioxide Emissions"] = no2_values
-            df["Fossil Fuel CO2 emissions"] = co2_values
-            df["error"] = error
-    
+                    for j in members:
+                        pixel_errors[j] = e
+                    continue
+                if tile_cache is not None:
+                    tile_cache.put(cache_namespace + (tuple(indexes), row_off // block_height, col_off // block_width), block)
+            pixel_values[members] = block[:, rows[members] - row_off, cols[members] - col_off].T
+        if ranges:
+            range_source.release()
+    values[point_idx] = pixel_values[pixel_of_point]
+    if pixel_errors:
+        for i, j in zip(point_idx, pixel_of_point):
+            if j in pixel_errors:
+                errors[i] = pixel_errors[j]
+    return values, errors
+
+BAND_STORE_METADATA = "omeinfo_band_store.json"
+OPEN_BAND_STORES = {}
+
+class BandStore:
+    #an uncompressed copy of a data packet written by prepare-local: one .npy array per band, memory
+    #mapped so that opening is instant and the page cache is shared between every process using it.
+    #has the crs, transform, bounds, width and height of a rasterio dataset for pixel_coordinates
+    def __init__(self, directory):
+        with open(os.path.join(directory, BAND_STORE_METADATA)) as f:
+            metadata = json.load(f)
+        self.directory = directory
+        self.metadata = metadata
+        self.crs = CRS.from_wkt(metadata["crs"])
+        self.transform = Affine(*metadata["transform"][:6])
+        self.width = metadata["width"]
+        self.height = metadata["height"]
+        self.bounds = BoundingBox(*array_bounds(self.height, self.width, self.transform)[:4])
+        self.bands = [np.load(os.path.join(directory, name), mmap_mode = "r") for name in metadata["bands"]]
+
+def is_band_store(url):
+    return not is_remote(url) and os.path.isfile(os.path.join(url, BAND_STORE_METADATA))
+
+def open_band_store(directory):
+    #band stores are opened once per process and reused, mapping a file costs nothing until pages are read
+    if directory not in OPEN_BAND_STORES:
+        OPEN_BAND_STORES[directory] = BandStore(directory)
+    return OPEN_BAND_STORES[directory]
+
+def sample_band_store(store, xs, ys, indexes, coord_crs = "EPSG:4326", stats = None):
+    #same result as sample_points, but the pixels are gathered straight from the memory mapped bands
+    values = np.zeros((len(xs), len(indexes)), dtype = store.bands[indexes[0] - 1].dtype)
+    errors = [None] * len(xs)
+    if len(xs) == 0:
+        return values, errors
+    point_idx, rows, cols = pixel_coordinates(store, xs, ys, coord_crs, errors)
+    rows, cols, pixel_of_point = unique_pixels(rows, cols, store.width, stats)
+    for i, index in enumerate(indexes):
+        values[point_idx, i] = store.bands[index - 1][rows, cols][pixel_of_point]
+    return values, errors
+
+def prepare_band_store(source, directory, console = None):
+    #converts a data packet geotiff into a band store, reading one internal tile at a time so memory use
+    #stays low. the metadata file is written last, a directory without it is never used as a band store
+    with rasterio.open(source) as dataset:
+        needed = dataset.count * dataset.width * dataset.height * np.dtype(dataset.dtypes[0]).itemsize
+        os.makedirs(directory, exist_ok = True)
+        free = shutil.disk_usage(directory).free
+        if needed > free:
+            raise OSError(f"Band store needs {needed / 1e9:.1f} GB but only {free / 1e9:.1f} GB is free in {directory}")
+        metadata_file = os.path.join(directory, BAND_STORE_METADATA)
+        if os.path.exists(metadata_file):
+            os.remove(metadata_file)
+        band_files = [f"band_{index}.npy" for index in dataset.indexes]
+        bands = [np.lib.format.open_memmap(os.path.join(directory, name), mode = "w+", dtype = dataset.dtypes[index - 1], shape = (dataset.height, dataset.width))
+                 for index, name in zip(dataset.indexes, band_files)]
+        windows = [window for _, window in dataset.block_windows(1)]
+        with Progress(TextColumn("[bold green]Writing band store"), BarColumn(), MofNCompleteColumn(), TimeRemainingColumn(), console = console, disable = console is None) as progress:
+            task = progress.add_task("Writing band store", total = len(windows))
+            for window in windows:
+                block = dataset.read(window = window)
+                rows, cols = window.toslices()
+                for band, data in zip(bands, block):
+                    band[rows, cols] = data
+                progress.advance(task)
+        for band in bands:
+            band.flush()
+        del bands
+        stat = os.stat(source)
+        metadata = {"source": {"path": os.path.abspath(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+                    "crs": dataset.crs.to_wkt(), "transform": list(dataset.transform), "width": dataset.width, "height": dataset.height,
+                    "nodata": dataset.nodata, "descriptions": list(dataset.descriptions), "bands": band_files}
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f, indent = 1)
+    return needed
+
+def prepare_local(argv):
+    parser = argparse.ArgumentParser(prog = "omeinfo.py prepare-local", description = "Convert a locally stored data packet geoTIFF into an uncompressed, memory mapped band store. Pass the band store directory as --source_data to annotate from it.")
+    parser.add_argument("--source_data", type = str, help = "locally stored data packet geoTIFF (e.g. omeinfo_v2.tif)", required = True)
+    parser.add_argument("--output_dir", type = str, help = "directory to write the band store to, defaults to the geoTIFF name without its extension followed by _bands", default = None)
+    args = parser.parse_args(argv)
+    console = Console()
+    output_dir = args.output_dir or f"{os.path.splitext(args.source_data)[0]}_bands"
+    size = prepare_band_store(args.source_data, output_dir, console)
+    console.print(f"Band store written to {output_dir} ({size / 1e9:.2f} GB)", style = "bold green")
+    console.print(f"Annotate from it with: omeinfo.py --source_data {output_dir}", style = "bold green")
+
+def band_column(values, ok, dtype):
+    #build an output column matching the per-row path: failed rows are missing, and integer
+    #columns fall back to float so that they can hold NaN
+    if dtype == "int" and ok.all():
+        return values.astype("int64")
+    column = values.astype("float64")
+    column[~ok] = np.nan
+    return column
+
+def raise_first_error(errors):
+    for e in errors:
+        if e is not None:
+            raise e
+
+def cache_settings(version, url, range_source, tile_cache):
+    #only remote packets are cached, tiles are keyed by data version, url and the ETag of the file
+    #so a republished packet never serves stale tiles. tile_cache = False disables caching
+    if range_source is None or tile_cache is False:
+        return None, ()
+    if tile_cache is None:
+        tile_cache = default_tile_cache()
+    return tile_cache, (version, url, range_source.etag or range_source.size)
+
+def data_packet_urls(version, user_url = None):
+    #urls of the files making up a data packet version, v1 is split across three files
+    if version == "2.0.0":
+        if user_url:
+            return [user_url]
+        return ["https://figshare.com/ndownloader/files/44053304"] #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/omeinfo_v2.tif
     elif version == "1.0.0":
         if user_url:
-            user_url = user_url.split(",")
-            s3_url_rur_pop_kop = user_url[0]
-            s3_url_co2 = user_url[1]
-            s3_url_no2 = user_url[2]
-        else:
-            s3_url_rur_pop_kop = f"https://figshare.com/ndownloader/files/44053298" #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/rurpopkop_v1_cog.tif
-            s3_url_co2 = f"https://figshare.com/ndownloader/files/44053301" #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/co2_v1_cog.tif
-            s3_url_no2 = f"https://figshare.com/ndownloader/files/44051945" #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/no2_v1_cog.tif
-        with Reader(s3_url_rur_pop_kop) as cog:
-            rurality_values = []
-            pop_density_values = []
-            koppen_values = []
-            
-            for _, row in df.iterrows():
-                x, y = row["longitude"], row["latitude"]
-                # Read pixel values for all bands at coordinates (x, y)
-                pointdata = cog.point(x, y, coord_crs=coord_projection, indexes=[1, 2, 3])
-                
-                rurality_values.append(int(pointdata.data[0]))
-                pop_density_values.append(float(pointdata.data[1]))
-                koppen_values.append(int(pointdata.data[2]))
-            
-            df["rurality_id"] = rurality_values
-            df["Population Density"] = pop_density_values
-            df["koppen_geiger_id"] = koppen_values
-        with Reader(s3_url_co2) as cog:
-            co2_values = []
-            for _, row in df.iterrows():
-                x, y = row["longitude"], row["latitude"]
-                # Read pixel values for all bands at coordinates (x, y)
-                pointdata = cog.point(x, y, coord_crs=coord_projection, indexes=[1])
-                co2_values.append(float(pointdata.data[0]))
-            
-            df["Fossil Fuel CO2 emissions"] = co2_values
-        with Reader(s3_url_no2) as cog:    
-            no2_values = []
-            for _, row in df.iterrows():
-                x, y = row["longitude"], row["latitude"]
-                # Read pixel values for all bands at coordinates (x, y)
-                pointdata = cog.point(x, y, coord_crs=coord_projection, indexes=[1])
-                no2_values.append(float(pointdata.data[0]))
-            
-            df["Tropospheric Nitrogen Dioxide Emissions"] = no2_values
+            return user_url.split(",")[:3]
+        return ["https://figshare.com/ndownloader/files/44053298", #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/rurpopkop_v1_cog.tif
+                "https://figshare.com/ndownloader/files/44053301", #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/co2_v1_cog.tif
+                "https://figshare.com/ndownloader/files/44051945"] #https://cloudgeotiffbucket.s3.eu-north-1.amazonaws.com/no2_v1_cog.tif
     else: 
         raise ValueError("Invalid version number. Must be 1.0.0 or 2.0.0")
-    
-    df["Rurality"] = df['rurality_id'].astype("str").map(rurality_def)
-    df["Koppen Geiger"] = df["koppen_geiger_id"].astype("str").map(kg_def)
-    
+
+def sample_url(url, version, xs, ys, indexes, coord_projection, tile_cache, range_source_factory = HTTPRangeSource, stats = None):
+    if is_band_store(url):
+        return sample_band_store(open_band_store(url), xs, ys, indexes, coord_crs = coord_projection, stats = stats)
+    with open_cog(url, range_source_factory) as (cog, range_source):
+        cache, namespace = cache_settings(version, url, range_source, tile_cache)
+        return sample_points(cog, xs, ys, indexes, coord_crs = coord_projection, range_source = range_source, tile_cache = cache, cache_namespace = namespace, stats = stats)
+
+class NoDataError(ValueError):
+    #a nodata pixel where the packet should hold a whole number id
+    pass
+
+def sample_data_packet(df, version, coord_projection="EPSG:4326", user_url = None, tile_cache = None, range_source_factory = HTTPRangeSource):
+    #adds the raw data packet columns (ids and values, no legend labels) to df
+    urls = data_packet_urls(version, user_url)
+    xs, ys = df["longitude"].to_numpy(), df["latitude"].to_numpy()
+    #deduplication is reported against the first (v1: rurality/population/koppen) file of the packet
+    SAMPLING_STATS.count(locations = len(df))
+    if version == "2.0.0":
+        values, error = sample_url(urls[0], version, xs, ys, [1, 2, 3, 4, 5, 6], coord_projection, tile_cache, range_source_factory, stats = SAMPLING_STATS)
+        ok = np.array([e is None for e in error], dtype = bool)
+        #id bands must be whole numbers, a nodata NaN here cannot be converted so the row is marked as failed
+        nan_ids = ok & ~np.isfinite(values[:, [1, 2, 3]].astype("float64")).all(axis = 1)
+        for i in np.flatnonzero(nan_ids):
+            error[i] = NoDataError("cannot convert float NaN to integer")
+        ok &= ~nan_ids
+        df["rurality_id"] = band_column(values[:, 1], ok, "int")
+        df["Population Density"] = band_column(values[:, 0], ok, "float")
+        df["koppen_geiger_id"] = band_column(values[:, 2], ok, "int")
+        df["Relative Deprivation"] = band_column(values[:, 3], ok, "int")
+        df["Tropospheric Nitrogen Dioxide Emissions"] = band_column(values[:, 5], ok, "float")
+        df["Fossil Fuel CO2 emissions"] = band_column(values[:, 4], ok, "float")
+        df["error"] = error
+    else:
+        #v1 has no per-row error handling, the first failed point aborts the annotation
+        rur_pop_kop_values, errors = sample_url(urls[0], version, xs, ys, [1, 2, 3], coord_projection, tile_cache, range_source_factory, stats = SAMPLING_STATS)
+        raise_first_error(errors)
+        co2_values, errors = sample_url(urls[1], version, xs, ys, [1], coord_projection, tile_cache, range_source_factory)
+        raise_first_error(errors)
+        no2_values, errors = sample_url(urls[2], version, xs, ys, [1], coord_projection, tile_cache, range_source_factory)
+        raise_first_error(errors)
+        ok = np.ones(len(df), dtype = bool)
+        df["rurality_id"] = band_column(rur_pop_kop_values[:, 0], ok, "int")
+        df["Population Density"] = band_column(rur_pop_kop_values[:, 1], ok, "float")
+        df["koppen_geiger_id"] = band_column(rur_pop_kop_values[:, 2], ok, "int")
+        df["Fossil Fuel CO2 emissions"] = band_column(co2_values[:, 0], ok, "float")
+        df["Tropospheric Nitrogen Dioxide Emissions"] = band_column(no2_values[:, 0], ok, "float")
+    return df
+
+class Legend:
+    #a legend (id -> definition) compiled for lookups: the definitions are the categories and codes is a
+    #dense array from id to category code (-1 for ids the legend does not have), so labelling a column of
+    #ids is an integer gather instead of a string conversion and dict lookup per row
+    def __init__(self, ids, definitions):
+        ids = np.asarray(ids, dtype = "int64")
+        definitions = pd.Series(definitions, dtype = object)
+        self.categories = pd.Index(definitions.dropna().unique(), dtype = object)
+        self.codes = np.full(ids.max() + 1 if len(ids) else 0, -1, dtype = "int16")
+        self.codes[ids] = self.categories.get_indexer(definitions)
+        #label of each code, code -1 (the last entry) is NaN
+        self.label_array = np.append(self.categories.to_numpy(), np.nan)
+
+    @classmethod
+    def from_dict(cls, definitions):
+        return cls([int(float(i)) for i in definitions], list(definitions.values()))
+
+    def codes_of(self, ids):
+        #category codes of a column of ids, which may be float (failed rows are NaN) or nullable integers
+        values = pd.Series(ids).to_numpy(dtype = "float64", na_value = np.nan)
+        known = np.isfinite(values) & (values >= 0) & (values < len(self.codes)) & (values == np.floor(values))
+        codes = np.full(len(values), -1, dtype = "int16")
+        codes[known] = self.codes[values[known].astype("int64")]
+        return codes
+
+    def labels(self, ids):
+        #an object column of labels (NaN where the id is unknown or missing), indexed like ids
+        return pd.Series(self.label_array[self.codes_of(ids)], index = ids.index, dtype = object)
+
+    def categorical(self, ids):
+        return pd.Categorical.from_codes(self.codes_of(ids), categories = self.categories)
+
+def as_legend(definitions):
+    #legends can also be given as {id: definition} dicts
+    return definitions if isinstance(definitions, Legend) else Legend.from_dict(definitions)
+
+def load_legend(path):
+    #legend files are tab separated, rows separated by runs of spaces are read too
+    definitions = pd.read_csv(path, sep = r"\t|\s{2,}", engine = "python", dtype = {"id": "int64", "definition": object})
+    return Legend(definitions["id"], definitions["definition"])
+
+def add_legend_labels(df, rurality_def, kg_def):
+    df["Rurality"] = as_legend(rurality_def).labels(df["rurality_id"])
+    df["Koppen Geiger"] = as_legend(kg_def).labels(df["koppen_geiger_id"])
     return df
 
+def get_s3_point_data(df, version, rurality_def, kg_def, coord_projection="EPSG:4326", user_url = None, tile_cache = None, range_source_factory = HTTPRangeSource):
+    df = sample_data_packet(df, version, coord_projection = coord_projection, user_url = user_url, tile_cache = tile_cache, range_source_factory = range_source_factory)
+    return add_legend_labels(df, rurality_def, kg_def)
+
+async def get_s3_point_data_async(df, version, rurality_def, kg_def, coord_projection="EPSG:4326", user_url = None, tile_cache = None, max_in_flight = 16, retries = 3, timeout = 30):
+    #coroutine version of get_s3_point_data for high latency storage: tile reads of remote packets are
+    #issued concurrently (max_in_flight at a time) with retries and per request timeouts, while decoding
+    #and sampling run in a worker thread so the event loop stays responsive
+    loop = asyncio.get_running_loop()
+    def range_source_factory(url):
+        return AsyncHTTPRangeSource(url, loop, max_in_flight = max_in_flight, retries = retries, timeout = timeout)
+    df = await asyncio.to_thread(sample_data_packet, df, version, coord_projection, user_url, tile_cache, range_source_factory)
+    return add_legend_labels(df, rurality_def, kg_def)
+
+class Coalescer:
+    #micro-batching for lookups that arrive a few points at a time from many callers (e.g. a web API).
+    #submitted requests are collected until window seconds after the first one arrived, or until max_rows
+    #rows are waiting, and handed to process as one batch on a worker thread, so a burst of lookups shares
+    #one grouped tile read. process is called with a list of requests and returns a result for each, size
+    #gives the number of rows in a request. submit returns a Future of the request's result
+    def __init__(self, process, window = 0.005, max_rows = 50000, workers = 1, size = len):
+        self.process = process
+        self.window = window
+        self.max_rows = max_rows
+        self.workers = workers
+        self.size = size
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        with self._lock:
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = threading.Thread(target = self._run, name = f"omeinfo-coalescer-{i}", daemon = True)
+                    thread.start()
+                    self._threads.append(thread)
+        future = Future()
+        self._queue.put((request, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        rows = self.size(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while rows < self.max_rows:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout = remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+            rows += self.size(batch[-1][0])
+        return batch
+
+    def _run(self):
+        while True:
+            self._process_batch(self._collect())
+
+    def _process_batch(self, batch):
+        try:
+            results = self.process([request for request, future in batch])
+        except Exception as e:
+            if len(batch) > 1:
+                #e.g. v1 packets abort on the first failed point, the requests are retried alone so only the
+                #request with that point fails
+                for item in batch:
+                    self._process_batch([item])
+                return
+            batch[0][1].set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.requests += len(batch)
+        for (request, future), result in zip(batch, results):
+            future.set_result(result)
+
+def keep_cog_open(url, stack):
+    #open a data packet file once for the lifetime of stack, later open_cog(url) calls reuse it
+    if is_band_store(url):
+        return
+    OPEN_COGS[url] = stack.enter_context(open_cog(url))
+    #callbacks run before the dataset is closed, so no later lookup finds it closed
+    stack.callback(OPEN_COGS.pop, url, None)
+
+def spatial_order(latitudes, longitudes):
+    #row order along a z-order (morton) curve over a 65536 x 65536 lat/lon grid, so that consecutive
+    #rows are close together and a contiguous run of rows touches a compact set of tiles
+    def spread_bits(v):
+        v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+        v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+        v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+        v = (v | (v << 2)) & 0x3333333333333333
+        return (v | (v << 1)) & 0x5555555555555555
+    x = np.nan_to_num((np.asarray(longitudes, dtype = "float64") + 180) / 360 * 65535).clip(0, 65535).astype("uint64")
+    y = np.nan_to_num((np.asarray(latitudes, dtype = "float64") + 90) / 180 * 65535).clip(0, 65535).astype("uint64")
+    return np.argsort(spread_bits(x) | (spread_bits(y) << np.uint64(1)), kind = "stable")
+
+WORKER_STATE = {}
+
+def init_annotation_worker(version, user_url, coord_projection, cache_dir, cache_size):
+    #runs once in every pool process: opens the data packet (one Reader per file) and the tile cache
+    global HTTP_SESSION
+    HTTP_SESSION = None
+    stack = ExitStack()
+    for url in data_packet_urls(version, user_url):
+        keep_cog_open(url, stack)
+    WORKER_STATE.update(version = version, user_url = user_url, coord_projection = coord_projection, stack = stack,
+                        tile_cache = TileCache(cache_dir, cache_size) if cache_dir else False)
+
+def annotate_shard(shard):
+    tile_cache = WORKER_STATE["tile_cache"]
+    before = cache_counters(tile_cache)
+    shard = sample_data_packet(shard, WORKER_STATE["version"], coord_projection = WORKER_STATE["coord_projection"], user_url = WORKER_STATE["user_url"], tile_cache = tile_cache)
+    return shard, [after - start for start, after in zip(before, cache_counters(tile_cache))]
+
+def cache_counters(tile_cache):
+    #tile cache and deduplication counters of this process, pool workers send back the change per shard
+    sampling = [SAMPLING_STATS.locations, SAMPLING_STATS.pixels]
+    if not tile_cache:
+        return [0, 0, 0, 0] + sampling
+    return [tile_cache.hits, tile_cache.misses, tile_cache.bytes_read, tile_cache.bytes_written] + sampling
+
+def annotation_pool(workers, version, user_url = None, coord_projection="EPSG:4326", tile_cache = None):
+    #process pool for annotate_in_parallel, can be reused across calls (e.g. for every chunk of a file)
+    if tile_cache is None:
+        tile_cache = default_tile_cache() or False
+    cache_dir, cache_size = (tile_cache.directory, tile_cache.max_bytes) if tile_cache else (None, 0)
+    #spawn rather than fork: GDAL handles and pooled HTTP connections must not be shared with children
+    return ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("spawn"), initializer = init_annotation_worker,
+                               initargs = (version, user_url, coord_projection, cache_dir, cache_size))
+
+def annotate_in_parallel(df, version, rurality_def, kg_def, workers, coord_projection="EPSG:4326", user_url = None, tile_cache = None, shard_size = 50000, progress = None, pool = None):
+    #get_s3_point_data split over a pool of processes. rows are sorted along a spatial curve and cut
+    #into shards so that each worker reads few tiles, then results are put back in the input order.
+    #progress is called with the number of rows finished as each shard completes
+    if tile_cache is None:
+        tile_cache = default_tile_cache() or False
+    shard_size = max(1, min(shard_size, math.ceil(len(df) / (workers * 4))))
+    order = spatial_order(df["latitude"].to_numpy(), df["longitude"].to_numpy())
+    shards = [order[i:i + shard_size] for i in range(0, len(order), shard_size)]
+    if not shards:
+        return get_s3_point_data(df, version, rurality_def, kg_def, coord_projection = coord_projection, user_url = user_url, tile_cache = tile_cache)
+    results = [None] * len(shards)
+    with ExitStack() as stack:
+        if pool is None:
+            pool = stack.enter_context(annotation_pool(workers, version, user_url = user_url, coord_projection = coord_projection, tile_cache = tile_cache))
+        futures = {pool.submit(annotate_shard, df.iloc[shard]): i for i, shard in enumerate(shards)}
+        for future in as_completed(futures):
+            results[futures[future]], counters = future.result()
+            if tile_cache:
+                tile_cache.count(*counters[:4])
+            SAMPLING_STATS.count(*counters[4:6])
+            if progress:
+                progress(len(results[futures[future]]))
+    annotated = pd.concat(results).iloc[np.argsort(np.concatenate(shards), kind = "stable")]
+    #labels are added after reassembly so that they are derived from the combined id columns
+    return add_legend_labels(annotated, rurality_def, kg_def)
+
+def read_locations(location_file, location = None, chunksize = None, skip_rows = 0, skip_location = False):
+    #yields (location table, from file) pairs: the rows of a CSV/TSV file (in chunks of chunksize rows
+    #if given, after skipping the first skip_rows rows), followed by the single --location sample
+    if location_file:
+        if location_file.endswith('.csv'):
+            delimiter = ','
+        elif location_file.endswith('.tsv'):
+            delimiter = '\t'
+        else:
+            raise ValueError("File format not supported. Please provide a CSV or TSV file.")
+        skiprows = range(1, skip_rows + 1) if skip_rows else None
+        if chunksize:
+            for chunk in pd.read_csv(location_file, delimiter = delimiter, chunksize = chunksize, skiprows = skiprows):
+                yield chunk, True
+        else:
+            yield pd.read_csv(location_file, delimiter = delimiter, skiprows = skiprows), True
+    if location and not skip_location:
+        individual_locations_df = pd.DataFrame([location.split(",")], columns = ["sample", "latitude", "longitude"])
+        yield individual_locations_df, False
+
+def run_identity(args):
+    #what a checkpoint belongs to: the exact input file (path, size, modification time) and the
+    #settings that change the output
+    identity = {"location_file": None, "location": args.location, "data_version": args.data_version, "source_data": args.source_data}
+    if args.output_format != "tsv" or args.compression != "none":
+        identity["output"] = {"format": args.output_format, "compression": args.compression}
+    if args.location_file:
+        stat = os.stat(args.location_file)
+        identity["location_file"] = {"path": os.path.abspath(args.location_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    return identity
+
+def load_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def checkpoint_output_intact(checkpoint, output_file, output_format, rejected_file):
+    #whether everything written before the checkpoint is still there: at least the recorded bytes of the
+    #tsv output and rejected files (a missing file counts as 0 bytes), or every recorded columnar part
+    def size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    if size(rejected_file) < checkpoint["rejected_bytes"]:
+        return False
+    if output_format == "tsv":
+        return size(output_file) >= checkpoint["output_bytes"]
+    parts = output_parts(output_file, output_format) if os.path.isdir(output_file) else {}
+    return all(number in parts for number in range(checkpoint["output_parts"]))
+
+def save_checkpoint(checkpoint_file, checkpoint):
+    #written to a temporary file and renamed, so the checkpoint on disk is always complete
+    temp_file = f"{checkpoint_file}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(checkpoint, f, indent = 1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, checkpoint_file)
+
+LAT_LON_COLUMNS = ["lat_lon", "lat_long", "latlon", "coordinates"]
+
+DMS_PATTERN = (r"(?i)^\s*(?P<sign>[-+])?\s*(?P<prefix>[NSEWnsew])?\s*(?P<degrees>\d+(?:\.\d+)?)\s*(?:°|º|deg|d|:)?\s*"
+               r"(?:(?P<minutes>\d+(?:\.\d+)?)\s*(?:'|′|min|m|:)?\s*)?"
+               r"(?:(?P<seconds>\d+(?:\.\d+)?)\s*(?:\"|″|''|sec|s)?\s*)?(?P<suffix>[NSEWnsew])?\s*$")
+
+def parse_coordinates(values, hemispheres):
+    #numeric columns pass straight through. text is parsed as decimal degrees, or as degrees/minutes/seconds
+    #with an optional sign or hemisphere letter. hemispheres is "NS" for latitudes (51°30'26"N, 51 30 26 N,
+    #N51:30:26) or "EW" for longitudes (0d7m39sW, W 0 7 39), the second letter being negative, and the
+    #letters of the other axis do not parse. returns float degrees, NaN where it cannot be parsed
+    if pd.api.types.is_numeric_dtype(values):
+        return values
+    parsed = pd.to_numeric(values, errors = "coerce").astype("float64")
+    todo = parsed.isna() & values.notna()
+    if todo.any():
+        parts = values[todo].astype(str).str.extract(DMS_PATTERN)
+        minutes = parts["minutes"].astype("float64").fillna(0)
+        seconds = parts["seconds"].astype("float64").fillna(0)
+        hemisphere = parts["prefix"].fillna(parts["suffix"]).str.upper()
+        degrees = parts["degrees"].astype("float64") + minutes / 60 + seconds / 3600
+        negative = (parts["sign"] == "-") | (hemisphere == hemispheres[1])
+        bad = (minutes >= 60) | (seconds >= 60) | (hemisphere.notna() & ~hemisphere.isin(list(hemispheres))) | (parts["prefix"].notna() & parts["suffix"].notna())
+        parsed[todo] = degrees.where(~negative, -degrees).where(~bad)
+    return parsed
+
+def split_lat_lon(values):
+    #a combined column holds "latitude,longitude" (comma or semicolon separated), or two whitespace
+    #separated coordinates without spaces of their own
+    text = values.astype(str).where(values.notna())
+    pairs = text.str.extract(r"^\s*(?P<latitude>.+?)\s*[,;]\s*(?P<longitude>.+?)\s*$")
+    return pairs.fillna(text.str.extract(r"^\s*(?P<latitude>\S+)\s+(?P<longitude>\S+)\s*$"))
+
+def filter_locations(locations_df):
+    #validation shared by the CLI and the Dash app. coordinates are parsed to decimal degrees (from
+    #latitude and longitude, or a combined lat_lon column) and every row checked at once. returns the
+    #valid rows, with numeric latitude and longitude, and the rejected rows unchanged but for a
+    #rejection_reason column. raises KeyError if the required columns are missing
+    columns = set(locations_df.columns)
+    combined = next((column for column in LAT_LON_COLUMNS if column in columns), None)
+    if "sample" not in columns or not ({"latitude", "longitude"}.issubset(columns) or combined):
+        raise KeyError("Location file must contain columns sample, latitude and longitude (or sample and lat_lon)")
+    if {"latitude", "longitude"}.issubset(columns):
+        raw_latitude, raw_longitude = locations_df["latitude"], locations_df["longitude"]
+    else:
+        raw_latitude = raw_longitude = pd.Series(np.nan, index = locations_df.index)
+    unsplit = pd.Series(False, index = locations_df.index)
+    if combined:
+        #rows without latitude and longitude (e.g. a lat_lon file annotated together with --location, or
+        #mixed API records) take their coordinates from the combined column. done by position, the rows
+        #of a file and the --location sample can share index labels
+        fallback = ((raw_latitude.isna() | raw_longitude.isna()) & locations_df[combined].notna()).to_numpy()
+        if fallback.any():
+            pairs = split_lat_lon(locations_df[combined][fallback])
+            raw_latitude, raw_longitude = raw_latitude.astype(object), raw_longitude.astype(object)
+            raw_latitude.iloc[fallback] = pairs["latitude"].to_numpy()
+            raw_longitude.iloc[fallback] = pairs["longitude"].to_numpy()
+            #combined values that are not two coordinates
+            unsplit.iloc[fallback] = pairs["latitude"].isna().to_numpy()
+    latitude = parse_coordinates(raw_latitude, "NS")
+    longitude = parse_coordinates(raw_longitude, "EW")
+
+    #later checks take precedence, so a row gets the most basic reason it fails on
+    reason = pd.Series(None, index = locations_df.index, dtype = object)
+    checks = [(locations_df["sample"].isna(), "missing sample"),
+              (unsplit, "unparseable coordinates"),
+              (raw_latitude.isna(), "missing latitude"),
+              (raw_longitude.isna(), "missing longitude"),
+              (raw_latitude.notna() & latitude.isna(), "unparseable latitude"),
+              (raw_longitude.notna() & longitude.isna(), "unparseable longitude"),
+              (latitude.notna() & ~latitude.between(-90, 90), "latitude out of range"),
+              (longitude.notna() & ~longitude.between(-180, 180), "longitude out of range")]
+    for failed, message in reversed(checks):
+        reason[failed.to_numpy()] = message
+    ok = reason.isna().to_numpy()
+    valid = locations_df[ok].assign(latitude = latitude[ok], longitude = longitude[ok])
+    rejected = locations_df[~ok].assign(rejection_reason = reason[~ok])
+    return valid, rejected
+
+def count_rejections(rejected):
+    #rows missing required metadata, and rows whose coordinates are unreadable or out of range
+    n_missing = int(rejected["rejection_reason"].str.startswith("missing").sum()) if len(rejected) else 0
+    return n_missing, len(rejected) - n_missing
+
+TSV_COMPRESSORS = {"gzip": gzip.compress, "bz2": bz2.compress, "xz": lzma.compress}
+TSV_SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+
+def tsv_compression_of(output_file):
+    #the compression a tsv file name implies (e.g. annotated.tsv.gz), none without a compression suffix
+    return next((compression for compression, suffix in TSV_SUFFIXES.items() if output_file.lower().endswith(suffix)), "none")
+
+def compressed_tsv_name(output_file, compression):
+    #compressed tsv files end in the suffix of their compression, added if the name does not have it
+    suffix = TSV_SUFFIXES.get(compression, "")
+    return output_file if output_file.lower().endswith(suffix) else f"{output_file}{suffix}"
+
+def write_output_chunk(df, output_file, header, compression = "none"):
+    #header starts a new file, otherwise rows are appended. each chunk is flushed to disk before the
+    #next one is read, so an interrupted run leaves the rows annotated so far. compressed chunks are
+    #complete streams of their own, which gzip, bz2 and xz readers decompress as one file
+    data = df.to_csv(index = False, sep = "\t", header = header)
+    if compression != "none":
+        data = TSV_COMPRESSORS[compression](data.encode())
+    with open(output_file, ("w" if header else "a") + ("b" if isinstance(data, bytes) else "")) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def stable_id_columns(df):
+    #id columns become float when a row fails, in streamed output use nullable integers so every chunk
+    #is written the same way
+    for column in ["rurality_id", "koppen_geiger_id", "Relative Deprivation"]:
+        if column in df.columns:
+            df[column] = df[column].astype("Int64")
+    return df
+
+OUTPUT_FORMATS = ["tsv", "parquet", "arrow", "feather"]
+COMPRESSIONS = {"tsv": ["none", "gzip", "bz2", "xz"],
+                "parquet": ["none", "snappy", "gzip", "zstd", "lz4", "brotli"],
+                "arrow": ["none", "lz4", "zstd"],
+                "feather": ["none", "lz4", "zstd"]}
+DEFAULT_COMPRESSION = {"tsv": "none", "parquet": "snappy", "arrow": "none", "feather": "lz4"}
+FLOAT32_COLUMNS = ["Population Density", "Tropospheric Nitrogen Dioxide Emissions", "Fossil Fuel CO2 emissions"]
+ID_COLUMNS = ["rurality_id", "koppen_geiger_id", "Relative Deprivation"]
+ERROR_CODES = ["point_outside_bounds", "nodata", "read_error"]
+
+def output_format_of(output_file):
+    #the format an output file name implies, tsv unless it ends in .parquet, .arrow or .feather
+    extension = os.path.splitext(output_file)[1].lower().lstrip(".")
+    return extension if extension in OUTPUT_FORMATS else "tsv"
+
+def error_code(error):
+    if error is None or error != error:
+        return None
+    if isinstance(error, PointOutsideBounds):
+        return "point_outside_bounds"
+    if isinstance(error, NoDataError):
+        return "nodata"
+    return "read_error"
+
+def typed_results(df, rurality_def, kg_def):
+    #the fixed schema of columnar output: nullable 16 bit ids, float32 values, the legend labels as
+    #categoricals over every legend entry (so all outputs share one dictionary) and errors as a
+    #categorical error_code next to the message. other text columns are written as strings
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object and column != "error":
+            df[column] = df[column].astype("string")
+    if "sample" in df.columns:
+        df["sample"] = df["sample"].astype("string")
+    for column in ID_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("Int16")
+    for column in FLOAT32_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("float32")
+    for column, id_column, legend in [("Rurality", "rurality_id", rurality_def), ("Koppen Geiger", "koppen_geiger_id", kg_def)]:
+        if column in df.columns:
+            df[column] = as_legend(legend).categorical(df[id_column])
+    if "error" in df.columns:
+        df["error_code"] = pd.Categorical(df["error"].map(error_code), categories = ERROR_CODES)
+        df["error"] = df["error"].map(lambda e: None if e is None or e != e else str(e)).astype("string")
+    return df
+
+def write_columnar(df, output_file, output_format, compression, schema = None):
+    #writes df as a single parquet, arrow (IPC file) or feather file and returns its arrow schema. given a
+    #schema (that of the first part of a chunked run) the table is cast to it, so every part matches
+    import pyarrow as pa
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    if schema is not None:
+        table = table.cast(schema)
+    temp_file = f"{output_file}.tmp"
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, temp_file, compression = compression)
+    elif output_format == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression = None if compression == "none" else compression)
+        with pa.ipc.new_file(temp_file, table.schema, options = options) as writer:
+            writer.write_table(table)
+    else:
+        from pyarrow import feather
+        feather.write_feather(table, temp_file, compression = "uncompressed" if compression == "none" else compression)
+    os.replace(temp_file, output_file)
+    return table.schema
+
+def read_columnar_schema(output_file, output_format):
+    import pyarrow as pa
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(output_file)
+    with pa.memory_map(output_file) as source:
+        return pa.ipc.open_file(source).schema
+
+def output_parts(output_dir, output_format):
+    #the part files of a chunked columnar run, by part number
+    pattern = re.compile(rf"^part-(\d{{5}})\.{output_format}$")
+    parts = {}
+    for name in os.listdir(output_dir):
+        match = pattern.match(name)
+        if match:
+            parts[int(match.group(1))] = os.path.join(output_dir, name)
+    return parts
+
+def part_file(output_dir, output_format, number):
+    return os.path.join(output_dir, f"part-{number:05d}.{output_format}")
+
+class RowRateColumn(ProgressColumn):
+    def render(self, task):
+        if task.speed is None:
+            return Text("- rows/s", style = "progress.data.speed")
+        return Text(f"{task.speed:,.0f} rows/s", style = "progress.data.speed")
+
 def main():
+    if sys.argv[1:2] == ["prepare-local"]:
+        return prepare_local(sys.argv[2:])
     parser = argparse.ArgumentParser(prog = "omeinfo.py", description = '''
                                      The OMEinfo command-line tool enables users to annotate geographical metadata, 
                                      including Koppen climate classification, degree of rurality, population density, 
                                      and fossil fuel CO2 emissions, from user-provided location data. 
                                      The tool offers options for selecting the data version and the data source. 
-                                     Annotations are stored in a specified output file in TSV format.''')   
+                                     Annotations are stored in a specified output file in TSV, parquet, arrow or feather format.''',
+                                     epilog = "run 'omeinfo.py prepare-local -h' to convert a locally stored data packet into a memory mapped band store")   
 
     parser.add_argument('--location_file', type = str, help = "file containing locations")
     parser.add_argument("--location", type = str, help = "location in latitude,longitude EPSG:4326 format, input string in format 'sample,latitude,longitude'")
     parser.add_argument("--data_version", type = str, help = "version of data to use", default = "2.0.0")
     parser.add_argument("--source_data", type = str, help = "url to data or filepath to local version")
-    parser.add_argument("--output_file", type = str, help = "name of output file", default = "annotated_locations.tsv")
+    parser.add_argument("--output_file", type = str, help = "name of output file, defaults to annotated_locations with the extension of the output format. chunked (--chunksize) parquet, arrow and feather output is a directory of part files", default = None)
+    parser.add_argument("--output_format", type = str, choices = OUTPUT_FORMATS, help = "format of the output file, defaults to the one its extension implies (tsv otherwise). parquet, arrow and feather output uses a fixed typed schema with an error_code column", default = None)
+    parser.add_argument("--compression", type = str, choices = sorted(set(sum(COMPRESSIONS.values(), []))), help = "compression of the output file (tsv: gzip, bz2, xz; parquet: snappy, gzip, zstd, lz4, brotli; arrow and feather: lz4, zstd), defaults to snappy for parquet, lz4 for feather and for tsv to the one a .gz, .bz2 or .xz output file name implies (none otherwise). compressed tsv output and rejected files get the suffix of their compression", default = None)
+    parser.add_argument("--rejected_file", type = str, help = "file to write rows that failed validation to, with the reason in a rejection_reason column, defaults to the output file name with _rejected added", default = None)
     parser.add_argument("--n_samples", type = int, help = "number of output summary table samples to show in command line", default = 10)
     parser.add_argument("--quiet", type = bool, help = "suppress console output", default = False)
+    parser.add_argument("--cache_dir", type = str, help = "directory for the persistent tile cache of remote data packets", default = os.environ.get("OMEINFO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "omeinfo", "tiles")))
+    parser.add_argument("--chunksize", type = int, help = "stream the location file in chunks of this many rows, appending each annotated chunk to the output file (bounded memory use)", default = None)
+    parser.add_argument("--resume", action = "store_true", help = "continue an interrupted --chunksize run from its checkpoint file (streams in chunks of 100000 rows if --chunksize is not given)")
+    parser.add_argument("--checkpoint_file", type = str, help = "checkpoint file recording the progress of a --chunksize run, defaults to the output file name with .checkpoint.json appended", default = None)
+    parser.add_argument("--workers", type = int, help = "number of processes to annotate with, locations are split spatially between them", default = 1)
+    parser.add_argument("--concurrency", type = int, help = "number of concurrent tile requests to remote data packets (asynchronous reads), 0 reads sequentially", default = 0)
+    parser.add_argument("--request_timeout", type = float, help = "timeout in seconds for each remote data packet request made with --concurrency", default = 30)
+    parser.add_argument("--cache_size", type = int, help = "size budget of the tile cache in MB, 0 disables the cache", default = int(os.environ.get("OMEINFO_CACHE_SIZE", 2048)))
     args = parser.parse_args()
+    args.output_format = args.output_format or (output_format_of(args.output_file) if args.output_file else "tsv")
+    args.output_file = args.output_file or f"annotated_locations.{args.output_format}"
+    if args.output_format == "tsv" and not args.compression:
+        args.compression = tsv_compression_of(args.output_file)
+    args.compression = args.compression or DEFAULT_COMPRESSION[args.output_format]
+    if args.compression not in COMPRESSIONS[args.output_format]:
+        parser.error(f"--compression {args.compression} is not available for {args.output_format} output, choose from {', '.join(COMPRESSIONS[args.output_format])}")
+    columnar = args.output_format != "tsv"
+    #rejected rows are always tsv, compressed like tsv output
+    rejected_compression = "none" if columnar else args.compression
+    if not columnar:
+        args.output_file = compressed_tsv_name(args.output_file, args.compression)
     
     OMEINFO_CLI_VERSION = "1.1.0"
     OMEINFO_CONDA_PREFIX = os.environ.get('CONDA_PREFIX')
@@ -140,67 +1319,179 @@ def main():
     else:
         console.print(f"Using OMEinfo Data Version: {args.data_version}", style = "green")
     
-    rurality_definitions = pd.read_csv(f"{OMEINFO_CONDA_PREFIX}/bin/rurality_legend.txt", sep = "\t")
-    rurality_definitions["id"] = rurality_definitions["id"].astype("str")
-    id_to_rurality = rurality_definitions.set_index('id')['definition'].to_dict()
-    kg_definitions = pd.read_csv(f"{OMEINFO_CONDA_PREFIX}/bin/kg_legend.txt", sep = "\t")
-    kg_definitions["id"] = kg_definitions["id"].astype("str")
-    id_to_kg = kg_definitions.set_index('id')['definition'].to_dict()
+    id_to_rurality = load_legend(f"{OMEINFO_CONDA_PREFIX}/bin/rurality_legend.txt")
+    id_to_kg = load_legend(f"{OMEINFO_CONDA_PREFIX}/bin/kg_legend.txt")
 
-    if args.location_file:
-        if args.location_file.endswith('.csv'):
-            delimiter = ','
-        elif args.location_file.endswith('.tsv'):
-            delimiter = '\t'
+    tile_cache = TileCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_size > 0 else False
+    output_name = args.output_file[:-len(TSV_SUFFIXES[args.compression])] if not columnar and args.compression in TSV_SUFFIXES else args.output_file
+    rejected_file = compressed_tsv_name(args.rejected_file or f"{os.path.splitext(output_name)[0]}_rejected.tsv", rejected_compression)
+    totals = {"loaded": 0, "missing": 0, "invalid": 0, "annotated": 0}
+    if args.resume and not args.chunksize:
+        args.chunksize = 100000
+    if args.chunksize:
+        #chunked runs record after every flushed chunk which input rows are done, so that --resume can
+        #pick up where an interrupted run stopped
+        checkpoint_file = args.checkpoint_file or f"{args.output_file}.checkpoint.json"
+        identity = run_identity(args)
+        checkpoint = load_checkpoint(checkpoint_file) if args.resume else None
+        if checkpoint is not None:
+            if checkpoint["identity"] != identity:
+                console.print(f"Checkpoint {checkpoint_file} was written for a different input, data source or output format, remove it or run without --resume", style = "bold red")
+                raise ValueError("Checkpoint does not match the current run")
+            if checkpoint["complete"]:
+                console.print(f"Annotation already complete according to {checkpoint_file}, output in {args.output_file}", style = "bold green")
+                return
+            if not checkpoint_output_intact(checkpoint, args.output_file, args.output_format, rejected_file):
+                #the rows annotated before the checkpoint are lost, resuming would leave them out of the output
+                console.print(f"Output recorded in {checkpoint_file} is missing or truncated, annotating again from the first row", style = "bold yellow")
+                checkpoint = None
+        if checkpoint is not None:
+            #anything written after the last checkpoint belongs to an unfinished chunk
+            if columnar:
+                for number, path in output_parts(args.output_file, args.output_format).items():
+                    if number >= checkpoint["output_parts"]:
+                        os.remove(path)
+            elif os.path.exists(args.output_file):
+                with open(args.output_file, "r+") as f:
+                    f.truncate(checkpoint["output_bytes"])
+            if os.path.exists(rejected_file):
+                with open(rejected_file, "r+") as f:
+                    f.truncate(checkpoint["rejected_bytes"])
+            totals = checkpoint["totals"]
+            console.print(f"Resuming from checkpoint: {checkpoint['file_rows_done']} input rows already annotated", style = "bold green")
         else:
-            raise ValueError("File format not supported. Please provide a CSV or TSV file.")
-        locations_df = pd.read_csv(args.location_file, delimiter = delimiter)        #check sample latitude and longitude columns are present in dataframe
-        
-        if not set(["sample", "latitude", "longitude"]).issubset(set(locations_df.columns)):
-            console.print("Location file must contain columns sample, latitude and longitude", style = "bold red")
-            raise KeyError("Location file must contain columns sample, latitude and longitude")
+            if args.resume and not os.path.exists(checkpoint_file):
+                console.print(f"No checkpoint found at {checkpoint_file}, starting from the beginning", style = "bold yellow")
+            checkpoint = {"identity": identity, "file_rows_done": 0, "completed_ranges": [], "location_done": False, "output_bytes": 0, "output_parts": 0, "rejected_bytes": 0, "totals": totals, "complete": False}
+            if columnar:
+                #parts left over from an earlier run
+                os.makedirs(args.output_file, exist_ok = True)
+                for path in output_parts(args.output_file, args.output_format).values():
+                    os.remove(path)
+        #every part of a chunked columnar run is cast to the schema of the first
+        part_schema = read_columnar_schema(part_file(args.output_file, args.output_format, 0), args.output_format) if columnar and checkpoint["output_parts"] else None
+        chunks = read_locations(args.location_file, args.location, args.chunksize, skip_rows = checkpoint["file_rows_done"], skip_location = checkpoint["location_done"])
     else:
-        locations_df = pd.DataFrame()
-    
-    if args.location:
-        individual_locations_df = pd.DataFrame([args.location.split(",")], columns = ["sample", "latitude", "longitude"])
-        individual_locations_df[["latitude", "longitude"]] = individual_locations_df[["latitude", "longitude"]].astype(float)
-        locations_df = pd.concat([locations_df, individual_locations_df])
-    
-    console.print(f"Loaded locations: {len(locations_df)}", style = "bold green")
-    if len(locations_df) == 0:
-        console.print("No locations provided. Exiting.", style = "bold red")
-        raise ValueError("No locations provided. Exiting.")
-    
-    metadata_filtered_locations_df  = locations_df[locations_df[['sample', 'latitude', 'longitude']].notna().all(axis=1)]
-    console.print(f"Missing required metadata: {len(locations_df) - len(metadata_filtered_locations_df)}", style = "bold red")  
-    filtered_locations_df = metadata_filtered_locations_df[metadata_filtered_locations_df[['latitude', 'longitude']].apply(lambda x: -90 <= x["latitude"] <= 90 and -180 <= x["longitude"] <= 180, axis=1)]
-    console.print(f"Invalid lat/long format: {len(metadata_filtered_locations_df) - len(filtered_locations_df)}", style = "bold red")      
-    tasks = ["Annotating metadata"]
-
-    with console.status("[bold green]Annotating metadata...") as status:
-        while tasks:
-            task = tasks.pop(0)
+        chunks = [(pd.concat([pd.DataFrame()] + [chunk for chunk, _ in read_locations(args.location_file, args.location)]), True)]
+    if not (args.chunksize and checkpoint["rejected_bytes"]) and os.path.exists(rejected_file):
+        #rejected rows left over from an earlier run
+        os.remove(rejected_file)
+
+    annotated_locations = pd.DataFrame()
+    annotation_time = datetime.timedelta()
+    with ExitStack() as stack:
+        if args.chunksize or args.workers > 1:
+            progress_columns = [TextColumn("[bold green]Annotating metadata"), BarColumn(), MofNCompleteColumn(), RowRateColumn(), TimeRemainingColumn()]
+            progress = stack.enter_context(Progress(*progress_columns, console = console))
+            task = progress.add_task("Annotating metadata", total = None)
+        else:
+            stack.enter_context(console.status("[bold green]Annotating metadata..."))
+        pool = stack.enter_context(annotation_pool(args.workers, args.data_version, user_url = args.source_data, tile_cache = tile_cache)) if args.workers > 1 else None
+        if args.chunksize and args.workers <= 1 and args.concurrency <= 0:
+            #keep local packets open between chunks so GDAL's block cache carries over. remote packets are
+            #reopened for every chunk to bound memory, their tiles come back from the tile cache instead
+            for url in data_packet_urls(args.data_version, args.source_data):
+                if not is_remote(url):
+                    keep_cog_open(url, stack)
+
+        for locations_df, from_file in chunks:
+            if not args.chunksize:
+                console.print(f"Loaded locations: {len(locations_df)}", style = "bold green")
+                if len(locations_df) == 0:
+                    console.print("No locations provided. Exiting.", style = "bold red")
+                    raise ValueError("No locations provided. Exiting.")
+            try:
+                filtered_locations_df, rejected_df = filter_locations(locations_df)
+            except KeyError as e:
+                console.print(e.args[0], style = "bold red")
+                raise
+            n_missing, n_invalid = count_rejections(rejected_df)
+            if not args.chunksize:
+                console.print(f"Missing required metadata: {n_missing}", style = "bold red")
+                console.print(f"Invalid lat/long format: {n_invalid}", style = "bold red")
+                if args.workers > 1:
+                    progress.update(task, total = len(filtered_locations_df))
+            totals["loaded"] += len(locations_df)
+            totals["missing"] += n_missing
+            totals["invalid"] += n_invalid
+            totals["annotated"] += len(filtered_locations_df)
+
             start_time = datetime.datetime.now()
-            annotated_locations = get_s3_point_data(filtered_locations_df.copy(), args.data_version, id_to_rurality, id_to_kg, user_url = args.source_data)
-            end_time = datetime.datetime.now()
-            c = end_time - start_time
-            minutes = int(c.total_seconds() // 60)
-            seconds = c.total_seconds() % 60
-            console.print(f'Annotation complete! {str(len(filtered_locations_df))} samples analysed in {str(minutes)} mins {str(round(seconds,2))} secs. :white_check_mark:')
-            annotated_locations.to_csv(args.output_file, index = False, sep = "\t")
-            
-            response = requests.get(bibtex_url)
-            if response.status_code == 200:
-                bibtex_content = response.text
-                with open("omeinfo_citations.bib", "w") as file:
-                    file.write(bibtex_content)
-                console.print(f"BibTeX file downloaded successfully, saved to: omeinfo_citations.bib", style = "bold green")
+            if args.workers > 1:
+                annotated_chunk = annotate_in_parallel(filtered_locations_df.copy(), args.data_version, id_to_rurality, id_to_kg, args.workers, user_url = args.source_data, tile_cache = tile_cache,
+                                                       progress = lambda n: progress.advance(task, n), pool = pool)
+            elif args.concurrency > 0:
+                annotated_chunk = asyncio.run(get_s3_point_data_async(filtered_locations_df.copy(), args.data_version, id_to_rurality, id_to_kg, user_url = args.source_data, tile_cache = tile_cache,
+                                                                      max_in_flight = args.concurrency, timeout = args.request_timeout))
             else:
-                console.print(f"Failed to download BibTeX file. Status code: {response.status_code}")       
+                annotated_chunk = get_s3_point_data(filtered_locations_df.copy(), args.data_version, id_to_rurality, id_to_kg, user_url = args.source_data, tile_cache = tile_cache)
+            annotation_time += datetime.datetime.now() - start_time
 
+            if args.chunksize:
+                if columnar:
+                    part_schema = write_columnar(typed_results(annotated_chunk, id_to_rurality, id_to_kg), part_file(args.output_file, args.output_format, checkpoint["output_parts"]),
+                                                 args.output_format, args.compression, schema = part_schema)
+                    checkpoint["output_parts"] += 1
+                else:
+                    write_output_chunk(stable_id_columns(annotated_chunk), args.output_file, header = checkpoint["output_bytes"] == 0, compression = args.compression)
+                    checkpoint["output_bytes"] = os.path.getsize(args.output_file)
+                if from_file:
+                    first_row = checkpoint["file_rows_done"]
+                    checkpoint["file_rows_done"] += len(locations_df)
+                    if checkpoint["completed_ranges"] and checkpoint["completed_ranges"][-1][1] == first_row:
+                        checkpoint["completed_ranges"][-1][1] = checkpoint["file_rows_done"]
+                    else:
+                        checkpoint["completed_ranges"].append([first_row, checkpoint["file_rows_done"]])
+                else:
+                    checkpoint["location_done"] = True
+                if len(rejected_df):
+                    write_output_chunk(rejected_df, rejected_file, header = checkpoint["rejected_bytes"] == 0, compression = rejected_compression)
+                    checkpoint["rejected_bytes"] = os.path.getsize(rejected_file)
+                checkpoint["totals"] = totals
+                save_checkpoint(checkpoint_file, checkpoint)
+                if args.workers <= 1:
+                    progress.advance(task, len(annotated_chunk))
+                #only the rows needed for the summary table are kept in memory
+                annotated_locations = pd.concat([annotated_locations, annotated_chunk.head(max(0, args.n_samples - len(annotated_locations)))])
+            else:
+                annotated_locations = annotated_chunk
+                if columnar:
+                    write_columnar(typed_results(annotated_locations, id_to_rurality, id_to_kg), args.output_file, args.output_format, args.compression)
+                else:
+                    annotated_locations.to_csv(args.output_file, index = False, sep = "\t", compression = None if args.compression == "none" else args.compression)
+                if len(rejected_df):
+                    rejected_df.to_csv(rejected_file, index = False, sep = "\t", compression = None if rejected_compression == "none" else rejected_compression)
+
+    if args.chunksize:
+        checkpoint["complete"] = True
+        save_checkpoint(checkpoint_file, checkpoint)
+        console.print(f"Loaded locations: {totals['loaded']}", style = "bold green")
+        if totals["loaded"] == 0:
+            console.print("No locations provided. Exiting.", style = "bold red")
+            raise ValueError("No locations provided. Exiting.")
+        console.print(f"Missing required metadata: {totals['missing']}", style = "bold red")
+        console.print(f"Invalid lat/long format: {totals['invalid']}", style = "bold red")
+    if totals["missing"] + totals["invalid"]:
+        console.print(f"Rejected rows written to: {rejected_file}", style = "bold red")
+    c = annotation_time
+    minutes = int(c.total_seconds() // 60)
+    seconds = c.total_seconds() % 60
+    console.print(f'Annotation complete! {str(totals["annotated"])} samples analysed in {str(minutes)} mins {str(round(seconds,2))} secs. :white_check_mark:')
+    if tile_cache and tile_cache.hits + tile_cache.misses:
+        console.print(tile_cache.summary(), style = "green")
+    if SAMPLING_STATS.pixels:
+        console.print(SAMPLING_STATS.summary(), style = "green")
     
-    if not args.quiet:
+    response = requests.get(bibtex_url)
+    if response.status_code == 200:
+        bibtex_content = response.text
+        with open("omeinfo_citations.bib", "w") as file:
+            file.write(bibtex_content)
+        console.print(f"BibTeX file downloaded successfully, saved to: omeinfo_citations.bib", style = "bold green")
+    else:
+        console.print(f"Failed to download BibTeX file. Status code: {response.status_code}")       
+
+    if not args.quiet and len(annotated_locations):
         if args.source_data:
             caption = f"OMEinfo annotation with user supplied data file: {args.source_data}"
         else:
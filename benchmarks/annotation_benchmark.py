@@ -0,0 +1,227 @@
+#benchmarks annotation throughput: a small synthetic six band COG laid out like the v2 data packet is
+#annotated with get_s3_point_data for synthetic location sets (uniform over the globe, tightly clustered,
+#duplicate heavy and out of bounds heavy) at several sizes, read as a local file, as a band store (see
+#omeinfo.py prepare-local) and over a local HTTP server with range support and a configurable latency per
+#request. rows per second, HTTP requests and bytes fetched are written to a JSON file, and a previous
+#results file can be passed with --baseline to report runs that got slower or fetch more than before
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.shutil
+from rasterio.transform import from_origin
+from rio_tiler.errors import NoOverviewWarning
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OMEinfo"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OMEinfo", "data_packet_creation"))
+from omeinfo import SAMPLING_STATS, HTTPRangeSource, get_s3_point_data, load_legend, prepare_band_store
+from build_packet import COG_DEFAULTS, cog_options
+from layout_benchmark import RangeRequestHandler, serve
+
+DISTRIBUTIONS = ["uniform", "clustered", "duplicates", "out_of_bounds"]
+#rurality (GHS SMOD) classes of the v2 packet
+SMOD_CLASSES = np.array([10, 11, 12, 13, 21, 22, 23, 30])
+
+class LatencyRangeRequestHandler(RangeRequestHandler):
+    #waits latency seconds before answering each request, like a round trip to remote storage
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+def is_land(lat, lon):
+    #smooth synthetic continents, so that neighbouring pixels (and tiles) are land or ocean together
+    return (np.sin(np.radians(lon) * 3) * np.cos(np.radians(lat) * 2) + 0.3 * np.sin(np.radians(lat + lon) * 7)) > -0.2
+
+def write_fixture(path, resolution, seed):
+    #six bands in the v2 order (population density, rurality, Koppen Geiger, relative deprivation, CO2,
+    #NO2) on a global EPSG:4326 grid, float32 with NaN over a synthetic ocean, written with the packet's
+    #default COG layout
+    rng = np.random.default_rng(seed)
+    width, height = round(360 / resolution), round(180 / resolution)
+    lat = np.linspace(90 - resolution / 2, -90 + resolution / 2, height)[:, None]
+    lon = np.linspace(-180 + resolution / 2, 180 - resolution / 2, width)[None, :]
+    land = is_land(lat, lon)
+    shape = (height, width)
+    bands = [rng.lognormal(3, 2, shape),
+             SMOD_CLASSES[rng.integers(0, len(SMOD_CLASSES), shape)],
+             np.clip(np.abs(lat) // 3 + rng.integers(0, 3, shape), 1, 30),
+             rng.integers(0, 101, shape),
+             rng.gamma(0.5, 50, shape),
+             rng.gamma(2, 1e-5, shape)]
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": 6, "dtype": "float32", "nodata": np.nan,
+               "crs": "EPSG:4326", "transform": from_origin(-180, 90, resolution, resolution), "tiled": True}
+    striped = f"{path}.tmp.tif"
+    with rasterio.open(striped, "w", **profile) as dst:
+        for number, band in enumerate(bands, start = 1):
+            dst.write(np.where(land, band, np.nan).astype("float32"), number)
+    rasterio.shutil.copy(striped, path, driver = "COG", **cog_options(COG_DEFAULTS))
+    os.remove(striped)
+    return path
+
+def location_set(distribution, size, rng):
+    #uniform: anywhere on the globe (ocean points are nodata). clustered: around 3 sites on land a few km across.
+    #duplicates: 1% distinct locations each repeated about 100 times (replicates, time series).
+    #out_of_bounds: half of the locations are impossible coordinates (e.g. swapped or projected ones)
+    if distribution == "uniform":
+        latitude, longitude = rng.uniform(-90, 90, size), rng.uniform(-180, 180, size)
+    elif distribution == "clustered":
+        centres = np.column_stack([rng.uniform(-50, 65, 1000), rng.uniform(-170, 170, 1000)])
+        centres = centres[is_land(centres[:, 0], centres[:, 1])][:3]
+        chosen = centres[rng.integers(0, 3, size)]
+        latitude, longitude = chosen[:, 0] + rng.normal(0, 0.03, size), chosen[:, 1] + rng.normal(0, 0.03, size)
+    elif distribution == "duplicates":
+        distinct = max(1, size // 100)
+        chosen = rng.integers(0, distinct, size)
+        latitude, longitude = rng.uniform(-90, 90, distinct)[chosen], rng.uniform(-180, 180, distinct)[chosen]
+    elif distribution == "out_of_bounds":
+        latitude, longitude = rng.uniform(-90, 90, size), rng.uniform(-180, 180, size)
+        outside = rng.random(size) < 0.5
+        latitude[outside] = rng.choice([-1, 1], outside.sum()) * rng.uniform(90.5, 1e6, outside.sum())
+        longitude[outside] = rng.uniform(-1e6, 1e6, outside.sum())
+    else:
+        raise ValueError(f"Unknown location distribution: {distribution}")
+    return pd.DataFrame({"sample": [f"s{i}" for i in range(size)], "latitude": latitude, "longitude": longitude})
+
+def measure(source, df, repeats, rurality_def, kg_def):
+    #best of repeats. the tile cache is off and every run opens new range sources, so each run reads
+    #the packet cold
+    best = None
+    for _ in range(repeats):
+        sources = []
+        def range_source_factory(source_url):
+            range_source = HTTPRangeSource(source_url)
+            sources.append(range_source)
+            return range_source
+        locations, pixels = SAMPLING_STATS.locations, SAMPLING_STATS.pixels
+        start = time.perf_counter()
+        result = get_s3_point_data(df.copy(), "2.0.0", rurality_def, kg_def, user_url = source, tile_cache = False, range_source_factory = range_source_factory)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best["seconds"]:
+            best = {"seconds": elapsed, "rows_per_second": len(df) / elapsed,
+                    "http_requests": sum(s.requests for s in sources) if sources else None,
+                    "bytes_fetched": sum(s.bytes_fetched for s in sources) if sources else None,
+                    "unique_pixels": SAMPLING_STATS.pixels - pixels, "failed_rows": int(result["error"].notna().sum())}
+        SAMPLING_STATS.locations, SAMPLING_STATS.pixels = locations, pixels
+    return best
+
+def run_key(run):
+    return (run["backend"], run.get("latency_ms"), run["distribution"], run["size"])
+
+def compare(results, baseline, tolerance):
+    #runs more than tolerance slower, or fetching more bytes or requests, than the same run in baseline
+    previous = {run_key(run): run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        before = previous.get(run_key(run))
+        if before is None:
+            continue
+        reasons = []
+        if run["rows_per_second"] < before["rows_per_second"] * (1 - tolerance):
+            reasons.append(f"{run['rows_per_second']:.0f} rows/s, was {before['rows_per_second']:.0f}")
+        for counter in ["http_requests", "bytes_fetched"]:
+            if run[counter] is not None and before.get(counter) is not None and run[counter] > before[counter]:
+                reasons.append(f"{run[counter]} {counter}, was {before[counter]}")
+        if reasons:
+            regressions.append({"run": list(run_key(run)), "reasons": reasons})
+    return regressions
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output = True, text = True, check = True,
+                                cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "numpy": np.__version__, "pandas": pd.__version__, "rasterio": rasterio.__version__, "gdal": rasterio.__gdal_version__}
+
+def main():
+    parser = argparse.ArgumentParser(prog = "annotation_benchmark.py", description = "benchmark annotation throughput of a synthetic v2 data packet across backends and location distributions")
+    parser.add_argument("--backends", type = str, help = "comma separated backends (local, band_store, http)", default = "local,band_store,http")
+    parser.add_argument("--latencies", type = str, help = "comma separated latencies in ms added to every request of the http backend", default = "0,20")
+    parser.add_argument("--distributions", type = str, help = f"comma separated location distributions ({', '.join(DISTRIBUTIONS)})", default = ",".join(DISTRIBUTIONS))
+    parser.add_argument("--sizes", type = str, help = "comma separated numbers of locations", default = "1000,10000,100000")
+    parser.add_argument("--resolution", type = float, help = "pixel size of the fixture packet in degrees (v2 is 1/120)", default = 0.1)
+    parser.add_argument("--repeats", type = int, help = "runs per measurement, the fastest is reported", default = 3)
+    parser.add_argument("--work_dir", type = str, help = "directory to keep the fixture in (reused if already there), by default it is written to a temporary directory and removed", default = None)
+    parser.add_argument("--output", type = str, help = "JSON file to write the results to", default = "annotation_benchmark.json")
+    parser.add_argument("--baseline", type = str, help = "results JSON of an earlier run to compare with, exits with status 1 if any run regressed", default = None)
+    parser.add_argument("--tolerance", type = float, help = "fraction of the baseline rows per second a run may lose before it counts as a regression", default = 0.2)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+    #the tile reads never touch the fixture's overviews
+    warnings.filterwarnings("ignore", category = NoOverviewWarning)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix = "omeinfo_benchmark_")
+    os.makedirs(work_dir, exist_ok = True)
+    fixture = os.path.join(work_dir, f"fixture_{args.resolution:g}_{args.seed}.tif")
+    if not os.path.exists(fixture):
+        write_fixture(fixture, args.resolution, args.seed)
+    backends = args.backends.split(",")
+    sources = []
+    servers = []
+    for backend in backends:
+        if backend == "local":
+            sources.append((backend, None, fixture))
+        elif backend == "band_store":
+            store = f"{os.path.splitext(fixture)[0]}_bands"
+            prepare_band_store(fixture, store)
+            sources.append((backend, None, store))
+        elif backend == "http":
+            for latency in [float(latency) for latency in args.latencies.split(",")]:
+                handler = type("Handler", (LatencyRangeRequestHandler,), {"latency": latency / 1000})
+                server = serve(work_dir, handler)
+                servers.append(server)
+                sources.append((backend, latency, f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(fixture)}"))
+        else:
+            parser.error(f"unknown backend {backend}")
+
+    legend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "OMEinfo")
+    rurality_def = load_legend(os.path.join(legend_dir, "rurality_legend.txt"))
+    kg_def = load_legend(os.path.join(legend_dir, "kg_legend.txt"))
+    with rasterio.open(fixture) as dataset:
+        results = {"environment": environment(),
+                   "fixture": {"resolution": args.resolution, "seed": args.seed, "width": dataset.width, "height": dataset.height,
+                               "block_shape": list(dataset.block_shapes[0]), "file_bytes": os.path.getsize(fixture)},
+                   "repeats": args.repeats, "runs": []}
+    for backend, latency, source in sources:
+        for distribution in args.distributions.split(","):
+            for size in [int(size) for size in args.sizes.split(",")]:
+                df = location_set(distribution, size, np.random.default_rng(args.seed))
+                run = {"backend": backend, "latency_ms": latency, "distribution": distribution, "size": size,
+                       **measure(source, df, args.repeats, rurality_def, kg_def)}
+                results["runs"].append(run)
+                label = backend if latency is None else f"{backend} {latency:g} ms"
+                traffic = f"{run['http_requests']:6} requests {run['bytes_fetched'] / 1e6:9.2f} MB" if run["http_requests"] is not None else ""
+                print(f"{label:16} {distribution:14} {size:>8} {run['rows_per_second']:12.0f} rows/s {traffic}")
+    for server in servers:
+        server.shutdown()
+    if not args.work_dir:
+        shutil.rmtree(work_dir)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        results["baseline"] = {"file": os.path.abspath(args.baseline), "tolerance": args.tolerance, "regressions": regressions}
+        for regression in regressions:
+            print(f"Regression in {' '.join(str(part) for part in regression['run'])}: {'; '.join(regression['reasons'])}")
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 1)
+    print(f"Results written to: {args.output}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
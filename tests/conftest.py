@@ -0,0 +1,106 @@
+import os
+import shutil
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+import rasterio.shutil
+from rasterio.transform import from_origin
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+#no persistent tile cache in the user's home directory, tests that need a cache make their own
+os.environ["OMEINFO_CACHE_SIZE"] = "0"
+sys.path.insert(0, os.path.join(ROOT, "OMEinfo"))
+sys.path.insert(0, os.path.join(ROOT, "OMEinfo", "data_packet_creation"))
+sys.path.insert(0, os.path.join(ROOT, "OMEinfo", "app"))
+from range_server import SlowRangeRequestHandler, serve
+
+#the test packet: six bands in the v2 order on a global 0.5 degree grid, in 64 pixel tiles (12 x 6 tiles,
+#the last row and column partial)
+RESOLUTION = 0.5
+BLOCKSIZE = 64
+
+@pytest.fixture(scope = "session")
+def packet(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("packet")
+    rng = np.random.default_rng(0)
+    width, height = round(360 / RESOLUTION), round(180 / RESOLUTION)
+    bands = [rng.lognormal(3, 2, (height, width)),
+             rng.choice([10, 11, 12, 13, 21, 22, 23, 30], (height, width)),
+             rng.integers(1, 31, (height, width)),
+             rng.integers(0, 101, (height, width)),
+             rng.gamma(0.5, 50, (height, width)),
+             rng.gamma(2, 1e-5, (height, width))]
+    profile = {"driver": "GTiff", "width": width, "height": height, "count": 6, "dtype": "float32", "nodata": np.nan,
+               "crs": "EPSG:4326", "transform": from_origin(-180, 90, RESOLUTION, RESOLUTION)}
+    data = np.stack(bands).astype("float32")
+    #nodata in every band across a tile boundary, and in the first band only at the edge of the grid
+    data[:, 100:110, 200:260] = np.nan
+    data[0, 300:302, 700:720] = np.nan
+    source = str(directory / "source.tif")
+    with rasterio.open(source, "w", **profile) as dst:
+        dst.write(data)
+    path = str(directory / "packet.tif")
+    rasterio.shutil.copy(source, path, driver = "COG", BLOCKSIZE = BLOCKSIZE, COMPRESS = "DEFLATE", INTERLEAVE = "PIXEL")
+    os.remove(source)
+    return path
+
+@pytest.fixture(scope = "session")
+def packet_url(packet):
+    server = serve(os.path.dirname(packet))
+    yield f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(packet)}"
+    server.shutdown()
+
+@pytest.fixture(scope = "session")
+def slow_packet_url(packet):
+    server = serve(os.path.dirname(packet), SlowRangeRequestHandler)
+    yield f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(packet)}"
+    server.shutdown()
+
+def random_locations(size, seed = 0, latitude = (-89, 89), longitude = (-179, 179)):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"sample": [f"s{i}" for i in range(size)], "latitude": rng.uniform(*latitude, size), "longitude": rng.uniform(*longitude, size)})
+
+def write_locations(path, df):
+    df.to_csv(path, sep = "\t", index = False)
+    return str(path)
+
+@pytest.fixture
+def cli(tmp_path, monkeypatch):
+    #runs the omeinfo.py command line in tmp_path, with the repository legends in place of the conda
+    #environment's, no persistent tile cache and without downloading the citations
+    import omeinfo
+    legend_dir = tmp_path / "prefix" / "bin"
+    legend_dir.mkdir(parents = True)
+    for name in ["rurality_legend.txt", "kg_legend.txt"]:
+        shutil.copy(os.path.join(ROOT, "OMEinfo", name), legend_dir / name)
+    monkeypatch.setenv("CONDA_PREFIX", str(tmp_path / "prefix"))
+    #wide enough that console messages are not wrapped
+    monkeypatch.setenv("COLUMNS", "500")
+    monkeypatch.setattr(omeinfo.requests, "get", lambda url: SimpleNamespace(status_code = 404))
+    monkeypatch.chdir(tmp_path)
+    def run(*args):
+        monkeypatch.setattr(sys, "argv", ["omeinfo.py", "--cache_size", "0", *[str(arg) for arg in args]])
+        return omeinfo.main()
+    return run
+
+@pytest.fixture(scope = "session")
+def dash_app():
+    #app.py reads its assets relative to the app directory, which the server runs in
+    cwd = os.getcwd()
+    os.chdir(os.path.join(ROOT, "OMEinfo", "app"))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+@pytest.fixture
+def packet_resources(dash_app, packet, monkeypatch):
+    #the app annotates against the test packet, with the repository legends
+    monkeypatch.setenv("OMEINFO_URL", packet)
+    monkeypatch.setattr(dash_app.RESOURCES, "legend_dir", os.path.join(ROOT, "OMEinfo"))
+    return dash_app.RESOURCES
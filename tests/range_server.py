@@ -0,0 +1,45 @@
+import functools
+import http.server
+import os
+import threading
+import time
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    #serves single byte ranges (all HTTPRangeSource asks for) from a directory
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        ranged = self.headers.get("Range", "").startswith("bytes=")
+        if ranged:
+            first, last = self.headers["Range"][len("bytes="):].split("-")
+            start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        self.send_response(206 if ranged else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+    def log_message(self, format, *args):
+        pass
+
+class SlowRangeRequestHandler(RangeRequestHandler):
+    #adds object storage like latency to every request
+    latency = 0.02
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+def serve(directory, handler_class = RangeRequestHandler):
+    handler = functools.partial(handler_class, directory = directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
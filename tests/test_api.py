@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from conftest import random_locations
+
+@pytest.fixture
+def client(dash_app, packet_resources):
+    return dash_app.server.test_client()
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text = True).splitlines()]
+
+def test_mixed_coordinate_forms_keep_their_own_fields(client):
+    response = client.post("/api/annotate", json = [{"sample": "a", "latitude": 51.5, "longitude": -0.12},
+                                                    {"sample": "b", "lat_lon": "40.7,-74.0"},
+                                                    {"sample": "c", "latitude": "north", "longitude": 10}])
+    assert response.status_code == 200
+    a, b, c = ndjson(response)
+    assert "lat_lon" not in a and "lat_lon" not in c
+    assert b["lat_lon"] == "40.7,-74.0"
+    assert (b["latitude"], b["longitude"]) == (40.7, -74.0)
+    assert a["rurality_id"] is not None and b["rurality_id"] is not None
+    assert (a["rejection_reason"], b["rejection_reason"], c["rejection_reason"]) == (None, None, "unparseable latitude")
+    assert c["latitude"] == "north"
+
+def locations(size):
+    #coordinates with few enough digits to survive the 15 significant digits of the JSON output
+    df = random_locations(size).round(6)
+    return [{"sample": sample, "latitude": latitude, "longitude": longitude} for sample, latitude, longitude in df.itertuples(index = False)]
+
+@pytest.mark.parametrize("body, error", [
+    ([{"sample": "a", "latitude": 51.5}], "every location must contain sample, latitude and longitude (or sample and lat_lon)"),
+    ([{"latitude": 51.5, "longitude": -0.12}], "every location must contain sample, latitude and longitude (or sample and lat_lon)"),
+    (["a,51.5,-0.12"], "every location must be a JSON object"),
+    ("a,51.5,-0.12", "expected a list of locations")])
+def test_bad_requests(client, body, error):
+    response = client.post("/api/annotate", json = body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+def test_invalid_json(client):
+    response = client.post("/api/annotate", data = "[{", content_type = "application/json")
+    assert (response.status_code, response.get_json()) == (400, {"error": "the request body is not valid JSON"})
+    response = client.post("/api/annotate", data = '{"sample": "a", "lat_lon": "1,2"}\n{"sample"\n', content_type = "application/x-ndjson")
+    assert (response.status_code, response.get_json()) == (400, {"error": "line 2 is not valid JSON"})
+
+def test_json_ndjson_and_get_agree(client):
+    body = locations(200)
+    lines = ndjson(client.post("/api/annotate", json = body))
+    #locations come back in the order they were sent, each with its own annotation
+    assert [line["sample"] for line in lines] == [record["sample"] for record in body]
+    assert all(line["rejection_reason"] is None for line in lines)
+    assert ndjson(client.post("/api/annotate", json = {"locations": body})) == lines
+    ndjson_body = "".join(json.dumps(record) + "\n" for record in body)
+    assert ndjson(client.post("/api/annotate", data = ndjson_body, content_type = "application/x-ndjson")) == lines
+    for record, line in list(zip(body, lines))[:5]:
+        response = client.get("/api/annotate", query_string = record)
+        assert response.status_code == 200 and response.mimetype == "application/json"
+        assert response.get_json() == line
+    response = client.get("/api/annotate", query_string = {"sample": "a"})
+    assert response.status_code == 400
+
+def test_large_requests_are_streamed_in_blocks(client, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "API_BLOCK_ROWS", 64)
+    body = locations(300)
+    response = client.post("/api/annotate", json = body)
+    assert response.status_code == 200 and response.is_streamed
+    assert [line["sample"] for line in ndjson(response)] == [record["sample"] for record in body]
+    #a bad location after the first block can only end the stream with an error
+    body[200] = {"sample": "bad"}
+    lines = ndjson(client.post("/api/annotate", json = body))
+    assert len(lines) == 193 and lines[-1] == {"error": "every location must contain sample, latitude and longitude (or sample and lat_lon)"}
+
+def test_status(client):
+    client.post("/api/annotate", json = locations(10))
+    status = client.get("/api/status").get_json()
+    assert status["batches"] >= 1 and status["requests"] >= 1
+    assert "data_packet" in status
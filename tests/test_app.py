@@ -0,0 +1,83 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import random_locations
+from result_store import ResultStore
+
+def test_partial_results_grow_geometrically(dash_app, packet_resources, tmp_path, monkeypatch):
+    rows = 100000
+    path = tmp_path / "locations.csv"
+    random_locations(rows).to_csv(path, index = False)
+    monkeypatch.setattr(dash_app, "PARTIAL_RESULT_SECONDS", -1)
+    published = []
+    df = dash_app.parse_upload(str(path), "locations.csv", publish = published.append)
+    assert len(df) == rows
+    #partial results are the start of the final one, and rewriting them costs little more than the final write
+    assert [len(partial) for partial in published] == [5000, 10000, 15000, 25000, 40000, 60000, 90000]
+    for partial in published:
+        pd.testing.assert_frame_equal(partial, df.iloc[:len(partial)])
+    assert sum(len(partial) for partial in published) <= 3 * rows
+
+def test_first_request_starts_resources(dash_app, packet_resources):
+    #servers that import the app (gunicorn app:server) never run its __main__ block
+    assert dash_app.server is dash_app.app.server
+    response = dash_app.server.test_client().get("/health")
+    assert response.status_code == 200
+    assert packet_resources._thread is not None and packet_resources._thread.is_alive()
+
+@pytest.fixture
+def results(dash_app, packet_resources, tmp_path):
+    path = tmp_path / "locations.csv"
+    df = random_locations(2000)
+    df["latitude"] = df["latitude"].astype(object)
+    df.loc[[5, 6], "latitude"] = "bad"
+    df.to_csv(path, index = False)
+    return dash_app.parse_upload(str(path), "locations.csv")
+
+def test_summarise_results(dash_app, results):
+    summary = dash_app.summarise_results(results)
+    assert summary["rows"] == len(results)
+    for variable, histogram in summary["histograms"].items():
+        values = results[variable].dropna()
+        assert sum(histogram["counts"]) == len(values)
+        if variable in dash_app.CATEGORICAL_VARIABLES:
+            assert dict(zip(histogram["categories"], histogram["counts"])) == values.astype(str).value_counts().to_dict()
+        else:
+            assert len(histogram["edges"]) == len(histogram["counts"]) + 1 <= 101
+            assert histogram["edges"][0] == values.min() and histogram["edges"][-1] == values.max()
+    assert set(summary["histograms"]) == set(dash_app.version_info[dash_app.OMEINFO_DATA_VERSION]["data_info"]) & set(results.columns)
+
+def test_summary_is_stored_when_first_needed(dash_app, results, monkeypatch, tmp_path):
+    store = ResultStore(str(tmp_path / "results"))
+    monkeypatch.setattr(dash_app, "RESULT_STORE", store)
+    store.put("key", results)
+    assert store.get_summary("key") is None
+    assert dash_app.result_summary("key") == dash_app.summarise_results(store.get("key"))
+    assert store.get_summary("key") is not None
+    assert dash_app.result_summary("other") is None
+
+def test_filter_rows(dash_app, results):
+    filtered = dash_app.filter_rows(results, '{Population Density} ge 10 && {Rurality} contains "rural" && {missing} eq 1')
+    expected = results[(results["Population Density"] >= 10) & results["Rurality"].astype(str).str.contains("rural", regex = False)]
+    assert len(filtered) and filtered.index.equals(expected.index)
+    assert dash_app.filter_rows(results, "{sample} eq s10")["sample"].tolist() == ["s10"]
+    assert dash_app.filter_rows(results, "{rejection_reason} datestartswith unparseable")["sample"].tolist() == ["s5", "s6"]
+    assert dash_app.filter_rows(results, "").equals(results) and dash_app.filter_rows(results, None).equals(results)
+
+def test_table_page(dash_app, results):
+    sort_by = [{"column_id": "Rurality", "direction": "asc"}, {"column_id": "Population Density", "direction": "desc"}]
+    filter_query = "{Population Density} gt 1"
+    expected = results[results["Population Density"] > 1].sort_values(["Rurality", "Population Density"], ascending = [True, False], na_position = "last")
+    records, page_count = dash_app.table_page("key", results, 2, 8, sort_by, filter_query)
+    assert page_count == -(-len(expected) // 8)
+    assert [record["sample"] for record in records] == expected["sample"].iloc[16:24].tolist()
+    assert "rurality_id" not in records[0] and isinstance(records[0]["Tropospheric Nitrogen Dioxide Emissions"], str)
+    #the order is kept for paging through the same view, for a bounded number of views
+    assert ("key", json.dumps(sort_by), filter_query) in dash_app.TABLE_VIEWS
+    for i in range(20):
+        dash_app.table_page(f"key{i}", results, 0, 8, [], "")
+    assert len(dash_app.TABLE_VIEWS) == 16
+    records, page_count = dash_app.table_page("key", results, 0, 8, [], "{sample} eq none")
+    assert (records, page_count) == ([], 1)
@@ -0,0 +1,19 @@
+import asyncio
+import os
+
+import pandas as pd
+
+from conftest import ROOT, random_locations
+from omeinfo import get_s3_point_data, get_s3_point_data_async, load_legend
+
+def legends():
+    return load_legend(os.path.join(ROOT, "OMEinfo", "rurality_legend.txt")), load_legend(os.path.join(ROOT, "OMEinfo", "kg_legend.txt"))
+
+def test_async_matches_sync_with_latency(slow_packet_url):
+    rurality_def, kg_def = legends()
+    df = random_locations(3000, seed = 1)
+    expected = get_s3_point_data(df.copy(), "2.0.0", rurality_def, kg_def, user_url = slow_packet_url, tile_cache = False)
+    #the packet is larger than the 4 MB coalesced reads of the async source, so its tiles are fetched by concurrent requests
+    result = asyncio.run(get_s3_point_data_async(df.copy(), "2.0.0", rurality_def, kg_def, user_url = slow_packet_url, tile_cache = False, max_in_flight = 4))
+    pd.testing.assert_frame_equal(expected.drop(columns = "error"), result.drop(columns = "error"))
+    assert expected["error"].map(repr).tolist() == result["error"].map(repr).tolist()
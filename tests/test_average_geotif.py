@@ -0,0 +1,71 @@
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import average_geotif
+
+def write_rasters(directory, dtype, tiled, months = 5, shape = (70, 90), nodata = -9999):
+    rng = np.random.default_rng(3)
+    data = rng.integers(0, 1000, (months, *shape)).astype(dtype)
+    #nodata in one month, in every month, and (for floats) NaN
+    data[-1, 5:9, 10:30] = nodata
+    data[:, 60:, 80:] = nodata
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        data[0, 30, 40:45] = np.nan
+    profile = {"driver": "GTiff", "width": shape[1], "height": shape[0], "count": 1, "dtype": dtype, "nodata": nodata,
+               "crs": "EPSG:4326", "transform": from_origin(-180, 90, 1, 1)}
+    if tiled:
+        profile.update(tiled = True, blockxsize = 16, blockysize = 16)
+    paths = []
+    for month, band in enumerate(data):
+        path = str(directory / f"month_{month}.tif")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(band, 1)
+        paths.append(path)
+    return paths, data
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["average_geotif.py", *[str(arg) for arg in args]])
+    average_geotif.main()
+
+@pytest.mark.parametrize("dtype, tiled", [("float32", True), ("int16", False)])
+def test_average_matches_numpy(tmp_path, monkeypatch, dtype, tiled):
+    paths, data = write_rasters(tmp_path, dtype, tiled)
+    #windows smaller than the rasters and not a multiple of their blocks
+    run(monkeypatch, *paths, "--output_file", tmp_path / "mean.tif", "--std_file", tmp_path / "std.tif", "--workers", 2, "--block_size", 20)
+    values = data.astype("float64")
+    missing = np.isnan(values).any(axis = 0) | (data == -9999).any(axis = 0)
+    output_dtype = dtype if dtype == "float32" else "float64"
+    with rasterio.open(tmp_path / "mean.tif") as src:
+        assert src.dtypes[0] == output_dtype and np.isnan(src.nodata)
+        mean = src.read(1)
+    with rasterio.open(tmp_path / "std.tif") as src:
+        std = src.read(1)
+    assert missing.any() and not missing.all()
+    assert np.isnan(mean[missing]).all() and np.isnan(std[missing]).all()
+    np.testing.assert_allclose(mean[~missing], values.mean(axis = 0)[~missing].astype(output_dtype), rtol = 1e-6)
+    np.testing.assert_allclose(std[~missing], values.std(axis = 0)[~missing].astype(output_dtype), rtol = 1e-5)
+
+def test_averaging_windows_cover_the_raster(tmp_path):
+    for tiled in [True, False]:
+        paths, data = write_rasters(tmp_path, "float32", tiled, months = 1)
+        with rasterio.open(paths[0]) as src:
+            covered = np.zeros((src.height, src.width), dtype = int)
+            for window in average_geotif.averaging_windows(src, 20):
+                covered[window.toslices()] += 1
+                if tiled:
+                    #windows start on block boundaries
+                    assert window.col_off % 16 == 0 and window.row_off % 16 == 0
+                else:
+                    assert window.width == src.width
+        assert (covered == 1).all()
+
+def test_rasters_must_share_a_grid(tmp_path, monkeypatch):
+    paths, data = write_rasters(tmp_path, "float32", True, months = 2)
+    with rasterio.open(paths[1], "r+") as dst:
+        dst.transform = from_origin(-170, 90, 1, 1)
+    with pytest.raises(ValueError, match = "does not have the same size, bands, CRS and transform"):
+        run(monkeypatch, *paths, "--output_file", tmp_path / "mean.tif")
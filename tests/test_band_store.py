@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from conftest import random_locations, write_locations
+from omeinfo import BAND_STORE_METADATA, is_band_store, open_band_store, open_cog, prepare_local, sample_band_store, sample_points
+from test_sampling import coordinates
+
+def band_store(packet, tmp_path):
+    directory = str(tmp_path / "packet_bands")
+    prepare_local(["--source_data", packet, "--output_dir", directory])
+    return directory
+
+def test_band_store_matches_cog(packet, tmp_path):
+    directory = band_store(packet, tmp_path)
+    assert is_band_store(directory)
+    store = open_band_store(directory)
+    xs, ys = coordinates()
+    for indexes in [[1, 2, 3, 4, 5, 6], [1], [2, 3, 4]]:
+        with open_cog(packet) as (cog, range_source):
+            expected, expected_errors = sample_points(cog, xs, ys, indexes, range_source = range_source)
+        values, errors = sample_band_store(store, xs, ys, indexes)
+        assert [type(e) for e in errors] == [type(e) for e in expected_errors]
+        ok = np.array([e is None for e in errors])
+        #bit for bit, nodata (NaN) included
+        np.testing.assert_array_equal(values[ok].view("uint32"), expected[ok].view("uint32"))
+
+def test_unfinished_band_store_is_not_used(packet, tmp_path):
+    #the metadata file is written last, without it the directory is not a band store
+    directory = band_store(packet, tmp_path)
+    os.remove(os.path.join(directory, BAND_STORE_METADATA))
+    assert not is_band_store(directory)
+    assert not is_band_store(packet)
+
+def test_annotation_from_band_store_matches_cog(cli, packet, tmp_path):
+    directory = band_store(packet, tmp_path)
+    location_file = write_locations(tmp_path / "locations.tsv", random_locations(2000))
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "cog.tsv")
+    cli("--location_file", location_file, "--source_data", directory, "--output_file", "bands.tsv")
+    cog = pd.read_csv("cog.tsv", sep = "\t")
+    bands = pd.read_csv("bands.tsv", sep = "\t")
+    assert cog["Population Density"].isna().any()
+    pd.testing.assert_frame_equal(cog, bands)
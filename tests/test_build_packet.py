@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import build_packet
+from conftest import ROOT
+
+def write_raster(path, data, resolution, dtype, nodata = None):
+    profile = {"driver": "GTiff", "width": data.shape[1], "height": data.shape[0], "count": 1, "dtype": dtype, "nodata": nodata,
+               "crs": "EPSG:4326", "transform": from_origin(-180, 90, resolution, resolution)}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data.astype(dtype), 1)
+
+@pytest.fixture
+def sources(tmp_path):
+    #a float layer on the packet grid, and a coarser integer layer with nodata that is resampled onto it
+    rng = np.random.default_rng(4)
+    fine = rng.gamma(2, 10, (180, 360))
+    coarse = rng.integers(10, 31, (90, 180))
+    coarse[40:45, 100:120] = -200
+    write_raster(tmp_path / "fine.tif", fine, 1, "float32")
+    write_raster(tmp_path / "coarse.tif", coarse, 2, "int16", nodata = -200)
+    return fine.astype("float32"), coarse
+
+def write_spec(directory, **spec):
+    spec = {"output": "packet.tif", "grid": {"crs": "EPSG:4326", "bounds": [-180, -90, 180, 90], "resolution": 1}, "nodata": "nan",
+            "cog": {"blocksize": 64}, "bands": [{"name": "fine", "source": "fine.tif"}, {"name": "coarse", "source": "coarse.tif", "dtype": "int16"}], **spec}
+    path = directory / "spec.json"
+    path.write_text(json.dumps(spec))
+    return str(path)
+
+def test_build_packet(sources, tmp_path, monkeypatch):
+    fine, coarse = sources
+    #paths in the spec are relative to it, not to the working directory
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(sys, "argv", ["build_packet.py", write_spec(tmp_path), "--threads", "2"])
+    build_packet.main()
+    with rasterio.open(tmp_path / "packet.tif") as src:
+        assert src.driver == "GTiff" and src.count == 2 and src.dtypes == ("float32", "float32")
+        assert src.descriptions == ("fine", "coarse")
+        assert src.block_shapes[0] == (64, 64) and src.overviews(1)
+        assert np.isnan(src.nodata)
+        assert src.transform == from_origin(-180, 90, 1, 1) and (src.width, src.height) == (360, 180)
+        data = src.read()
+    np.testing.assert_array_equal(data[0], fine)
+    #nearest neighbour onto a grid of half the resolution repeats every pixel, nodata becomes NaN
+    expected = np.repeat(np.repeat(coarse, 2, axis = 0), 2, axis = 1).astype("float32")
+    expected[expected == -200] = np.nan
+    np.testing.assert_array_equal(data[1], expected)
+    #nothing is left behind but the packet
+    assert sorted(os.listdir(tmp_path)) == ["coarse.tif", "fine.tif", "packet.tif", "spec.json"]
+
+def test_packet_on_the_grid_of_a_source(sources, tmp_path):
+    spec = build_packet.load_spec(write_spec(tmp_path, grid = {"like": "coarse.tif"}, nodata = -200, dtype = "int16", bands = [{"source": "coarse.tif"}]))
+    output = build_packet.build_packet(spec, output = str(tmp_path / "coarse_packet.tif"))
+    with rasterio.open(output) as src:
+        assert src.dtypes == ("int16",) and src.nodata == -200
+        assert src.descriptions == ("coarse.tif",)
+        assert (src.width, src.height) == (180, 90)
+        np.testing.assert_array_equal(src.read(1), sources[1])
+
+def test_packet_dtype():
+    assert build_packet.packet_dtype([{"dtype": "uint8"}, {"dtype": "int16"}]) == "int16"
+    assert build_packet.packet_dtype([{"dtype": "uint8"}, {}]) == "float32"
+    assert build_packet.packet_dtype([{"dtype": "int16"}, {"dtype": "float64"}]) == "float64"
+
+def test_cog_options():
+    cog = {**build_packet.COG_DEFAULTS, "predictor": "yes", "level": 9, "creation_options": {"sparse_ok": "TRUE"}}
+    options = build_packet.cog_options(cog, threads = 4)
+    assert options == {"BLOCKSIZE": 512, "COMPRESS": "DEFLATE", "INTERLEAVE": "PIXEL", "OVERVIEWS": "AUTO", "OVERVIEW_RESAMPLING": "NEAREST",
+                       "NUM_THREADS": 4, "BIGTIFF": "IF_SAFER", "PREDICTOR": "YES", "LEVEL": "9", "SPARSE_OK": "TRUE"}
+
+def test_v2_spec():
+    spec = build_packet.load_spec(os.path.join(ROOT, "OMEinfo", "data_packet_creation", "omeinfo_v2_packet.json"))
+    #the bands in the order omeinfo.py reads them
+    assert [band["name"] for band in spec["bands"]] == ["population_density", "rurality", "koppen_geiger", "relative_deprivation", "co2", "no2"]
+    assert all(os.path.isabs(band["source"]) for band in spec["bands"])
+    crs, transform, width, height = build_packet.target_grid(spec["grid"])
+    assert (width, height) == (43200, 21600)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import random_locations, write_locations
+
+def locations(tmp_path, size = 1000):
+    df = random_locations(size)
+    df["latitude"] = df["latitude"].astype(object)
+    df.loc[[3, size // 2], "latitude"] = "bad"
+    df.loc[[7], "sample"] = np.nan
+    return write_locations(tmp_path / "locations.tsv", df)
+
+def read(path):
+    return pd.read_csv(path, sep = "\t")
+
+@pytest.mark.parametrize("args", [[], ["--chunksize", 100]])
+def test_no_locations(cli, packet, capsys, args):
+    with pytest.raises(ValueError, match = "No locations provided"):
+        cli("--source_data", packet, *args)
+    assert "No locations provided. Exiting." in capsys.readouterr().out
+
+def test_chunked_run_matches_single_pass(cli, packet, tmp_path):
+    location_file = locations(tmp_path)
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "single.tsv")
+    #chunks that do not divide the file evenly
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "chunked.tsv", "--chunksize", 333)
+    pd.testing.assert_frame_equal(read("single.tsv"), read("chunked.tsv"))
+    pd.testing.assert_frame_equal(read("single_rejected.tsv"), read("chunked_rejected.tsv"))
+    #in chunked runs --location is a chunk of its own after the file
+    cli("--location_file", location_file, "--location", "extra,51.5,-0.1", "--source_data", packet, "--output_file", "single_location.tsv")
+    cli("--location_file", location_file, "--location", "extra,51.5,-0.1", "--source_data", packet, "--output_file", "chunked_location.tsv", "--chunksize", 333)
+    pd.testing.assert_frame_equal(read("single_location.tsv"), read("chunked_location.tsv"))
+    assert read("chunked_location.tsv")["sample"].iloc[-1] == "extra"
+
+def test_workers_keep_input_order(cli, packet, tmp_path):
+    #shards are annotated in spatial order by two processes, the output must still follow the input
+    location_file = locations(tmp_path, size = 3000)
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "serial.tsv")
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "workers.tsv", "--workers", 2)
+    pd.testing.assert_frame_equal(read("serial.tsv"), read("workers.tsv"))
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "workers_chunked.tsv", "--workers", 2, "--chunksize", 1000)
+    pd.testing.assert_frame_equal(read("serial.tsv"), read("workers_chunked.tsv"))
+    pd.testing.assert_frame_equal(read("serial_rejected.tsv"), read("workers_chunked_rejected.tsv"))
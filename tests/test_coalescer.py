@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from omeinfo import Coalescer
+
+class Recorder:
+    #a batch processing function that doubles every value and records the batches it was given
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, requests):
+        self.batches.append(requests)
+        if any("bad" in request for request in requests):
+            raise ValueError("bad location")
+        return [[2 * value for value in request] for request in requests]
+
+def test_concurrent_requests_share_a_batch():
+    process = Recorder()
+    coalescer = Coalescer(process, window = 0.5)
+    requests = [[i, i + 1] for i in range(0, 20, 2)]
+    with ThreadPoolExecutor(len(requests)) as pool:
+        futures = list(pool.map(coalescer.submit, requests))
+    #every caller gets the result of its own request
+    assert [future.result(10) for future in futures] == [[2 * i, 2 * i + 2] for i in range(0, 20, 2)]
+    assert len(process.batches) == 1 and sorted(process.batches[0]) == requests
+    assert (coalescer.batches, coalescer.requests) == (1, len(requests))
+
+def test_full_batches_do_not_wait_for_the_window():
+    process = Recorder()
+    coalescer = Coalescer(process, window = 30, max_rows = 4)
+    start = time.monotonic()
+    futures = [coalescer.submit([i, i]) for i in range(4)]
+    assert [future.result(10) for future in futures] == [[2 * i, 2 * i] for i in range(4)]
+    assert time.monotonic() - start < 10
+    #rows are counted with size
+    coalescer = Coalescer(process, window = 30, max_rows = 3, size = lambda request: 1)
+    futures = [coalescer.submit([i, i]) for i in range(3)]
+    assert [future.result(10) for future in futures] == [[2 * i, 2 * i] for i in range(3)]
+
+def test_a_failed_request_fails_alone():
+    process = Recorder()
+    coalescer = Coalescer(process, window = 0.5)
+    futures = [coalescer.submit(request) for request in [[1], ["bad"], [3]]]
+    assert futures[0].result(10) == [2] and futures[2].result(10) == [6]
+    with pytest.raises(ValueError, match = "bad location"):
+        futures[1].result(10)
+    #the whole batch, then each request on its own
+    assert process.batches == [[[1], ["bad"], [3]], [[1]], [["bad"]], [[3]]]
+    assert (coalescer.batches, coalescer.requests) == (2, 2)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import uuid
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+import cog_creator
+
+BUCKET = "testbucket"
+PART_SIZE = cog_creator.MIN_PART_SIZE
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name = "eu-north-1")
+        client.create_bucket(Bucket = BUCKET, CreateBucketConfiguration = {"LocationConstraint": "eu-north-1"})
+        yield client
+
+@pytest.fixture
+def cog(tmp_path):
+    #three parts: two full ones and a short last one
+    path = tmp_path / "packet.tif"
+    path.write_bytes(os.urandom(2 * PART_SIZE + 1234))
+    return str(path)
+
+def publish(path, client):
+    return cog_creator.publish_cog(path, BUCKET, "packet.tif", data_version = "2.0.0", part_size = PART_SIZE, threads = 1, client = client)
+
+def interrupt_at_part(monkeypatch, number):
+    upload_part = cog_creator.upload_part
+    def interrupted(*args):
+        if args[5] == number:
+            raise ConnectionError("connection lost")
+        return upload_part(*args)
+    monkeypatch.setattr(cog_creator, "upload_part", interrupted)
+
+def count_parts(monkeypatch):
+    uploaded = []
+    upload_part = cog_creator.upload_part
+    def counting(*args):
+        uploaded.append(args[5])
+        return upload_part(*args)
+    monkeypatch.setattr(cog_creator, "upload_part", counting)
+    return uploaded
+
+def test_interrupted_upload_resumes(s3, cog, monkeypatch):
+    interrupt_at_part(monkeypatch, 2)
+    with pytest.raises(ConnectionError):
+        publish(cog, s3)
+    assert os.path.exists(f"{cog}.upload.json")
+    monkeypatch.undo()
+    uploaded = count_parts(monkeypatch)
+    manifest = publish(cog, s3)
+    #only the part that failed is sent again
+    assert uploaded == [2]
+    with open(cog, "rb") as f:
+        data = f.read()
+    body = s3.get_object(Bucket = BUCKET, Key = "packet.tif")["Body"].read()
+    assert hashlib.sha256(body).hexdigest() == hashlib.sha256(data).hexdigest() == manifest["sha256"]
+    assert manifest["size"] == len(data)
+    assert manifest["parts"] == 3
+    assert manifest["part_size"] == PART_SIZE
+    assert manifest["data_version"] == "2.0.0"
+    assert manifest["etag"] == s3.head_object(Bucket = BUCKET, Key = "packet.tif")["ETag"].strip('"')
+    with open(f"{cog}.manifest.json") as f:
+        assert json.load(f) == manifest
+    assert json.loads(s3.get_object(Bucket = BUCKET, Key = "packet.tif.manifest.json")["Body"].read()) == manifest
+    assert not os.path.exists(f"{cog}.upload.json")
+    assert s3.list_multipart_uploads(Bucket = BUCKET).get("Uploads", []) == []
+
+def test_changed_file_starts_a_new_upload(s3, cog, monkeypatch):
+    interrupt_at_part(monkeypatch, 2)
+    with pytest.raises(ConnectionError):
+        publish(cog, s3)
+    monkeypatch.undo()
+    with open(cog, "ab") as f:
+        f.write(b"more data")
+    uploaded = count_parts(monkeypatch)
+    manifest = publish(cog, s3)
+    assert sorted(uploaded) == [1, 2, 3]
+    assert manifest["size"] == 2 * PART_SIZE + 1234 + len(b"more data")
+    #the interrupted upload of the old file was aborted
+    assert s3.list_multipart_uploads(Bucket = BUCKET).get("Uploads", []) == []
+
+class KMSLikeClient:
+    #the moto client, but with the ETags S3 gives data encrypted with KMS: not the md5 of the data, and
+    #no SHA256 checksum reported for the object
+    def __init__(self, client):
+        self.client = client
+        self.etags = {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def upload_part(self, **kwargs):
+        response = self.client.upload_part(**kwargs)
+        etag = f'"{uuid.uuid4().hex}"'
+        self.etags[etag] = response["ETag"]
+        return {**response, "ETag": etag}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        parts = [{**part, "ETag": self.etags[part["ETag"]]} for part in MultipartUpload["Parts"]]
+        return self.client.complete_multipart_upload(MultipartUpload = {"Parts": parts}, **kwargs)
+
+    def head_object(self, **kwargs):
+        head = self.client.head_object(**kwargs)
+        head.pop("ChecksumSHA256", None)
+        return {**head, "ETag": f'"{uuid.uuid4().hex}-3"', "ServerSideEncryption": "aws:kms"}
+
+def test_upload_to_kms_encrypted_bucket(s3, cog):
+    manifest = publish(cog, KMSLikeClient(s3))
+    with open(cog, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == manifest["sha256"]
+    body = s3.get_object(Bucket = BUCKET, Key = "packet.tif")["Body"].read()
+    assert hashlib.sha256(body).hexdigest() == manifest["sha256"]
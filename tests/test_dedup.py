@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+import omeinfo
+
+from conftest import RESOLUTION, random_locations, write_locations
+from omeinfo import SamplingStats, open_cog, sample_points, unique_pixels
+
+def test_unique_pixels():
+    rows = np.array([5, 0, 5, 2, 0, 5])
+    cols = np.array([1, 3, 1, 2, 3, 0])
+    stats = SamplingStats()
+    unique_rows, unique_cols, pixel_of_point = unique_pixels(rows, cols, 10, stats)
+    assert len(unique_rows) == 4
+    np.testing.assert_array_equal(unique_rows[pixel_of_point], rows)
+    np.testing.assert_array_equal(unique_cols[pixel_of_point], cols)
+    assert (stats.locations, stats.pixels) == (0, 4)
+
+def test_repeated_pixels_are_sampled_once(packet):
+    #replicates of every site, and points spread within one pixel of each site
+    sites = random_locations(200)
+    xs = np.repeat(sites["longitude"].to_numpy(), 5)
+    ys = np.repeat(sites["latitude"].to_numpy(), 5)
+    centres_x = -180 + (np.floor((xs + 180) / RESOLUTION) + 0.5) * RESOLUTION
+    centres_y = 90 - (np.floor((90 - ys) / RESOLUTION) + 0.5) * RESOLUTION
+    offsets = np.random.default_rng(1).uniform(-0.4, 0.4, (2, len(xs))) * RESOLUTION
+    xs, ys = centres_x + offsets[0], centres_y + offsets[1]
+    stats = SamplingStats()
+    with open_cog(packet) as (cog, range_source):
+        values, errors = sample_points(cog, xs, ys, [1, 2, 3, 4, 5, 6], stats = stats)
+        singles = [sample_points(cog, xs[i:i + 1], ys[i:i + 1], [1, 2, 3, 4, 5, 6])[0][0] for i in range(len(xs))]
+    assert errors == [None] * len(xs)
+    assert stats.pixels == len(pd.unique(pd.Series(list(zip(centres_x, centres_y)))))
+    assert stats.pixels <= len(sites)
+    np.testing.assert_array_equal(values.view("uint32"), np.array(singles).view("uint32"))
+
+def test_cli_reports_deduplication(cli, packet, tmp_path, capsys, monkeypatch):
+    #the counts are kept for the whole process, which every test shares
+    monkeypatch.setattr(omeinfo, "SAMPLING_STATS", SamplingStats())
+    df = random_locations(100)
+    df = pd.concat([df, df.assign(sample = df["sample"] + "_replicate")], ignore_index = True)
+    location_file = write_locations(tmp_path / "locations.tsv", df)
+    cli("--location_file", location_file, "--source_data", packet)
+    assert "Deduplication: 200 locations sampled as 100 unique pixels (2.0x)" in capsys.readouterr().out
+    output = pd.read_csv("annotated_locations.tsv", sep = "\t").drop(columns = "sample")
+    pd.testing.assert_frame_equal(output.iloc[:100], output.iloc[100:].reset_index(drop = True))
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from jobs import JobQueue
+
+def wait(job, timeout = 10):
+    deadline = time.time() + timeout
+    while job.state not in ("done", "failed", "cancelled"):
+        assert time.time() < deadline, f"job {job.job_id} still {job.state}"
+        time.sleep(0.01)
+    return job.status()
+
+def test_job_runs_with_progress():
+    queue = JobQueue(workers = 1)
+    started = threading.Event()
+    release = threading.Event()
+    def annotate(job, rows):
+        job.progress(0, rows)
+        job.progress(rows // 2)
+        started.set()
+        release.wait(10)
+        job.progress(rows)
+    job = queue.submit("job", annotate, 100)
+    assert started.wait(10)
+    status = queue.status("job")
+    assert (status["state"], status["rows_done"], status["rows_total"]) == ("running", 50, 100)
+    assert status["eta_seconds"] is not None
+    release.set()
+    status = wait(job)
+    assert (status["state"], status["rows_done"], status["message"]) == ("done", 100, None)
+    assert status["eta_seconds"] is None
+    assert queue.status("other") is None
+
+def test_failed_job_keeps_its_message():
+    queue = JobQueue(workers = 1)
+    def annotate(job):
+        raise ValueError("No locations provided")
+    status = wait(queue.submit("job", annotate))
+    assert (status["state"], status["message"]) == ("failed", "No locations provided")
+
+def test_running_and_queued_jobs_are_cancelled():
+    queue = JobQueue(workers = 1)
+    started = threading.Event()
+    calls = []
+    def annotate(job):
+        calls.append(job.job_id)
+        started.set()
+        while True:
+            job.progress(job.rows_done + 1)
+            time.sleep(0.01)
+    running = queue.submit("running", annotate)
+    queued = queue.submit("queued", annotate)
+    assert started.wait(10)
+    assert queue.cancel("queued") and queue.cancel("running")
+    assert wait(running)["state"] == "cancelled"
+    assert wait(queued)["state"] == "cancelled"
+    #the queued job never started
+    assert calls == ["running"]
+    assert not queue.cancel("other")
+
+def test_resubmitting_a_job_id():
+    queue = JobQueue(workers = 2)
+    release = threading.Event()
+    calls = []
+    def annotate(job):
+        calls.append(job.job_id)
+        release.wait(10)
+    job = queue.submit("job", annotate)
+    #the same upload submitted while it is still being annotated joins the existing job
+    assert queue.submit("job", annotate) is job
+    release.set()
+    wait(job)
+    #a finished job can be run again
+    again = queue.submit("job", annotate)
+    assert again is not job
+    wait(again)
+    assert calls == ["job", "job"]
+
+def test_finished_jobs_are_forgotten():
+    queue = JobQueue(workers = 1, keep = 0)
+    job = queue.submit("old", lambda job: None)
+    wait(job)
+    time.sleep(0.01)
+    wait(queue.submit("new", lambda job: None))
+    assert queue.get("old") is None and queue.get("new") is not None
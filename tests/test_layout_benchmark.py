@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import rasterio
+
+import layout_benchmark
+from conftest import random_locations
+from omeinfo import get_s3_point_data
+
+@pytest.mark.parametrize("name", sorted(layout_benchmark.LAYOUTS))
+def test_layouts_keep_the_packet(packet, tmp_path, name):
+    layout = layout_benchmark.LAYOUTS[name]
+    path = layout_benchmark.write_layout(packet, str(tmp_path / f"{name}.tif"), layout)
+    with rasterio.open(packet) as src:
+        expected = src.read()
+    with rasterio.open(path) as dst:
+        assert dst.block_shapes[0] == (layout["blocksize"], layout["blocksize"])
+        assert dst.profile.get("interleave") == layout.get("interleave", "pixel")
+        assert dst.compression is None if layout["compress"] == "none" else dst.compression is not None
+        #every layout is lossless
+        np.testing.assert_array_equal(dst.read(), expected)
+
+def test_layouts_annotate_alike(packet, tmp_path):
+    df = random_locations(500)
+    expected = get_s3_point_data(df.copy(), "2.0.0", {}, {}, user_url = packet, tile_cache = False)
+    server = layout_benchmark.serve(str(tmp_path))
+    try:
+        for name in ["band_512_deflate", "pixel_128_zstd"]:
+            layout_benchmark.write_layout(packet, str(tmp_path / f"{name}.tif"), layout_benchmark.LAYOUTS[name])
+            url = f"http://127.0.0.1:{server.server_address[1]}/{name}.tif"
+            annotated = get_s3_point_data(df.copy(), "2.0.0", {}, {}, user_url = url, tile_cache = False)
+            assert annotated.drop(columns = "error").equals(expected.drop(columns = "error"))
+    finally:
+        server.shutdown()
+
+def test_locations():
+    rng = np.random.default_rng(0)
+    for distribution in ["uniform", "clustered", "dense"]:
+        df = layout_benchmark.locations(distribution, 2000, rng)
+        assert len(df) == 2000 and df["sample"].is_unique
+        assert df["latitude"].between(-90, 90).all() and df["longitude"].between(-180, 180).all()
+    #dense locations share tiles, uniform ones hardly do
+    tiles = {distribution: len(set(zip(*np.floor(layout_benchmark.locations(distribution, 2000, np.random.default_rng(0))[["latitude", "longitude"]].to_numpy().T))))
+             for distribution in ["uniform", "dense"]}
+    assert tiles["dense"] < 50 < tiles["uniform"]
+
+def test_benchmark(packet, tmp_path, monkeypatch):
+    layouts = tmp_path / "layouts.json"
+    layouts.write_text(json.dumps({"small": {"blocksize": 64, "compress": "deflate"}, "large": {"blocksize": 256, "compress": "deflate"}}))
+    output = tmp_path / "results.json"
+    monkeypatch.setattr(sys, "argv", ["layout_benchmark.py", packet, "--layouts", str(layouts), "--distributions", "uniform,dense",
+                                      "--sizes", "100", "--repeats", "1", "--output", str(output), "--work_dir", str(tmp_path / "layouts")])
+    layout_benchmark.main()
+    with open(output) as f:
+        results = json.load(f)
+    assert results["layouts"]["small"]["block_shape"] == [64, 64] and results["layouts"]["large"]["block_shape"] == [256, 256]
+    assert [(run["layout"], run["distribution"], run["size"]) for run in results["runs"]] == [
+        ("small", "uniform", 100), ("small", "dense", 100), ("large", "uniform", 100), ("large", "dense", 100)]
+    for run in results["runs"]:
+        assert run["requests"] > 0 and run["bytes_fetched"] > 0 and run["lookups_per_second"] > 0
+    runs = {(run["layout"], run["distribution"]): run for run in results["runs"]}
+    #smaller tiles mean fewer bytes per lookup
+    assert runs["small", "uniform"]["bytes_fetched"] < runs["large", "uniform"]["bytes_fetched"]
+    assert sorted(os.listdir(tmp_path / "layouts")) == ["large.tif", "small.tif"]
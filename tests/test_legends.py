@@ -0,0 +1,65 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import ROOT
+from omeinfo import Legend, add_legend_labels, load_legend
+
+LEGENDS = ["rurality_legend.txt", "kg_legend.txt"]
+
+def old_legend(path):
+    #how legends were read before Legend: a tab separated file into a {str(id): definition} dict
+    definitions = pd.read_csv(path, sep = "\t")
+    definitions["id"] = definitions["id"].astype("str")
+    return definitions.set_index("id")["definition"].to_dict()
+
+def tab_separated(path, tmp_path):
+    #the first rows of kg_legend.txt are separated by spaces, which the old reader did not split
+    copy = tmp_path / os.path.basename(path)
+    with open(path) as f:
+        copy.write_text(re.sub(r" {2,}", "\t", f.read()))
+    return str(copy)
+
+def legend_ids(definitions):
+    #every id of the legend, ids it does not have and ids beyond its end
+    ids = [int(i) for i in definitions]
+    return pd.Series(ids + [max(ids) + 1, max(ids) + 100, 9999] + [i for i in range(0, max(ids)) if i not in ids])
+
+def assert_same_labels(labels, expected):
+    #the old labels are strings (of pandas' string dtype), Legend labels an object column
+    pd.testing.assert_series_equal(labels, expected, check_names = False, check_dtype = False)
+
+@pytest.mark.parametrize("name", LEGENDS)
+def test_load_legend_reads_legend_files_as_before(name, tmp_path):
+    path = os.path.join(ROOT, "OMEinfo", name)
+    old = old_legend(tab_separated(path, tmp_path))
+    ids = legend_ids(old)
+    assert_same_labels(load_legend(path).labels(ids), ids.astype(str).map(old))
+
+def test_space_separated_rows_are_read():
+    legend = load_legend(os.path.join(ROOT, "OMEinfo", "kg_legend.txt"))
+    assert legend.labels(pd.Series([0, 1, 2])).tolist() == ["No Data", "Tropical, rainforest", "Tropical, monsoon"]
+
+@pytest.mark.parametrize("name", LEGENDS)
+def test_labels_match_dict_labels(name, tmp_path):
+    old = old_legend(tab_separated(os.path.join(ROOT, "OMEinfo", name), tmp_path))
+    ids = legend_ids(old)
+    expected = ids.astype(str).map(old)
+    #a legend given as a dict is compiled the same way
+    assert_same_labels(Legend.from_dict(old).labels(ids), expected)
+    #float ids (failed rows are NaN) and nullable integer ids get the labels of the integer ids
+    float_ids = pd.concat([ids.astype("float64"), pd.Series([np.nan, 1.5, -1.0])], ignore_index = True)
+    float_expected = pd.concat([expected, pd.Series([np.nan] * 3, dtype = object)], ignore_index = True)
+    assert_same_labels(Legend.from_dict(old).labels(float_ids), float_expected)
+    assert_same_labels(Legend.from_dict(old).labels(ids.astype("Int64")), expected)
+
+def test_add_legend_labels():
+    df = pd.DataFrame({"rurality_id": [10, 30, np.nan], "koppen_geiger_id": [1, 29, 99]})
+    df = add_legend_labels(df, load_legend(os.path.join(ROOT, "OMEinfo", "rurality_legend.txt")), {"1": "Tropical, rainforest", "29": "Polar, frost"})
+    assert df["Rurality"].tolist()[:2] == ["water", "urban centre"]
+    assert pd.isna(df["Rurality"].iloc[2])
+    assert df["Koppen Geiger"].tolist()[:2] == ["Tropical, rainforest", "Polar, frost"]
+    assert pd.isna(df["Koppen Geiger"].iloc[2])
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from omeinfo import count_rejections, filter_locations, parse_coordinates, split_lat_lon
+
+@pytest.mark.parametrize("value, hemispheres, expected", [
+    ("51.5074", "NS", 51.5074),
+    ("-0.1275", "EW", -0.1275),
+    ("51°30'26\"N", "NS", 51 + 30 / 60 + 26 / 3600),
+    ("51 30 26 N", "NS", 51 + 30 / 60 + 26 / 3600),
+    ("N51:30:26", "NS", 51 + 30 / 60 + 26 / 3600),
+    ("33°51′54″S", "NS", -(33 + 51 / 60 + 54 / 3600)),
+    ("0d7m39sW", "EW", -(7 / 60 + 39 / 3600)),
+    ("0D7M39SW", "EW", -(7 / 60 + 39 / 3600)),
+    ("W 0 7 39", "EW", -(7 / 60 + 39 / 3600)),
+    ("0deg 7min 39sec W", "EW", -(7 / 60 + 39 / 3600)),
+    ("151 12.5 E", "EW", 151 + 12.5 / 60),
+    ("-0:7:39", "EW", -(7 / 60 + 39 / 3600)),
+])
+def test_parse_coordinates(value, hemispheres, expected):
+    assert parse_coordinates(pd.Series([value], dtype = object), hemispheres).iloc[0] == pytest.approx(expected)
+
+@pytest.mark.parametrize("value, hemispheres", [
+    ("0d7m39sW", "NS"),       #a longitude hemisphere for a latitude
+    ("51°30'26\"N", "EW"),
+    ("N51°30'26\"S", "NS"),   #two hemispheres
+    ("51 60 00 N", "NS"),     #minutes out of range
+    ("51 30 60 N", "NS"),     #seconds out of range
+    ("bad", "NS"),
+])
+def test_parse_coordinates_rejects(value, hemispheres):
+    assert np.isnan(parse_coordinates(pd.Series([value], dtype = object), hemispheres).iloc[0])
+
+def test_numeric_coordinates_pass_through():
+    values = pd.Series([51.5, -0.1275])
+    assert parse_coordinates(values, "NS") is values
+
+@pytest.mark.parametrize("value, latitude, longitude", [
+    ("51.5,-0.1", "51.5", "-0.1"),
+    (" 51.5 ; -0.1 ", "51.5", "-0.1"),
+    ("51 30 26 N, W 0 7 39", "51 30 26 N", "W 0 7 39"),
+    ("51°30'26\"N 0d7m39sW", "51°30'26\"N", "0d7m39sW"),
+])
+def test_split_lat_lon(value, latitude, longitude):
+    pairs = split_lat_lon(pd.Series([value]))
+    assert (pairs["latitude"].iloc[0], pairs["longitude"].iloc[0]) == (latitude, longitude)
+
+def test_split_lat_lon_leaves_single_values_unsplit():
+    pairs = split_lat_lon(pd.Series(["bad", "51.5", None], dtype = object))
+    assert pairs["latitude"].isna().all() and pairs["longitude"].isna().all()
+
+def test_filter_locations_rejection_reasons():
+    df = pd.DataFrame({"sample": ["ok", None, "a", "b", "c", "d", "e", "f"],
+                       "latitude": ["51.5", "51.5", None, "51.5", "north", "51.5", "91", "51.5"],
+                       "longitude": ["-0.1", "-0.1", "-0.1", None, "-0.1", "west", "-0.1", "181"]})
+    valid, rejected = filter_locations(df)
+    assert valid["sample"].tolist() == ["ok"]
+    assert valid[["latitude", "longitude"]].values.tolist() == [[51.5, -0.1]]
+    assert rejected["rejection_reason"].tolist() == ["missing sample", "missing latitude", "missing longitude", "unparseable latitude",
+                                                     "unparseable longitude", "latitude out of range", "longitude out of range"]
+    assert count_rejections(rejected) == (3, 4)
+
+def test_filter_locations_lat_lon_rejection_reasons():
+    df = pd.DataFrame({"sample": ["ok", "a", "b", "c"], "lat_lon": ["51°30'26\"N 0d7m39sW", "bad", "north,-0.1", None]})
+    valid, rejected = filter_locations(df)
+    assert valid["longitude"].tolist() == pytest.approx([-(7 / 60 + 39 / 3600)])
+    assert rejected["rejection_reason"].tolist() == ["unparseable coordinates", "unparseable latitude", "missing latitude"]
+    assert rejected["lat_lon"].iloc[:2].tolist() == ["bad", "north,-0.1"]
+
+def test_filter_locations_mixes_coordinate_columns():
+    #rows without latitude and longitude fall back to the combined column, by position
+    df = pd.DataFrame({"sample": ["a", "b"], "latitude": [None, "10"], "longitude": [None, "20"], "lat_lon": ["1,2", None]}, index = [0, 0])
+    valid, rejected = filter_locations(df)
+    assert valid[["latitude", "longitude"]].values.tolist() == [[1.0, 2.0], [10.0, 20.0]]
+    assert len(rejected) == 0
+
+def test_filter_locations_requires_columns():
+    with pytest.raises(KeyError):
+        filter_locations(pd.DataFrame({"sample": ["a"], "latitude": [1.0]}))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from result_store import ResultStore
+
+def samples(size, seed = 0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"sample": [f"s{i}" for i in range(size)], "latitude": rng.uniform(-60, 60, size), "longitude": rng.uniform(-179, 179, size),
+                         "rurality_id": rng.choice([10, 11, 30], size), "Population Density": rng.uniform(0, 100, size)})
+
+@pytest.fixture
+def map_limit(dash_app, monkeypatch):
+    monkeypatch.setattr(dash_app, "MAP_POINT_LIMIT", 500)
+    return 500
+
+def test_map_clusters(dash_app):
+    df = pd.DataFrame({"latitude": [1.0, 2.0, 3.0, -1.0], "longitude": [1.0, 3.0, 2.0, -1.0],
+                       "rurality_id": [10, 30, 30, 11], "Population Density": [1.0, 2.0, 6.0, 4.0]})
+    clusters = dash_app.map_clusters(df, "Population Density", 10).sort_values("count")
+    assert clusters["count"].tolist() == [1, 3]
+    assert clusters["latitude"].tolist() == [-1.0, 2.0] and clusters["longitude"].tolist() == [-1.0, 2.0]
+    assert clusters["value"].tolist() == [4.0, 3.0]
+    assert clusters["text"].iloc[1] == "3 samples<br>Population Density (mean): 3.0"
+    #the categorical ids are summarised by their most common class
+    clusters = dash_app.map_clusters(df, "rurality_id", 10).sort_values("count")
+    assert clusters["value"].tolist() == [11, 30]
+
+def test_small_sample_sets_are_drawn_whole(dash_app, map_limit):
+    df = samples(map_limit)
+    df.loc[0, "latitude"] = np.nan
+    trace = dash_app.map_figure(df, "Population Density").data[0]
+    #samples without coordinates are left off the map
+    assert len(trace.lat) == map_limit - 1
+    assert "sample: s1" in trace.hovertext[0]
+
+def test_large_sample_sets_are_clustered(dash_app, map_limit):
+    df = samples(20000)
+    markers = []
+    for zoom in [0, 2, 4]:
+        trace = dash_app.map_figure(df, "Population Density", zoom = zoom).data[0]
+        assert len(trace.lat) <= map_limit
+        markers.append(len(trace.lat))
+    #clusters get finer as the map is zoomed in
+    assert markers[0] < markers[1] <= markers[2]
+    cell = 22.5 / 2 ** 2
+    while len(dash_app.map_clusters(df, "Population Density", cell)) > map_limit:
+        cell *= 2
+    assert dash_app.map_clusters(df, "Population Density", cell)["count"].sum() == len(df)
+
+def test_samples_in_view_are_drawn_individually(dash_app, map_limit):
+    df = samples(20000)
+    trace = dash_app.map_figure(df, "Population Density", zoom = 6, bounds = (10, 10, 15, 15)).data[0]
+    in_view = df[df["longitude"].between(10, 15) & df["latitude"].between(10, 15)]
+    assert sorted(trace.lat) == sorted(in_view["latitude"])
+    #a view across the antimeridian
+    trace = dash_app.map_figure(df, "Population Density", zoom = 6, bounds = (177, 0, -177, 5)).data[0]
+    in_view = df[((df["longitude"] >= 177) | (df["longitude"] <= -177)) & df["latitude"].between(0, 5)]
+    assert len(in_view) and sorted(trace.lon) == sorted(in_view["longitude"])
+
+def test_zooming_redraws_large_results(dash_app, map_limit, monkeypatch, tmp_path):
+    store = ResultStore(str(tmp_path))
+    monkeypatch.setattr(dash_app, "RESULT_STORE", store)
+    store.put("small", samples(100))
+    store.put("large", samples(20000))
+    relayout = {"mapbox.zoom": 6, "mapbox.center": {"lon": 12.5, "lat": 12.5},
+                "mapbox._derived": {"coordinates": [[10, 15], [15, 15], [15, 10], [10, 10]]}}
+    assert dash_app.update_map_detail(relayout, "small", "Population Density") is dash_app.dash.no_update
+    assert dash_app.update_map_detail({"dragmode": "pan"}, "large", "Population Density") is dash_app.dash.no_update
+    trace = dash_app.update_map_detail(relayout, "large", "Population Density").data[0]
+    df = samples(20000)
+    assert len(trace.lat) == (df["longitude"].between(10, 15) & df["latitude"].between(10, 15)).sum()
@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+import pytest
+
+from conftest import ROOT, random_locations, write_locations
+from omeinfo import load_legend
+
+def locations(tmp_path):
+    df = random_locations(500)
+    #a location in the nodata patch of the packet, one on its (excluded) edge and one rejected
+    df.loc[10, ["latitude", "longitude"]] = [37.4, -64.9]
+    df.loc[11, ["latitude", "longitude"]] = [0, 180]
+    df["latitude"] = df["latitude"].astype(object)
+    df.loc[12, "latitude"] = "bad"
+    return write_locations(tmp_path / "locations.tsv", df)
+
+def read_tsv(path):
+    return pd.read_csv(path, sep = "\t")
+
+def test_parquet_schema(cli, packet, tmp_path):
+    location_file = locations(tmp_path)
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "annotated.parquet")
+    df = pd.read_parquet("annotated.parquet")
+    #rejected rows are always written as tsv
+    assert read_tsv("annotated_rejected.tsv")["sample"].tolist() == ["s12"]
+    for column in ["rurality_id", "koppen_geiger_id", "Relative Deprivation"]:
+        assert df[column].dtype == "Int16"
+    for column in ["Population Density", "Tropospheric Nitrogen Dioxide Emissions", "Fossil Fuel CO2 emissions"]:
+        assert df[column].dtype == "float32"
+    assert isinstance(df["sample"].dtype, pd.StringDtype)
+    #labels are categoricals over the whole legend, so every output has the same dictionary
+    for column, legend in [("Rurality", "rurality_legend.txt"), ("Koppen Geiger", "kg_legend.txt")]:
+        assert list(df[column].cat.categories) == list(load_legend(os.path.join(ROOT, "OMEinfo", legend)).categories)
+    assert list(df["error_code"].cat.categories) == ["point_outside_bounds", "nodata", "read_error"]
+    #s342 is one of the random locations falling in the nodata patch
+    codes = df.set_index("sample")["error_code"].dropna().astype(str)
+    assert codes.to_dict() == {"s10": "nodata", "s11": "point_outside_bounds", "s342": "nodata"}
+    #the same values as tsv output
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "annotated.tsv")
+    tsv = read_tsv("annotated.tsv")
+    assert df["sample"].tolist() == tsv["sample"].tolist()
+    pd.testing.assert_series_equal(df["Population Density"], tsv["Population Density"].astype("float32"))
+    pd.testing.assert_series_equal(df["rurality_id"], tsv["rurality_id"].astype("Int16"))
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow", "feather"])
+def test_chunked_columnar_output_is_a_directory_of_parts(cli, packet, tmp_path, output_format):
+    location_file = locations(tmp_path)
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", f"single.{output_format}")
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", f"chunked.{output_format}", "--chunksize", 200)
+    parts = sorted(os.listdir(f"chunked.{output_format}"))
+    assert parts == [f"part-{i:05d}.{output_format}" for i in range(3)]
+    read = pd.read_parquet if output_format == "parquet" else pd.read_feather
+    single = read(f"single.{output_format}")
+    chunked = pd.concat([read(os.path.join(f"chunked.{output_format}", part)) for part in parts], ignore_index = True)
+    pd.testing.assert_frame_equal(single, chunked)
+
+@pytest.mark.parametrize("args, output_file, rejected_file", [
+    (["--output_file", "annotated.tsv", "--compression", "gzip"], "annotated.tsv.gz", "annotated_rejected.tsv.gz"),
+    (["--output_file", "annotated.tsv.gz"], "annotated.tsv.gz", "annotated_rejected.tsv.gz"),
+    (["--output_file", "annotated.tsv.bz2", "--chunksize", 200], "annotated.tsv.bz2", "annotated_rejected.tsv.bz2"),
+    (["--output_file", "annotated.tsv", "--compression", "xz", "--rejected_file", "rejected.tsv"], "annotated.tsv.xz", "rejected.tsv.xz")])
+def test_compressed_tsv_naming(cli, packet, tmp_path, args, output_file, rejected_file):
+    location_file = locations(tmp_path)
+    cli("--location_file", location_file, "--source_data", packet, "--output_file", "plain.tsv")
+    cli("--location_file", location_file, "--source_data", packet, *args)
+    assert sorted(name for name in os.listdir() if name.startswith(("annotated", "rejected")) and not name.endswith(".checkpoint.json")) == sorted([output_file, rejected_file])
+    pd.testing.assert_frame_equal(read_tsv(output_file), read_tsv("plain.tsv"))
+    pd.testing.assert_frame_equal(read_tsv(rejected_file), read_tsv("plain_rejected.tsv"))
+
+def test_unavailable_compression(cli, packet, capsys):
+    with pytest.raises(SystemExit):
+        cli("--location", "a,51.5,-0.12", "--source_data", packet, "--output_file", "annotated.arrow", "--compression", "gzip")
+    assert "--compression gzip is not available for arrow output" in capsys.readouterr().err
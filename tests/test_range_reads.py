@@ -0,0 +1,67 @@
+import pandas as pd
+import rasterio
+
+from conftest import random_locations
+from omeinfo import HTTPRangeSource, get_s3_point_data, plan_range_reads
+
+def annotate(url, df, **kwargs):
+    return get_s3_point_data(df.copy(), "2.0.0", {}, {}, user_url = url, tile_cache = False, **kwargs)
+
+def assert_same_annotations(expected, result):
+    pd.testing.assert_frame_equal(expected.drop(columns = "error"), result.drop(columns = "error"))
+    assert expected["error"].map(repr).tolist() == result["error"].map(repr).tolist()
+
+def counting_factory(sources, **kwargs):
+    def range_source_factory(url):
+        source = HTTPRangeSource(url, **kwargs)
+        sources.append(source)
+        return source
+    return range_source_factory
+
+def header_requests(url):
+    #requests made to open the packet, before any tile is read
+    source = HTTPRangeSource(url)
+    with rasterio.open(url, opener = source.open):
+        pass
+    return source.requests
+
+def test_plan_range_reads_merges_overlapping_and_touching_ranges():
+    assert plan_range_reads([(0, 10), (5, 20), (20, 30)], max_gap = 0) == [(0, 30)]
+    assert plan_range_reads([(0, 100), (10, 20)], max_gap = 0) == [(0, 100)]
+
+def test_plan_range_reads_merges_across_small_gaps_only():
+    assert plan_range_reads([(0, 10), (15, 20)], max_gap = 5) == [(0, 20)]
+    assert plan_range_reads([(0, 10), (16, 20)], max_gap = 5) == [(0, 10), (16, 20)]
+
+def test_plan_range_reads_sorts_ranges():
+    assert plan_range_reads([(100, 110), (0, 10), (50, 60)], max_gap = 0) == [(0, 10), (50, 60), (100, 110)]
+
+def test_plan_range_reads_limits_request_size():
+    assert plan_range_reads([(0, 10), (10, 20), (20, 30)], max_gap = 0, max_request = 20) == [(0, 20), (20, 30)]
+    assert plan_range_reads([(0, 50)], max_gap = 0, max_request = 20) == [(0, 50)]
+
+def test_http_range_source_matches_local_read(packet, packet_url):
+    df = random_locations(2000)
+    assert_same_annotations(annotate(packet, df), annotate(packet_url, df))
+
+def test_clustered_points_are_read_in_one_request(packet, packet_url):
+    #all points in one 64 pixel (32 degree) tile
+    df = random_locations(500, latitude = (60, 85), longitude = (-175, -150))
+    sources = []
+    result = annotate(packet_url, df, range_source_factory = counting_factory(sources))
+    assert sources[0].requests == header_requests(packet_url) + 1
+    assert_same_annotations(annotate(packet, df), result)
+
+def test_adjacent_tiles_are_coalesced(packet, packet_url):
+    #points across the whole first row of tiles, which are stored one after the other
+    df = random_locations(500, latitude = (60, 85))
+    sources = []
+    annotate(packet_url, df, range_source_factory = counting_factory(sources))
+    assert sources[0].requests == header_requests(packet_url) + 1
+
+def test_small_buffer_fetches_in_batches(packet, packet_url):
+    df = random_locations(2000)
+    sources = []
+    result = annotate(packet_url, df, range_source_factory = counting_factory(sources, max_buffer = 16 * 1024))
+    assert sources[0].requests > header_requests(packet_url) + 1
+    assert_same_annotations(annotate(packet, df), result)
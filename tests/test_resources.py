@@ -0,0 +1,39 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import resources
+from conftest import ROOT
+
+def test_slow_load_does_not_block_readers(packet_url, monkeypatch):
+    started, finish = threading.Event(), threading.Event()
+    loads = []
+    warm_up = resources.warm_up
+    def slow_warm_up(url, source = None):
+        #a data packet fetch that hangs until the test lets it finish
+        loads.append(url)
+        started.set()
+        finish.wait(10)
+        warm_up(url, source)
+    monkeypatch.setattr(resources, "warm_up", slow_warm_up)
+    packet = resources.DataPacketResources("2.0.0", legend_dir = os.path.join(ROOT, "OMEinfo"), url_setting = lambda: packet_url)
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        requests = [executor.submit(packet.current) for _ in range(4)]
+        assert started.wait(10)
+        #while the packet loads, other callers get answers straight away
+        assert packet.status()["status"] == "loading"
+        assert packet.range_source_factory(packet_url).url == packet_url
+        assert not any(request.done() for request in requests)
+        finish.set()
+        results = [request.result(10) for request in requests]
+    assert all(url == packet_url and legends[0] and legends[1] for url, legends in results)
+    #the requests waiting for the load used its result rather than loading again
+    assert loads == [packet_url]
+
+def test_start_runs_one_health_thread(packet_url):
+    packet = resources.DataPacketResources("2.0.0", legend_dir = os.path.join(ROOT, "OMEinfo"), health_interval = 3600, url_setting = lambda: packet_url)
+    packet.start()
+    thread = packet._thread
+    packet.start()
+    assert packet._thread is thread and thread.is_alive()
+    assert packet.current()[0] == packet_url
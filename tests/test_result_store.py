@@ -0,0 +1,81 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from result_store import ResultStore, upload_key
+
+def frame():
+    return pd.DataFrame({"sample": ["a", "b", "c"], "latitude": [1.0, 2.0, 3.0], "error": [None, ValueError("outside"), np.nan]})
+
+def age(store, key, seconds):
+    #pretend key was last used seconds ago
+    then = time.time() - seconds
+    for path in [store._path(key), store._summary_path(key)]:
+        if os.path.exists(path):
+            os.utime(path, (then, then))
+
+def test_put_and_get(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.put("key", frame(), summary = {"rows": 3})
+    #read back from the file as well as from memory, errors are kept as their messages
+    for df in [store.get("key"), ResultStore(str(tmp_path)).get("key")]:
+        assert df["sample"].tolist() == ["a", "b", "c"]
+        assert df["error"].isna().tolist() == [True, False, True]
+        assert df["error"][1] == "outside"
+    assert store.get_summary("key") == {"rows": 3}
+    assert ResultStore(str(tmp_path)).get_summary("key") == {"rows": 3}
+    #callers get copies
+    df = store.get("key")
+    df["sample"] = "changed"
+    assert store.get("key")["sample"].tolist() == ["a", "b", "c"]
+    assert "key" in store
+    assert "other" not in store and store.get("other") is None and store.get_summary("other") is None
+    assert None not in store and store.get(None) is None
+
+def test_results_expire(tmp_path):
+    store = ResultStore(str(tmp_path), ttl = 60)
+    store.put("old", frame(), summary = {"rows": 3})
+    store.put("recent", frame())
+    age(store, "old", 120)
+    age(store, "recent", 30)
+    assert "old" not in store
+    assert store.get("old") is None
+    assert not os.path.exists(store._path("old")) and not os.path.exists(store._summary_path("old"))
+    #using a result keeps it
+    assert store.get("recent") is not None
+    assert time.time() - os.path.getmtime(store._path("recent")) < 5
+
+def test_evict(tmp_path):
+    store = ResultStore(str(tmp_path), ttl = 60)
+    store.put("old", frame(), summary = {"rows": 3})
+    store.put("used", frame(), summary = {"rows": 3})
+    unfinished = tmp_path / "unfinished.parquet.1.2.tmp"
+    unfinished.write_text("")
+    for path in [store._path("old"), store._summary_path("old"), store._summary_path("used"), str(unfinished)]:
+        os.utime(path, (time.time() - 120, time.time() - 120))
+    store.evict()
+    #summaries of results still in use are kept
+    assert sorted(os.listdir(tmp_path)) == ["used.json", "used.parquet"]
+
+def test_memory_is_bounded(tmp_path):
+    store = ResultStore(str(tmp_path), memory_items = 2)
+    for key in ["a", "b", "c"]:
+        store.put(key, frame())
+    assert list(store._frames) == ["b", "c"]
+    assert store.get("a") is not None
+    assert list(store._frames) == ["c", "a"]
+
+def test_discard(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.put("key", frame(), summary = {"rows": 3})
+    store.discard("key")
+    assert "key" not in store and store.get("key") is None and store.get_summary("key") is None
+    assert os.listdir(tmp_path) == []
+    store.discard("key")
+
+def test_upload_key():
+    assert upload_key("contents", "2.0.0", "url") == upload_key(b"contents", "2.0.0", "url")
+    assert upload_key("contents", "2.0.0", "url") != upload_key("contents", "1.0.0", "url")
+    assert upload_key("contents", "ab", "c") != upload_key("contents", "a", "bc")
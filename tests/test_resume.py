@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import omeinfo
+from conftest import random_locations, write_locations
+
+GET_S3_POINT_DATA = omeinfo.get_s3_point_data
+
+def locations(tmp_path):
+    #300 rows in chunks of 100, with rejected rows in every chunk
+    df = random_locations(300)
+    df["latitude"] = df["latitude"].astype(object)
+    df.loc[[5, 150, 299], "latitude"] = "bad"
+    df.loc[[10, 160], "sample"] = np.nan
+    return write_locations(tmp_path / "locations.tsv", df)
+
+def interrupt_at_chunk(monkeypatch, number):
+    calls = []
+    get_s3_point_data = omeinfo.get_s3_point_data
+    def interrupted(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == number:
+            raise KeyboardInterrupt
+        return get_s3_point_data(*args, **kwargs)
+    monkeypatch.setattr(omeinfo, "get_s3_point_data", interrupted)
+
+def run_interrupted(cli, monkeypatch, *args):
+    interrupt_at_chunk(monkeypatch, 3)
+    with pytest.raises(KeyboardInterrupt):
+        cli(*args)
+    monkeypatch.setattr(omeinfo, "get_s3_point_data", GET_S3_POINT_DATA)
+
+def truncate(path):
+    with open(path, "r+") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+@pytest.mark.parametrize("damage", [None, "remove output", "truncate output", "remove rejected", "truncate rejected"])
+def test_resume_tsv(cli, packet, tmp_path, monkeypatch, capsys, damage):
+    location_file = locations(tmp_path)
+    args = ["--location_file", location_file, "--source_data", packet, "--chunksize", 100]
+    cli(*args, "--output_file", "expected.tsv")
+    run_interrupted(cli, monkeypatch, *args, "--output_file", "out.tsv")
+    if damage:
+        action, name = damage.split()
+        (os.remove if action == "remove" else truncate)("out.tsv" if name == "output" else "out_rejected.tsv")
+    capsys.readouterr()
+    cli(*args, "--output_file", "out.tsv", "--resume")
+    log = capsys.readouterr().out
+    assert ("annotating again from the first row" in log) == bool(damage)
+    pd.testing.assert_frame_equal(pd.read_csv("expected.tsv", sep = "\t"), pd.read_csv("out.tsv", sep = "\t"))
+    pd.testing.assert_frame_equal(pd.read_csv("expected_rejected.tsv", sep = "\t"), pd.read_csv("out_rejected.tsv", sep = "\t"))
+    assert "295 samples analysed" in log
+    assert "Loaded locations: 300" in log
+
+def test_resume_columnar_with_missing_part(cli, packet, tmp_path, monkeypatch, capsys):
+    location_file = locations(tmp_path)
+    args = ["--location_file", location_file, "--source_data", packet, "--chunksize", 100]
+    cli(*args, "--output_file", "expected.parquet")
+    run_interrupted(cli, monkeypatch, *args, "--output_file", "out.parquet")
+    os.remove(os.path.join("out.parquet", "part-00000.parquet"))
+    capsys.readouterr()
+    cli(*args, "--output_file", "out.parquet", "--resume")
+    log = capsys.readouterr().out
+    assert "annotating again from the first row" in log
+    pd.testing.assert_frame_equal(pd.read_parquet("expected.parquet"), pd.read_parquet("out.parquet"))
+    assert "295 samples analysed" in log
@@ -0,0 +1,72 @@
+import os
+from contextlib import ExitStack
+
+import numpy as np
+import pytest
+from rio_tiler.io import Reader
+
+from conftest import ROOT, RESOLUTION, random_locations
+from omeinfo import OPEN_COGS, get_s3_point_data, keep_cog_open, load_legend, open_cog, sample_points
+
+def legends():
+    return load_legend(os.path.join(ROOT, "OMEinfo", "rurality_legend.txt")), load_legend(os.path.join(ROOT, "OMEinfo", "kg_legend.txt"))
+
+def annotate(url, df):
+    return get_s3_point_data(df.copy(), "2.0.0", *legends(), user_url = url, tile_cache = False)
+
+def test_kept_open_packet_is_forgotten_when_closed(packet):
+    df = random_locations(100)
+    with ExitStack() as stack:
+        keep_cog_open(packet, stack)
+        assert packet in OPEN_COGS
+        kept_open = annotate(packet, df)
+    assert packet not in OPEN_COGS
+    #later runs in the same process open the packet again rather than reusing the closed dataset
+    reopened = annotate(packet, df)
+    assert reopened["error"].isna().all()
+    assert kept_open.equals(reopened)
+
+def coordinates():
+    #random points, points on every pixel and tile boundary and just inside the edges of the grid, points
+    #on and outside its bounds, NaN coordinates, and points around the nodata patches of the packet
+    rng = np.random.default_rng(2)
+    xs = [rng.uniform(-180, 180, 1000)]
+    ys = [rng.uniform(-90, 90, 1000)]
+    boundaries = np.arange(-180, 180, RESOLUTION)
+    xs.append(boundaries)
+    ys.append(np.resize(np.arange(90, -90, -RESOLUTION), len(boundaries)))
+    edges = np.array([-180, 180, -180 + 1e-9, 180 - 1e-9, 0, 0, 0, 0, 181, np.nan, 10])
+    xs.append(edges)
+    ys.append(np.array([0, 0, 0, 0, 90, -90, 90 - 1e-9, -90 + 1e-9, 0, 10, np.nan]))
+    for rows, cols in [(range(99, 111), range(199, 261)), (range(299, 303), range(698, 720))]:
+        #pixel centres
+        grid_x, grid_y = np.meshgrid(-180 + (np.array(cols) + 0.5) * RESOLUTION, 90 - (np.array(rows) + 0.5) * RESOLUTION)
+        xs.append(grid_x.ravel())
+        ys.append(grid_y.ravel())
+    return np.concatenate(xs), np.concatenate(ys)
+
+def point_values(cog, xs, ys, indexes):
+    #what the original per-point loop read: cog.point for every coordinate
+    values = np.zeros((len(xs), len(indexes)), dtype = cog.dataset.dtypes[0])
+    errors = []
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        try:
+            values[i] = cog.point(x, y, coord_crs = "EPSG:4326", indexes = indexes).data
+            errors.append(None)
+        except Exception as e:
+            errors.append(type(e))
+    return values, errors
+
+@pytest.mark.parametrize("indexes", [[1, 2, 3, 4, 5, 6], [1], [2, 3, 4]])
+def test_sample_points_matches_point_reads(packet, packet_url, indexes):
+    xs, ys = coordinates()
+    with Reader(packet) as cog:
+        expected, expected_errors = point_values(cog, xs, ys, indexes)
+    assert np.isnan(expected).any() and expected_errors.count(None) < len(xs)
+    for url in [packet, packet_url]:
+        with open_cog(url) as (cog, range_source):
+            values, errors = sample_points(cog, xs, ys, indexes, range_source = range_source)
+        assert [type(e) if e is not None else None for e in errors] == expected_errors
+        ok = np.array([e is None for e in errors])
+        #bit for bit, nodata (NaN) included
+        np.testing.assert_array_equal(values[ok].view("uint32"), expected[ok].view("uint32"))
@@ -0,0 +1,27 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from omeinfo import MemoryTileCache, TileCache
+
+def test_tile_cache_is_thread_safe(tmp_path):
+    cache = TileCache(str(tmp_path), 64 * 1024 * 1024)
+    tile = np.arange(64 * 64, dtype = "float32").reshape(64, 64)
+    def put_and_get(i):
+        #every thread writes the same few tiles, so writes of one tile race each other
+        cache.put(("packet", i % 4), tile)
+        return cache.get(("packet", i % 4))
+    with ThreadPoolExecutor(max_workers = 16) as executor:
+        tiles = list(executor.map(put_and_get, range(2000)))
+    assert all(np.array_equal(result, tile) for result in tiles)
+    assert cache.hits == 2000 and cache.misses == 0
+    assert cache.bytes_read == 2000 * os.path.getsize(cache._path(("packet", 0)))
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+def test_memory_tile_cache_counts_every_lookup(tmp_path):
+    cache = MemoryTileCache(64 * 64 * 4 * 2, backing = TileCache(str(tmp_path), 64 * 1024 * 1024))
+    cache.put(("packet", 0), np.zeros((64, 64), dtype = "float32"))
+    with ThreadPoolExecutor(max_workers = 16) as executor:
+        list(executor.map(lambda i: cache.get(("packet", i % 2)), range(2000)))
+    assert cache.hits == 1000 and cache.misses == 1000